@@ -0,0 +1,146 @@
+import time
+
+# Client side action pipeline between the key bindings and ActionPublisher. Holding an arrow
+# key makes Tk fire the binding many times a second; instead of publishing every event only
+# the latest intent per turn window goes out:
+#
+#   - the first key event of a window is sent right away. Until the server acknowledges that
+#     action (a frame of ours whose last_action_seq reaches its seq) or the turn flips, later
+#     events only set the pending intent
+#   - a newer intent replaces the pending one (coalesced), the same intent again is an
+#     auto-repeat (debounced)
+#   - on the ack the pending intent is sent if it is still our turn. When the action ended
+#     the turn, as it does on a one-move-per-turn server, it is dropped: holding a key through
+#     a turn publishes one action. A server that does not echo last_action_seq never acks,
+#     then the pending intent goes out after ack_timeout_ms
+#   - intents that can not be sent (not our turn, game not started) are dropped, unless the
+#     input buffer is on (buffer_ms > 0): then, while the game is running, the latest one is
+#     kept and sent by turn_started() if the turn starts within buffer_ms of the key press
+#
+# Every published action gets the publisher's monotonic sequence id, on_send(action, seq) is
+# called after each one (the rotation preview hooks in there).
+
+
+class ActionPipeline:
+    def __init__(self, publisher, agent_id, schedule, can_send=None, ack_timeout_ms=1000, can_buffer=None,
+                 buffer_ms=0, on_send=None):
+        self.publisher = publisher
+        self.agent_id = agent_id
+        self.schedule = schedule  # root.after, the ack timeout runs on the Tk thread
+        self.can_send = can_send or (lambda: True)
+        self.ack_timeout_ms = ack_timeout_ms
+        self.can_buffer = can_buffer or (lambda: True)
+        self.buffer_window = buffer_ms / 1000
+        self.on_send = on_send
+        self.awaiting = None  # seq of the last action sent by submit(), until the server acks it
+        self.pending = None  # (action, time pressed) waiting for that ack
+        self.buffered = None  # (action, time pressed) waiting for our turn
+        self.submitted = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.debounced = 0
+        self.dropped = 0
+        self.acked = 0
+        self.ack_timeouts = 0
+        self.buffer_fired = 0
+        self.buffer_expired = 0
+        self.buffer_replaced = 0
+
+    def submit(self, action):
+        self.submitted += 1
+        now = time.perf_counter()
+        if not self.can_send():
+            self.hold(action, now)
+            return
+        if self.awaiting is None:
+            self.send(action, await_ack=True)
+            return
+        if self.pending is not None and self.pending[0] != action:
+            self.coalesced += 1
+        else:
+            self.debounced += 1
+        self.pending = (action, now)
+
+    def send_now(self, action):
+        # Actions that must never be merged with movement, e.g. the communication messages
+        self.submitted += 1
+        if not self.can_send():
+            self.dropped += 1
+            return
+        self.send(action)
+
+    def acknowledged(self, last_action_seq):
+        # Called with the last_action_seq of every frame of our agent, after its turn state
+        if self.awaiting is None or last_action_seq is None or last_action_seq < self.awaiting:
+            return
+        self.acked += 1
+        self.awaiting = None
+        self.release()
+
+    def ack_timeout(self, seq):
+        if self.awaiting != seq:
+            return
+        self.ack_timeouts += 1
+        self.awaiting = None
+        self.release()
+
+    def release(self):
+        # The window of the last action closed, send the latest intent if we still can
+        if self.pending is None:
+            return
+        action, pressed_at = self.pending
+        self.pending = None
+        if self.can_send():
+            self.send(action, await_ack=True)
+        else:
+            self.hold(action, pressed_at)
+
+    def hold(self, action, pressed_at):
+        if not self.buffer_window or not self.can_buffer():
+            self.dropped += 1
+            return
+        if self.buffered is not None:
+            self.buffer_replaced += 1
+        self.buffered = (action, pressed_at)
+
+    def turn_started(self):
+        # Our turn just began: whatever was in flight belongs to the last turn, and the
+        # buffered press (or the intent left pending) is sent if it is recent enough
+        self.awaiting = None
+        if self.pending is not None:
+            self.hold(*self.pending)
+            self.pending = None
+        if self.buffered is None:
+            return
+        action, pressed_at = self.buffered
+        self.buffered = None
+        if time.perf_counter() - pressed_at > self.buffer_window:
+            self.buffer_expired += 1
+            return
+        self.buffer_fired += 1
+        self.send(action, await_ack=True)
+
+    def send(self, action, await_ack=False):
+        seq = self.publisher.publish_action(self.agent_id, action)
+        self.sent += 1
+        if await_ack:
+            self.awaiting = seq
+            self.schedule(self.ack_timeout_ms, lambda: self.ack_timeout(seq))
+        if self.on_send:
+            self.on_send(action, seq)
+
+    def reset(self):
+        self.awaiting = None
+        if self.pending is not None:
+            self.dropped += 1
+            self.pending = None
+        if self.buffered is not None:
+            self.dropped += 1
+            self.buffered = None
+
+    def stats(self):
+        return {"submitted": self.submitted, "sent": self.sent, "coalesced": self.coalesced,
+                "debounced": self.debounced, "dropped": self.dropped, "acked": self.acked,
+                "ack_timeouts": self.ack_timeouts, "buffer_fired": self.buffer_fired,
+                "buffer_expired": self.buffer_expired, "buffer_replaced": self.buffer_replaced,
+                "last_seq": self.publisher.seq}
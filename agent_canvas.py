@@ -0,0 +1,214 @@
+import math
+import time
+
+import numpy as np
+import cv2
+
+# Multi-agent view. Every agent's frame is copied into one preallocated canvas and the canvas
+# is pushed to Tk once per message, instead of one label, PhotoImage and paste per agent.
+# The grid comes from the number of agents (ceil(sqrt(n)) columns) and each tile is as large
+# as the canvas allows. The GUI points FrameDecoder at the tile size, so frames arrive at
+# their final size and placing one is a slice copy. Frames that did not change (the same
+# cached array as last time) are not copied again.
+
+BACKGROUND = (0x2C, 0x2F, 0x33)
+TURN_COLOR = (0x43, 0xB5, 0x81)
+CAPTION_COLOR = (255, 255, 255)
+CAPTION_HEIGHT = 18
+
+
+def grid_layout(count, canvas_size, border=4):
+    # Square tile size and the top left corner of every tile, row by row
+    cols = max(1, math.ceil(math.sqrt(count)))
+    rows = max(1, math.ceil(count / cols))
+    width, height = canvas_size
+    cell_w, cell_h = width // cols, height // rows
+    gap = 2 * border
+    tile = max(16, min(cell_w - 2 * gap, cell_h - 2 * gap - CAPTION_HEIGHT))
+    positions = []
+    for index in range(count):
+        row, col = divmod(index, cols)
+        positions.append((col * cell_w + (cell_w - tile) // 2, row * cell_h + gap))
+    return (tile, tile), positions
+
+
+class AgentCanvas:
+    def __init__(self, surface, canvas_size=(800, 800), own_id=None, border=4):
+        self.surface = surface  # PhotoSurface (or NullSurface) the canvas is shown on
+        self.canvas_size = canvas_size
+        self.own_id = own_id
+        self.border = border
+        self.canvas = np.empty((canvas_size[1], canvas_size[0], 3), dtype=np.uint8)
+        self.canvas[:] = BACKGROUND
+        self.agent_ids = []
+        self.slots = {}
+        self.tile_size = canvas_size
+        self.shown = {}  # agent_id -> frame array last copied in
+        self.turns = {}
+        self.dirty = True
+        self.layouts = 0
+        self.placed = 0
+        self.unchanged = 0
+        self.resized = 0
+        self.flushes = 0
+        self.total_time = 0.0
+
+    def layout(self, agent_ids):
+        # Agents only ever join during a game, the grid is recomputed when one does.
+        # Returns True when the tile size may have changed.
+        new = set(agent_ids) - set(self.agent_ids)
+        if not new:
+            return False
+        self.agent_ids = sorted(set(self.agent_ids) | new)
+        self.tile_size, positions = grid_layout(len(self.agent_ids), self.canvas_size, self.border)
+        self.slots = dict(zip(self.agent_ids, positions))
+        self.canvas[:] = BACKGROUND
+        tile_w, tile_h = self.tile_size
+        for agent_id, (x, y) in self.slots.items():
+            caption = f"Player {agent_id}" + (" (you)" if agent_id == self.own_id else "")
+            cv2.putText(self.canvas, caption, (x, y + tile_h + self.border + CAPTION_HEIGHT - 4),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.45, CAPTION_COLOR, 1, cv2.LINE_AA)
+        self.shown = {}
+        self.turns = {}
+        self.layouts += 1
+        self.dirty = True
+        return True
+
+    def place(self, agent_id, frame, is_turn=False):
+        start = time.perf_counter()
+        x, y = self.slots[agent_id]
+        tile_w, tile_h = self.tile_size
+        if self.turns.get(agent_id) != is_turn:
+            self.turns[agent_id] = is_turn
+            self.draw_border(x, y, TURN_COLOR if is_turn else BACKGROUND)
+        if frame is self.shown.get(agent_id):
+            self.unchanged += 1
+        else:
+            self.shown[agent_id] = frame
+            if frame.shape[:2] != (tile_h, tile_w):
+                # Decoded before the last layout change
+                frame = cv2.resize(frame, self.tile_size, interpolation=cv2.INTER_AREA)
+                self.resized += 1
+            self.canvas[y:y + tile_h, x:x + tile_w] = frame
+            self.placed += 1
+            self.dirty = True
+        self.total_time += time.perf_counter() - start
+
+    def draw_border(self, x, y, color):
+        b = self.border
+        tile_w, tile_h = self.tile_size
+        ring = self.canvas[y - b:y + tile_h + b, x - b:x + tile_w + b]
+        ring[:b] = color
+        ring[-b:] = color
+        ring[:, :b] = color
+        ring[:, -b:] = color
+        self.dirty = True
+
+    def flush(self):
+        # One Tk image update for all the agents placed since the last flush
+        if not self.dirty:
+            return
+        start = time.perf_counter()
+        self.surface.show(self.canvas)
+        self.dirty = False
+        self.flushes += 1
+        self.total_time += time.perf_counter() - start
+
+    def stats(self):
+        return {
+            "agents": len(self.agent_ids),
+            "tile": self.tile_size[0],
+            "layouts": self.layouts,
+            "placed": self.placed,
+            "unchanged": self.unchanged,
+            "resized": self.resized,
+            "flushes": self.flushes,
+            "ms_per_flush": round(self.total_time / self.flushes * 1000, 3) if self.flushes else 0.0,
+        }
+
+
+def benchmark(agents=8, iterations=100, canvas_size=(800, 800), fps=10.0, display="tk"):
+    # One label per agent against the shared canvas, on one thread. Both sides decode at the
+    # canvas tile size, so the difference is the display work: N PhotoSurface updates and N
+    # labels to redraw against one of each. display "tk" needs a display (xvfb-run on a
+    # headless machine), "null" stops at the PIL image and leaves the Tk cost out.
+    from frame_pipeline import prepare_frame
+    from local_server import MOVES, SyntheticGame
+    from tk_display import NullSurface, PhotoSurface
+
+    game = SyntheticGame(range(1, agents + 1), world_size=max(24, 2 * agents + 8))
+    rng = np.random.default_rng(0)
+    messages = []
+    for _ in range(iterations):
+        game.apply_action(game.current_agent(), list(MOVES)[rng.integers(len(MOVES))])
+        messages.append(game.frame())
+    tile_size, _ = grid_layout(len(game.agent_ids), canvas_size)
+
+    root = None
+    if display == "tk":
+        import tkinter as tk
+        try:
+            root = tk.Tk()
+        except tk.TclError as e:
+            print(f"No display ({e}), run it under xvfb-run or with --display null")
+            return None
+
+    def new_surface():
+        if root is None:
+            return NullSurface()
+        label = tk.Label(root)
+        label.pack(side=tk.LEFT)
+        return PhotoSurface(label)
+
+    def redraw():
+        if root is not None:
+            root.update()
+
+    surfaces = {agent_id: new_surface() for agent_id in game.agent_ids}
+    redraw()
+    start = time.perf_counter()
+    for data_dict in messages:
+        for agent_id in sorted(data_dict):
+            surfaces[agent_id].show(prepare_frame(data_dict[agent_id], tile_size))
+        redraw()
+    per_label = (time.perf_counter() - start) / iterations
+    label_updates = sum(surface.updates for surface in surfaces.values())
+    if root is not None:
+        for surface in surfaces.values():
+            surface.label.destroy()
+
+    canvas = AgentCanvas(new_surface(), canvas_size)
+    canvas.layout(game.agent_ids)
+    redraw()
+    start = time.perf_counter()
+    for data_dict in messages:
+        for agent_id in sorted(data_dict):
+            canvas.place(agent_id, prepare_frame(data_dict[agent_id], canvas.tile_size),
+                         data_dict[agent_id]["is_turn"])
+        canvas.flush()
+        redraw()
+    per_canvas = (time.perf_counter() - start) / iterations
+    if root is not None:
+        root.destroy()
+
+    budget = 1000 / fps
+    print(f"{agents} agents, {fps:.0f} fps server, budget {budget:.0f} ms/message, "
+          f"{tile_size[0]} px tiles, display {display}")
+    print(f"one label per agent: {per_label * 1000:.2f} ms/message, "
+          f"{label_updates / iterations:.1f} image updates/message")
+    print(f"single canvas: {per_canvas * 1000:.2f} ms/message, "
+          f"{canvas.surface.updates / iterations:.1f} image updates/message, {canvas.stats()}")
+    return per_label, per_canvas
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--agents", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--fps", type=float, default=10.0)
+    parser.add_argument("--display", type=str, choices=["tk", "null"], default="tk")
+    args = parser.parse_args()
+
+    benchmark(args.agents, args.iterations, fps=args.fps, display=args.display)
@@ -0,0 +1,74 @@
+import tkinter as tk
+
+import numpy as np
+
+from agent_canvas import AgentCanvas
+from tk_display import PhotoSurface
+
+# The player's view as PlayerGUI.update_gui draws it, shared with replay_viewer.py so a
+# recorded session is shown the way the participant saw it:
+#
+#   - only our agent: its frame in one label (one PhotoSurface), with a green border on our turn
+#   - every agent: all the frames in one AgentCanvas grid, the turn as a border around the tile,
+#     pushed to Tk once per message by flush()
+#   - the text the server sends with our turn, as "Texto: ..." in a Text widget
+
+
+def show_turn_text(text_widget, text):
+    text = f"Texto: {text}"
+    text_widget.config(state='normal')
+    text_widget.delete(1.0, tk.END)
+    text_widget.insert(tk.END, text)
+    text_widget.config(state='disabled')
+    return text
+
+
+class AgentView:
+    def __init__(self, parent, own_id, show_only_self=True, canvas_size=(800, 800)):
+        self.own_id = own_id
+        self.show_only_self = show_only_self
+        self.label = tk.Label(parent)
+        self.surface = PhotoSurface(self.label)
+        self.agent_canvas = None
+        if show_only_self:
+            self.surface.show(np.zeros((350, 350, 3), dtype=np.uint8))
+        else:
+            self.agent_canvas = AgentCanvas(self.surface, canvas_size, own_id=own_id)
+            self.surface.show(self.agent_canvas.canvas)
+        self.label.pack()
+
+    def layout(self, agent_ids):
+        # Frame size to decode at from now on when the grid changed, None otherwise
+        if self.agent_canvas is not None and self.agent_canvas.layout(agent_ids):
+            return self.agent_canvas.tile_size
+        return None
+
+    def show(self, agent_id, frame, is_turn):
+        if self.agent_canvas is not None:
+            # Copied into the shared canvas, which goes to Tk in flush()
+            self.agent_canvas.place(agent_id, frame, is_turn)
+            return
+        self.surface.show(frame)
+        if is_turn:
+            self.label.config(borderwidth=5, relief="solid", highlightthickness=5, highlightbackground="green")
+        else:
+            self.label.config(borderwidth=5, relief="solid", highlightthickness=0)
+
+    def flush(self):
+        if self.agent_canvas is not None:
+            self.agent_canvas.flush()
+
+    def set_surface(self, surface):
+        # e.g. a NullSurface for benchmarks: all the widget work, no image transfer to Tk
+        self.surface = surface
+        if self.agent_canvas is not None:
+            self.agent_canvas.surface = surface
+
+    def destroy(self):
+        self.label.destroy()
+
+    def stats(self):
+        stats = {"surface": self.surface.stats()}
+        if self.agent_canvas is not None:
+            stats["agent_canvas"] = self.agent_canvas.stats()
+        return stats
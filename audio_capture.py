@@ -0,0 +1,111 @@
+import threading
+
+import numpy as np
+import pyaudio
+
+# Microphone capture for AudioPublisher. One callback-mode PyAudio input stream stays open for
+# the whole session and PortAudio's thread copies every buffer into a preallocated ring of int16
+# samples, so recording starts without opening a device and nothing is allocated per chunk.
+# Readers keep a cursor (a count of samples since the stream started); a recording begins
+# pre-roll samples in the past, so speech that starts right before the key press is kept.
+#
+#   overflows   PortAudio input overflow (the device dropped samples) or a reader that fell
+#               more than the ring's capacity behind (its oldest samples were overwritten)
+#   underruns   PortAudio input underflow, or a reader that waited and got no samples at all
+
+
+class SampleRing:
+    def __init__(self, capacity):
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        self.capacity = capacity
+        self.written = 0  # samples written since the start, the write position is written % capacity
+        self.condition = threading.Condition()
+
+    def write(self, samples):
+        with self.condition:
+            if len(samples) > self.capacity:
+                self.written += len(samples) - self.capacity
+                samples = samples[-self.capacity:]
+            start = self.written % self.capacity
+            first = min(len(samples), self.capacity - start)
+            self.buffer[start:start + first] = samples[:first]
+            self.buffer[:len(samples) - first] = samples[first:]
+            self.written += len(samples)
+            self.condition.notify_all()
+
+    def read(self, cursor, timeout=None):
+        # Everything written since cursor (at most the capacity) and the new cursor. Waits up
+        # to timeout for new samples. Also returns how many samples were overwritten unread.
+        with self.condition:
+            if timeout and self.written <= cursor:
+                self.condition.wait(timeout)
+            lost = max(0, self.written - self.capacity - cursor)
+            cursor += lost
+            count = self.written - cursor
+            start = cursor % self.capacity
+            first = min(count, self.capacity - start)
+            samples = np.concatenate([self.buffer[start:start + first], self.buffer[:count - first]])
+            return samples, cursor + count, lost
+
+
+class AudioCapture:
+    def __init__(self, audio, rate=44100, channels=1, chunk=1024, max_seconds=12.0, preroll_ms=300):
+        self.audio = audio
+        self.rate = rate
+        self.channels = channels
+        self.chunk = chunk
+        self.preroll = int(rate * channels * preroll_ms / 1000)
+        # Fixed memory ceiling: the longest recording plus the pre-roll
+        self.ring = SampleRing(int(rate * channels * max_seconds) + self.preroll)
+        self.stream = None
+        self.callbacks = 0
+        self.overflows = 0
+        self.underruns = 0
+        self.samples_lost = 0
+
+    def start(self):
+        if self.stream is None:
+            self.stream = self.audio.open(format=pyaudio.paInt16, channels=self.channels, rate=self.rate,
+                                          input=True, frames_per_buffer=self.chunk,
+                                          stream_callback=self.on_audio)
+            self.stream.start_stream()
+        return self
+
+    def on_audio(self, in_data, frame_count, time_info, status):
+        # PortAudio's thread: one copy into the ring and nothing else
+        self.callbacks += 1
+        if status & pyaudio.paInputOverflow:
+            self.overflows += 1
+        if status & pyaudio.paInputUnderflow:
+            self.underruns += 1
+        self.ring.write(np.frombuffer(in_data, dtype=np.int16))
+        return None, pyaudio.paContinue
+
+    def begin(self):
+        # Cursor for a new recording, pre-roll samples back
+        with self.ring.condition:
+            return max(0, self.ring.written - self.preroll)
+
+    def read(self, cursor, timeout=None):
+        samples, cursor, lost = self.ring.read(cursor, timeout)
+        if lost:
+            self.overflows += 1
+            self.samples_lost += lost
+        if timeout and not len(samples):
+            self.underruns += 1
+        return samples, cursor
+
+    def stats(self):
+        return {
+            "callbacks": self.callbacks,
+            "overflows": self.overflows,
+            "underruns": self.underruns,
+            "samples_lost": self.samples_lost,
+            "ring_mb": round(self.ring.buffer.nbytes / 2 ** 20, 2),
+        }
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
@@ -0,0 +1,258 @@
+import struct
+import time
+
+import numpy as np
+
+# Audio profiles for topic/audio. Speech is captured at the microphone's rate (44.1 kHz by
+# default), resampled to the profile's rate with a windowed-sinc low-pass and linear
+# interpolation, and encoded with a small codec implemented here, so nothing native is needed:
+#
+#   pcm16   16-bit little endian PCM, what WAV carries
+#   mulaw   G.711 mu-law, 8 bits per sample
+#   adpcm   IMA ADPCM, 4 bits per sample. Every payload starts with the coder state
+#           (predictor i16, step index u8, pad, sample count u32), so chunks decode on their own
+#
+# Decoders always return 16-bit PCM at the profile's rate.
+PROFILES = {
+    "pcm44k": {"rate": 44100, "codec": "pcm16"},  # the default, what the clients always sent
+    "pcm16k": {"rate": 16000, "codec": "pcm16"},
+    "mulaw16k": {"rate": 16000, "codec": "mulaw"},
+    "adpcm16k": {"rate": 16000, "codec": "adpcm"},
+}
+
+MULAW_BIAS = 0x84
+MULAW_CLIP = 32635
+
+ADPCM_HEADER = struct.Struct("<hBxI")
+ADPCM_INDEX_TABLE = (-1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8)
+ADPCM_STEP_TABLE = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45, 50, 55, 60, 66,
+    73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230, 253, 279, 307, 337, 371, 408, 449,
+    494, 544, 598, 658, 724, 796, 876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272,
+    2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493,
+    10442, 11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767,
+)
+
+
+def _mulaw_tables():
+    # Encoding is one lookup over every int16 value, decoding one over every byte
+    samples = np.arange(-32768, 32768, dtype=np.int32)
+    sign = (samples < 0).astype(np.int32) << 7
+    magnitude = np.minimum(np.abs(samples), MULAW_CLIP) + MULAW_BIAS
+    exponent = np.floor(np.log2(magnitude)).astype(np.int32) - 7
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    encode_table = (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    decoded = (((codes & 0x0F) << 3) + MULAW_BIAS << exponent) - MULAW_BIAS
+    decode_table = np.where(codes & 0x80, -decoded, decoded).astype(np.int16)
+    return encode_table, decode_table
+
+
+MULAW_ENCODE_TABLE, MULAW_DECODE_TABLE = _mulaw_tables()
+
+
+def mulaw_encode(samples):
+    return MULAW_ENCODE_TABLE[samples.astype(np.int32) + 32768].tobytes()
+
+
+def mulaw_decode(payload):
+    return MULAW_DECODE_TABLE[np.frombuffer(payload, dtype=np.uint8)]
+
+
+class AdpcmEncoder:
+    # Keeps the coder state between chunks of the same recording
+    def __init__(self):
+        self.predictor = 0
+        self.index = 0
+
+    def encode(self, samples):
+        header = ADPCM_HEADER.pack(self.predictor, self.index, len(samples))
+        predictor = self.predictor
+        index = self.index
+        index_table = ADPCM_INDEX_TABLE
+        step_table = ADPCM_STEP_TABLE
+        nibbles = bytearray(len(samples))
+        # Every sample depends on the previous one, so this stays a plain loop over Python ints
+        for i, sample in enumerate(samples.tolist()):
+            step = step_table[index]
+            diff = sample - predictor
+            nibble = 0
+            if diff < 0:
+                nibble = 8
+                diff = -diff
+            delta = step >> 3
+            if diff >= step:
+                nibble |= 4
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                nibble |= 2
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                nibble |= 1
+                delta += step
+            if nibble & 8:
+                predictor = max(-32768, predictor - delta)
+            else:
+                predictor = min(32767, predictor + delta)
+            index = min(88, max(0, index + index_table[nibble]))
+            nibbles[i] = nibble
+        self.predictor = predictor
+        self.index = index
+
+        # Two samples per byte, first one in the low nibble
+        packed = np.frombuffer(bytes(nibbles), dtype=np.uint8)
+        if len(packed) % 2:
+            packed = np.append(packed, np.uint8(0))
+        return header + (packed[0::2] | (packed[1::2] << 4)).tobytes()
+
+
+def adpcm_decode(payload):
+    predictor, index, count = ADPCM_HEADER.unpack_from(payload, 0)
+    packed = np.frombuffer(payload, dtype=np.uint8, offset=ADPCM_HEADER.size)
+    nibbles = np.empty(len(packed) * 2, dtype=np.uint8)
+    nibbles[0::2] = packed & 0x0F
+    nibbles[1::2] = packed >> 4
+    index_table = ADPCM_INDEX_TABLE
+    step_table = ADPCM_STEP_TABLE
+    samples = [0] * count
+    for i, nibble in enumerate(nibbles[:count].tolist()):
+        step = step_table[index]
+        delta = step >> 3
+        if nibble & 4:
+            delta += step
+        if nibble & 2:
+            delta += step >> 1
+        if nibble & 1:
+            delta += step >> 2
+        if nibble & 8:
+            predictor = max(-32768, predictor - delta)
+        else:
+            predictor = min(32767, predictor + delta)
+        index = min(88, max(0, index + index_table[nibble]))
+        samples[i] = predictor
+    return np.array(samples, dtype=np.int16)
+
+
+def decode(codec, payload):
+    # Returns 16-bit PCM samples
+    if codec == "mulaw":
+        return mulaw_decode(payload)
+    if codec == "adpcm":
+        return adpcm_decode(payload)
+    if codec == "pcm16":
+        return np.frombuffer(payload, dtype="<i2")
+    raise ValueError(f"Unknown audio codec {codec}")
+
+
+class Resampler:
+    # Streaming resampler: anti-alias low-pass, then linear interpolation at the new rate.
+    # History is carried over between calls so chunk boundaries do not click.
+    def __init__(self, src_rate, dst_rate, taps=63):
+        self.src_rate = src_rate
+        self.dst_rate = dst_rate
+        self.step = src_rate / dst_rate
+        # Windowed sinc with the cutoff a little below the lower Nyquist frequency
+        cutoff = 0.45 * min(src_rate, dst_rate) / src_rate
+        n = np.arange(taps) - (taps - 1) / 2
+        self.taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+        self.taps /= self.taps.sum()
+        self.history = np.zeros(taps - 1)
+        self.tail = np.zeros(0)
+        self.position = 0.0
+
+    def process(self, samples):
+        if self.src_rate == self.dst_rate:
+            return samples.astype(np.int16)
+        x = np.concatenate([self.history, samples.astype(np.float64)])
+        self.history = x[len(x) - (len(self.taps) - 1):]
+        y = np.concatenate([self.tail, np.convolve(x, self.taps, mode="valid")])
+        if not len(y):
+            return np.zeros(0, dtype=np.int16)
+        last = len(y) - 1
+        count = int((last - self.position) // self.step) + 1 if last >= self.position else 0
+        t = self.position + self.step * np.arange(count)
+        out = np.interp(t, np.arange(len(y)), y)
+        # Next output time, relative to y's last sample which starts the next block
+        self.position = self.position + self.step * count - last
+        self.tail = y[-1:]
+        return np.clip(np.round(out), -32768, 32767).astype(np.int16)
+
+
+class AudioEncoder:
+    # Capture-rate PCM in, profile payloads out. One instance per recording.
+    def __init__(self, profile="pcm44k", capture_rate=44100):
+        self.profile = profile
+        self.rate = PROFILES[profile]["rate"]
+        self.codec = PROFILES[profile]["codec"]
+        self.resampler = Resampler(capture_rate, self.rate)
+        self.adpcm = AdpcmEncoder() if self.codec == "adpcm" else None
+
+    def encode(self, pcm):
+        samples = self.resampler.process(np.frombuffer(pcm, dtype="<i2"))
+        if self.codec == "mulaw":
+            return mulaw_encode(samples)
+        if self.codec == "adpcm":
+            return self.adpcm.encode(samples)
+        return samples.astype("<i2").tobytes()
+
+
+def speech_like(seconds, rate, seed=0):
+    # Voiced harmonics with a wandering pitch and syllable-rate envelope, plus some breath noise
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 20))
+    envelope = np.clip(np.sin(2 * np.pi * 3 * t), 0, None) ** 0.5
+    signal = voiced * envelope + 0.05 * rng.standard_normal(len(t))
+    return (signal / np.abs(signal).max() * 12000).astype(np.int16)
+
+
+def snr_db(reference, decoded):
+    noise = np.sum((reference.astype(np.float64) - decoded.astype(np.float64)) ** 2)
+    if noise == 0:
+        return float("inf")  # lossless
+    return 10 * np.log10(np.sum(reference.astype(np.float64) ** 2) / noise)
+
+
+def benchmark(seconds=10.0, capture_rate=44100, chunk_ms=200):
+    import base64
+
+    pcm = speech_like(seconds, capture_rate)
+    baseline = len(base64.b64encode(pcm.tobytes()))  # base64 44.1 kHz PCM, what topic/audio carried
+    chunk = capture_rate * chunk_ms // 1000
+    print(f"{seconds:.0f} s of speech-like audio at {capture_rate} Hz, {chunk_ms} ms chunks")
+    print(f"{'profile':>9} {'payload KB':>11} {'smaller':>8} {'encode ms/s':>12} {'decode ms/s':>12} {'SNR dB':>7}")
+    for profile in PROFILES:
+        encoder = AudioEncoder(profile, capture_rate)
+        start = time.perf_counter()
+        payloads = [encoder.encode(pcm[i:i + chunk].tobytes()) for i in range(0, len(pcm), chunk)]
+        encode_time = time.perf_counter() - start
+        size = sum(len(base64.b64encode(payload)) for payload in payloads)
+
+        start = time.perf_counter()
+        decoded = np.concatenate([decode(encoder.codec, payload) for payload in payloads])
+        decode_time = time.perf_counter() - start
+
+        # Codec error only, against the same resampled signal
+        reference = Resampler(capture_rate, encoder.rate).process(pcm)
+        snr = snr_db(reference, decoded[:len(reference)])
+        print(f"{profile:>9} {size / 1024:>11.1f} {baseline / size:>7.1f}x {encode_time / seconds * 1000:>12.2f} "
+              f"{decode_time / seconds * 1000:>12.2f} {snr:>7.1f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--capture_rate", type=int, default=44100)
+    args = parser.parse_args()
+
+    benchmark(args.seconds, args.capture_rate)
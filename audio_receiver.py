@@ -0,0 +1,254 @@
+import base64
+import json
+import os
+import re
+import struct
+import threading
+import time
+import wave
+from collections import deque
+
+import paho.mqtt.client as mqtt
+
+from audio_codec import decode
+
+# Reference receiver for topic/audio. Streaming uploads from AudioPublisher look like:
+#
+#   {"type": "start", "transfer_id", "agent_id", "message_kind", "rate", "codec", "channels", "sample_width"}
+#   {"type": "chunk", "transfer_id", "agent_id", "seq", "audio": base64 payload}   seq = 0, 1, 2, ...
+#   {"type": "end",   "transfer_id", "agent_id", "chunk_count"}
+#
+# Chunks are written to the WAV file as soon as they are next in order. Out of order chunks
+# wait in a small reorder buffer; when it is full (or the end marker arrives) the missing
+# chunks are given up on and replaced by silence so the timing of the rest stays right.
+# Messages without "type" are batch uploads (one WAV split by chunk_index / chunk_count, or a
+# whole WAV in a single message) and are written once complete. Payloads are decoded with
+# audio_codec according to "codec" (pcm16 when missing) and always written as 16-bit WAV.
+
+
+def safe_name(text):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(text))
+
+
+class StreamTransfer:
+    def __init__(self, transfer_id, out_dir, max_reorder):
+        self.transfer_id = transfer_id
+        self.out_dir = out_dir
+        self.max_reorder = max_reorder
+        self.wav = None
+        self.path = None
+        self.next_seq = 0
+        self.codec = "pcm16"
+        self.pending = {}  # seq -> encoded payload waiting for the gap before them
+        self.chunk_len = 0
+        self.chunk_count = None
+        self.last_seen = time.time()
+        self.written = 0
+        self.reordered = 0
+        self.lost = 0
+        self.duplicates = 0
+
+    def start(self, start_dict):
+        name = f"{safe_name(start_dict.get('agent_id'))}_{safe_name(start_dict.get('message_kind'))}_" \
+               f"{safe_name(self.transfer_id)}.wav"
+        self.path = os.path.join(self.out_dir, name)
+        self.codec = start_dict.get("codec", "pcm16")
+        self.wav = wave.open(self.path, 'wb')
+        self.wav.setnchannels(int(start_dict.get("channels", 1)))
+        self.wav.setsampwidth(int(start_dict.get("sample_width", 2)))
+        self.wav.setframerate(int(start_dict.get("rate", 44100)))
+        self.drain()
+
+    def chunk(self, seq, payload):
+        self.last_seen = time.time()
+        if seq < self.next_seq or seq in self.pending:
+            self.duplicates += 1
+            return
+        if seq != self.next_seq:
+            self.reordered += 1
+        self.pending[seq] = payload
+        self.drain()
+
+    def end(self, chunk_count):
+        self.chunk_count = chunk_count
+        self.drain()
+
+    def drain(self):
+        if self.wav is None:
+            return  # no format yet, the start marker is still on its way
+        while True:
+            if self.next_seq in self.pending:
+                self.write(decode(self.codec, self.pending.pop(self.next_seq)).astype("<i2").tobytes())
+            elif self.pending and (len(self.pending) > self.max_reorder or self.chunk_count is not None):
+                # The gap is not going to be filled, keep the timing with silence
+                self.lost += 1
+                self.write(bytes(self.chunk_len or 2 * len(decode(self.codec, next(iter(self.pending.values()))))))
+            elif self.chunk_count is not None and self.next_seq < self.chunk_count:
+                # Chunks lost at the end
+                self.lost += 1
+                self.write(bytes(self.chunk_len))
+            else:
+                return
+
+    def write(self, pcm):
+        self.chunk_len = self.chunk_len or len(pcm)
+        self.wav.writeframesraw(pcm)
+        self.written += len(pcm)
+        self.next_seq += 1
+
+    def complete(self):
+        return self.wav is not None and self.chunk_count is not None and self.next_seq >= self.chunk_count
+
+    def close(self):
+        if self.wav is not None:
+            self.wav.close()  # patches the header with the final length
+            self.wav = None
+
+
+class AudioReceiver:
+    def __init__(self, out_dir="recordings", max_reorder=8, timeout=30.0):
+        self.out_dir = out_dir
+        self.max_reorder = max_reorder
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.streams = {}
+        self.batches = {}  # transfer_id -> {chunk_index: WAV bytes}
+        self.finished = deque(maxlen=256)  # recent transfer ids, late duplicates are ignored
+        self.completed = 0
+        self.expired = 0
+        self.chunks = 0
+        self.reordered = 0
+        self.lost = 0
+        self.duplicates = 0
+        os.makedirs(out_dir, exist_ok=True)
+
+    def handle(self, payload):
+        audio_dict = json.loads(payload)
+        kind = audio_dict.get("type")
+        with self.lock:
+            if kind is None:
+                return self.handle_batch(audio_dict)
+            transfer_id = str(audio_dict["transfer_id"])
+            if transfer_id in self.finished:
+                self.duplicates += 1
+                return None
+            transfer = self.streams.get(transfer_id)
+            if transfer is None:
+                transfer = self.streams[transfer_id] = StreamTransfer(transfer_id, self.out_dir, self.max_reorder)
+            if kind == "start":
+                transfer.start(audio_dict)
+            elif kind == "chunk":
+                self.chunks += 1
+                transfer.chunk(int(audio_dict["seq"]), base64.b64decode(audio_dict["audio"]))
+            elif kind == "end":
+                transfer.end(int(audio_dict["chunk_count"]))
+            if transfer.complete():
+                return self.finish(transfer_id)
+        return None
+
+    def handle_batch(self, audio_dict):
+        transfer_id = str(audio_dict.get("transfer_id", time.time()))
+        chunk_count = int(audio_dict.get("chunk_count", 1))
+        parts = self.batches.setdefault(transfer_id, {})
+        parts[int(audio_dict.get("chunk_index", 0))] = base64.b64decode(audio_dict["audio"])
+        self.chunks += 1
+        if len(parts) < chunk_count:
+            return None
+        del self.batches[transfer_id]
+        data = b"".join(parts[index] for index in sorted(parts))
+        name = f"{safe_name(audio_dict.get('agent_id'))}_{safe_name(audio_dict.get('message_kind'))}_" \
+               f"{safe_name(transfer_id)}.wav"
+        path = os.path.join(self.out_dir, name)
+        if "codec" in audio_dict:
+            wav = wave.open(path, 'wb')
+            wav.setnchannels(int(audio_dict.get("channels", 1)))
+            wav.setsampwidth(2)
+            wav.setframerate(int(audio_dict["rate"]))
+            wav.writeframes(decode(audio_dict["codec"], data).astype("<i2").tobytes())
+            wav.close()
+        else:
+            # Already a WAV file
+            with open(path, "wb") as f:
+                f.write(data)
+        self.completed += 1
+        return path
+
+    def finish(self, transfer_id):
+        # Called with self.lock held
+        transfer = self.streams.pop(transfer_id)
+        transfer.close()
+        self.finished.append(transfer_id)
+        self.completed += 1
+        self.reordered += transfer.reordered
+        self.lost += transfer.lost
+        self.duplicates += transfer.duplicates
+        print(f"Audio {transfer_id}: {transfer.written} bytes to {transfer.path}, "
+              f"{transfer.lost} chunks lost, {transfer.reordered} out of order")
+        return transfer.path
+
+    def expire(self):
+        # Streams whose end marker never came are closed with what they have
+        now = time.time()
+        with self.lock:
+            for transfer_id, transfer in list(self.streams.items()):
+                if now - transfer.last_seen <= self.timeout:
+                    continue
+                self.expired += 1
+                if transfer.wav is None:
+                    # Never got the start marker, there is no format to write the chunks with
+                    del self.streams[transfer_id]
+                    self.lost += len(transfer.pending)
+                    continue
+                transfer.chunk_count = max(transfer.pending, default=transfer.next_seq - 1) + 1
+                transfer.drain()
+                self.finish(transfer_id)
+
+    def stats(self):
+        with self.lock:
+            return {"completed": self.completed, "expired": self.expired, "active": len(self.streams),
+                    "chunks": self.chunks, "reordered": self.reordered, "lost": self.lost,
+                    "duplicates": self.duplicates}
+
+
+def run(broker_address, port, out_dir, topic="topic/audio"):
+    receiver = AudioReceiver(out_dir)
+
+    def on_connect(client, userdata, flags, rc):
+        if rc == 0:
+            print(f"Audio receiver writing {topic} to {out_dir}")
+            client.subscribe(topic)
+        else:
+            print(f"Error al conectar al broker. Código de error: {rc}")
+
+    def on_message(client, userdata, message):
+        try:
+            receiver.handle(message.payload)
+        except (json.JSONDecodeError, KeyError, ValueError, struct.error) as e:
+            print(f"Error al decodificar el audio: {e}")
+
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(broker_address, port, 60)
+    client.loop_start()
+    try:
+        while True:
+            time.sleep(1.0)
+            receiver.expire()
+    except KeyboardInterrupt:
+        pass
+    client.loop_stop()
+    client.disconnect()
+    print(f"Audio receiver stats: {receiver.stats()}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--broker", type=str, default="172.24.98.252")
+    parser.add_argument("--port", type=int, default=8085)
+    parser.add_argument("--out_dir", type=str, default="recordings")
+    args = parser.parse_args()
+
+    run(args.broker, args.port, args.out_dir)
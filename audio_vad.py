@@ -0,0 +1,105 @@
+import numpy as np
+
+# Energy based voice activity detection for the microphone messages. Audio is cut in 20 ms
+# frames and a frame counts as speech when its RMS level is some margin above the noise floor
+# (the 10th percentile of the levels seen so far in the recording), clamped to a sane range.
+# SpeechTrimmer works on the stream as it is captured:
+#
+#   - leading silence is dropped, except for pad_ms before the first speech
+#   - trailing silence is held back and only sent if speech resumes; at the end only pad_ms
+#     of it is kept
+#   - should_stop() turns true after early_stop_ms of silence following speech, so the mic
+#     window can close before its 10 s are up
+
+
+def frame_energy_db(samples, frame_len):
+    # dBFS RMS level of every whole frame, one vectorized pass
+    count = len(samples) // frame_len
+    frames = samples[:count * frame_len].reshape(count, frame_len).astype(np.float32)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20 * np.log10(rms / 32768.0 + 1e-9)
+
+
+class SpeechTrimmer:
+    def __init__(self, rate, channels=1, frame_ms=20, margin_db=12.0, min_threshold_db=-50.0,
+                 max_threshold_db=-30.0, pad_ms=200, early_stop_ms=1500):
+        self.samples_per_ms = rate * channels / 1000
+        self.frame_len = int(self.samples_per_ms * frame_ms)
+        self.margin_db = margin_db
+        self.min_threshold_db = min_threshold_db
+        self.max_threshold_db = max_threshold_db
+        self.pad_frames = pad_ms // frame_ms
+        self.early_stop_frames = early_stop_ms // frame_ms if early_stop_ms else None
+
+        self.held = np.zeros(0, dtype=np.int16)  # captured, not sent yet; starts on a frame boundary
+        self.analysed = 0  # frames of self.held already added to self.energies
+        self.energies = []
+        self.speech_started = False
+        self.silent_frames = 0
+        self.input_samples = 0
+        self.lead_trimmed = 0
+        self.trail_trimmed = 0
+
+    def threshold(self):
+        floor = np.percentile(self.energies, 10) if self.energies else self.min_threshold_db
+        return min(self.max_threshold_db, max(self.min_threshold_db, floor + self.margin_db))
+
+    def process(self, samples):
+        # Returns the samples that can be sent now
+        self.input_samples += len(samples)
+        self.held = np.concatenate([self.held, samples])
+        energies = frame_energy_db(self.held, self.frame_len)
+        self.energies.extend(energies[self.analysed:].tolist())
+        frames = len(energies)
+        speech = np.flatnonzero(energies > self.threshold())
+
+        if not len(speech):
+            if self.speech_started:
+                # Possibly the end of the message, hold it until speech resumes or the recording ends
+                self.silent_frames = frames
+                self.analysed = frames
+            else:
+                # Still before the first word, keep just the pad
+                drop = max(0, frames - self.pad_frames) * self.frame_len
+                self.lead_trimmed += drop
+                self.held = self.held[drop:]
+                self.analysed = frames - drop // self.frame_len
+            return np.zeros(0, dtype=np.int16)
+
+        start = 0
+        if not self.speech_started:
+            self.speech_started = True
+            start = max(0, speech[0] - self.pad_frames) * self.frame_len
+            self.lead_trimmed += start
+        end = (speech[-1] + 1) * self.frame_len
+        emitted = self.held[start:end]
+        self.held = self.held[end:]
+        self.silent_frames = frames - (speech[-1] + 1)
+        self.analysed = self.silent_frames
+        return emitted
+
+    def should_stop(self):
+        return (self.speech_started and self.early_stop_frames is not None
+                and self.silent_frames >= self.early_stop_frames)
+
+    def finish(self):
+        # End of the recording: the pad after the last word, the rest of the silence is dropped
+        if not self.speech_started:
+            self.lead_trimmed += len(self.held)
+            emitted = np.zeros(0, dtype=np.int16)
+        else:
+            emitted = self.held[:self.pad_frames * self.frame_len]
+            self.trail_trimmed += len(self.held) - len(emitted)
+        self.held = np.zeros(0, dtype=np.int16)
+        return emitted
+
+    def report(self):
+        to_ms = 1 / self.samples_per_ms
+        trimmed = self.lead_trimmed + self.trail_trimmed
+        return {
+            "captured_ms": round(self.input_samples * to_ms),
+            "sent_ms": round((self.input_samples - trimmed) * to_ms),
+            "trimmed_ms": round(trimmed * to_ms),
+            "lead_trimmed_ms": round(self.lead_trimmed * to_ms),
+            "trail_trimmed_ms": round(self.trail_trimmed * to_ms),
+        }
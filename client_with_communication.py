@@ -1,12 +1,25 @@
 import json
 import base64
-import paho.mqtt.client as mqtt
 import tkinter as tk
 from PIL import Image, ImageTk
 import numpy as np
 import cv2
 import threading
-import queue
+from frame_codec import FrameFormatError, agent_topic, decode_payload
+from frame_mailbox import FrameMailbox, has_flag
+from latency import LatencyTracker, stamp
+from frame_pipeline import FrameDecoder, prepare_frame
+from sprite_atlas import AtlasStore
+from tile_delta import TileCompositor, composite_frames
+from tk_display import TkWakeup
+from agent_view import AgentView, show_turn_text
+from session_log import SessionLog
+from mqtt_session import MqttSession
+from action_pipeline import ActionPipeline
+from rotation_preview import RotationPredictor
+from audio_codec import PROFILES, AudioEncoder
+from audio_capture import AudioCapture
+from audio_vad import SpeechTrimmer
 import time
 import keyboard
 import pyaudio
@@ -15,79 +28,130 @@ import io
 import os
 
 class DataSubscriber:
-    def __init__(self, broker_address, data_topic, data_queue, gui, port):
-        self.broker_address = broker_address
+    def __init__(self, session, data_topic, data_queue, gui):
+        self.session = session
         self.data_topic = data_topic
         self.data_queue = data_queue
-        self.port = port
-        self.client = mqtt.Client()
-        self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
         self.gui = gui  
-        print(f"Trying to connect to {self.broker_address} on port {self.port}")
-        self.client.connect(self.broker_address, self.port, 60)
-        self.client.loop_start()
-        
-
-    def on_connect(self, client, userdata, flags, rc):
-        if rc == 0:
-            print("Conectado al broker MQTT")
-            client.subscribe(self.data_topic)
-        else:
-            print(f"Error al conectar al broker. Código de error: {rc}")
+        self.compositor = TileCompositor()
+        self.atlas_store = AtlasStore()
+        self.keyframe_topic = "topic/keyframe"
+        self.atlas_topic = "topic/atlas"
+        self.requested = {}
+        # The session renews these subscriptions after every reconnect
+        self.session.subscribe(self.data_topic, self.on_message)
+        self.session.subscribe(self.atlas_topic, self.on_message)
 
     def on_message(self, client, userdata, message):
+        arrival = time.perf_counter()
         try:
-            msg_json = message.payload.decode('utf-8')
-            data_dict = json.loads(msg_json)
-            self.data_queue.put(data_dict)
+            if message.topic == self.atlas_topic:
+                atlas = self.atlas_store.add(message.payload)
+                print(f"Sprite atlas {atlas.version.hex()} received")
+                return
+
+            # Binary envelopes and legacy JSON messages are told apart by their first bytes
+            data_dict = decode_payload(message.payload)
+            stamp(data_dict, "_t_arrival", arrival)
+            # Tile deltas have to be applied in arrival order, before the mailbox coalesces frames
+            for agent_id in composite_frames(self.compositor, data_dict):
+                self.request(self.keyframe_topic, agent_id, {"agent_id": agent_id})
+            for version in self.atlas_store.attach(data_dict):
+                self.request(f"{self.atlas_topic}/request", version, {"version": version.hex()})
+            if data_dict:
+                stamp(data_dict, "_t_recv")
+                self.data_queue.put(data_dict)
 
         except json.JSONDecodeError as e:
             print(f"Error al decodificar el mensaje JSON: {e}")
+        except FrameFormatError as e:
+            print(f"Error al decodificar el mensaje binario: {e}")
+
+    def request(self, topic, key, request_dict):
+        # Keyframe and atlas requests, at most one per second for the same thing
+        now = time.time()
+        if now - self.requested.get((topic, key), 0) >= 1.0:
+            self.requested[(topic, key)] = now
+            self.session.publish(topic, json.dumps(request_dict))
 
 class ActionPublisher:
-    def __init__(self, broker_address, actions_topic, port):
-        self.broker_address = broker_address
+    def __init__(self, session, actions_topic):
+        self.session = session
         self.actions_topic = actions_topic
-        self.port = port
 
-        self.client = mqtt.Client()
-        print(f"Action publisher trying to connect to {self.broker_address} on port {self.port}")
-        self.client.connect(self.broker_address, self.port, 60)
-        self.client.loop_start()
+        self.latency_tracker = None  # Will be set in main()
+        self.session_log = None  # Will be set in main() when recording
+        self.seq = 0
+        self.seq_lock = threading.Lock()
 
     def publish_action(self, agent_id, action):
+        # Every action gets a sequence id, the server echoes the last applied one back
+        with self.seq_lock:
+            self.seq += 1
+            seq = self.seq
         action_dict = {
             "agent_id": agent_id,
-            "action": action
+            "action": action,
+            "seq": seq
         }
+        if self.latency_tracker:
+            self.latency_tracker.action_sent(seq)
+        if self.session_log:
+            self.session_log.action(agent_id, action, seq)
         action_json = json.dumps(action_dict)
-        self.client.publish(self.actions_topic, action_json)
+        # Buffered by the session while disconnected, sent as soon as it reconnects
+        self.session.publish(self.actions_topic, action_json, buffer=True)
+        return seq
 
 class AudioPublisher:
-    def __init__(self, broker_address, agent_id, port):
-        self.broker_address = broker_address
+    def __init__(self, session, agent_id, streaming=False, profile="pcm44k", capture_rate=44100, vad=False,
+                 early_stop_ms=None, chunk_kb=None):
+        self.session = session
         self.agent_id = agent_id
-        self.port = port
         self.recording = False
         self.audio_thread = None
-        self.frames = []
+        self.stop_event = threading.Event()
+        self.cursor = 0  # position in the capture ring where the next chunk starts
         self.message_kind = None
+
+        # Batch mode (the default) sends the whole WAV after stop_recording, the opt-in streaming
+        # mode publishes the audio while recording (see audio_receiver.py for the message format)
+        self.streaming = streaming
+        self.stream_chunk_ms = 200
+        self.transfer_id = None
+        self.stream_seq = 0
+
+        # Transmit profile (rate and codec, see audio_codec.py), a new encoder per recording
+        self.profile = profile
+        self.encoder = None
+
+        # Optional silence trimming (audio_vad.py), off by default. With early_stop_ms as well,
+        # on_silence is called from the recording thread once the speaker has been quiet that
+        # long, so the GUI can close the mic window. When the trimmer hears no speech at all
+        # (quiet speaker, low mic gain) the capture is sent untrimmed instead of nothing.
+        self.vad = vad
+        self.early_stop_ms = early_stop_ms
+        self.trimmer = None
+        self.untrimmed = []
+        self.on_silence = None
+        self.batch_parts = []
+        self.trimmed_ms = 0
+        self.session_log = None  # Will be set in main() when recording
         
         # Audio settings
         self.format = pyaudio.paInt16
         self.channels = 1
-        self.rate = 44100
+        self.rate = capture_rate
         self.chunk = 1024
+        # Batch recordings go out as one message, as always. With chunk_kb they are split in
+        # messages of that many KB, which only the chunk-aware audio_receiver.py can join.
+        self.chunk_bytes = chunk_kb * 1024 if chunk_kb else None
+        self.transfers = 0
         
-        # MQTT client setup
-        self.client = mqtt.Client()
-        print(f"Audio publisher trying to connect to {self.broker_address} on port {self.port}")
-        self.client.connect(self.broker_address, self.port, 60)
-        self.client.loop_start()
-        
-        # Initialize PyAudio
+        # Initialize PyAudio. The input stream stays open and fills a ring buffer, so a
+        # recording starts instantly and includes the pre-roll before the key press.
         self.audio = pyaudio.PyAudio()
+        self.capture = AudioCapture(self.audio, self.rate, self.channels, self.chunk).start()
     
     def start_recording(self, message_kind):
         if self.recording:
@@ -95,7 +159,27 @@ class AudioPublisher:
             
         self.message_kind = message_kind
         self.recording = True
-        self.frames = []
+        self.cursor = self.capture.begin()
+        self.encoder = AudioEncoder(self.profile, self.rate)
+        self.batch_parts = []
+        self.untrimmed = []
+        self.trimmer = None
+        if self.vad:
+            self.trimmer = SpeechTrimmer(self.rate, self.channels, early_stop_ms=self.early_stop_ms)
+        if self.streaming:
+            self.transfer_id = self._new_transfer_id()
+            self.stream_seq = 0
+            self._publish({
+                "type": "start",
+                "transfer_id": self.transfer_id,
+                "agent_id": self.agent_id,
+                "message_kind": message_kind,
+                "rate": self.encoder.rate,
+                "codec": self.encoder.codec,
+                "channels": self.channels,
+                "sample_width": 2
+            })
+        self.stop_event.clear()
         self.audio_thread = threading.Thread(target=self._record_audio)
         self.audio_thread.daemon = True
         self.audio_thread.start()
@@ -106,72 +190,168 @@ class AudioPublisher:
             return
             
         self.recording = False
+        self.stop_event.set()
         if self.audio_thread:
             self.audio_thread.join(timeout=1.0)
+            self.audio_thread = None
+        samples, self.cursor = self.capture.read(self.cursor)
+        self._consume(samples)
+        trimmed_ms = 0
+        if self.trimmer:
+            self._deliver(self.trimmer.finish())
+            report = self.trimmer.report()
+            trimmed_ms = report["trimmed_ms"]
+            if not self.trimmer.speech_started:
+                print(f"No speech detected for {self.message_kind}, sending the recording untrimmed")
+                self._deliver(np.concatenate(self.untrimmed) if self.untrimmed else np.zeros(0, dtype=np.int16))
+                trimmed_ms = 0
+            else:
+                print(f"Silence trimmed for {self.message_kind}: {report}")
+            self.untrimmed = []
+            self.trimmed_ms += trimmed_ms
+
+        if self.streaming:
+            # The last chunk went out above, close the stream
+            self._publish({
+                "type": "end",
+                "transfer_id": self.transfer_id,
+                "agent_id": self.agent_id,
+                "chunk_count": self.stream_seq,
+                "trimmed_ms": trimmed_ms
+            })
+            print(f"Agent {self.agent_id} streamed {self.stream_seq} audio chunks for message kind: {self.message_kind}")
+            self._log_audio(self.transfer_id, self.stream_seq, trimmed_ms)
+            return
         
         # Send the recorded audio
-        if self.frames and self.message_kind:
-            self._send_audio()
+        samples = np.concatenate(self.batch_parts) if self.batch_parts else np.zeros(0, dtype=np.int16)
+        self.batch_parts = []
+        if len(samples) and self.message_kind:
+            transfer_id, chunk_count = self._send_audio(samples, trimmed_ms)
+            self._log_audio(transfer_id, chunk_count, trimmed_ms)
             print(f"Agent {self.agent_id} sent to the topic topic/audio audio for message kind: {self.message_kind}")
     
     def _record_audio(self):
-        stream = self.audio.open(
-            format=self.format,
-            channels=self.channels,
-            rate=self.rate,
-            input=True,
-            frames_per_buffer=self.chunk
-        )
-        
-        while self.recording:
-            data = stream.read(self.chunk)
-            self.frames.append(data)
-        
-        stream.stop_stream()
-        stream.close()
-    
-    def _send_audio(self):
-        # Convert frames to WAV format in memory
-        buffer = io.BytesIO()
-        wf = wave.open(buffer, 'wb')
-        wf.setnchannels(self.channels)
-        wf.setsampwidth(self.audio.get_sample_size(self.format))
-        wf.setframerate(self.rate)
-        wf.writeframes(b''.join(self.frames))
-        wf.close()
-        
-        # Get the WAV data and encode it as base64
-        buffer.seek(0)
-        audio_data = buffer.read()
-        audio_base64 = base64.b64encode(audio_data).decode('utf-8')
-        
-        # Create a dictionary with the required keys
-        audio_dict = {
-            "audio": audio_base64,
+        # Every stream_chunk_ms, whatever the capture stream added since the last chunk
+        silence_reported = False
+        while not self.stop_event.wait(self.stream_chunk_ms / 1000):
+            samples, self.cursor = self.capture.read(self.cursor, timeout=0.5)
+            self._consume(samples)
+            if self.trimmer and self.trimmer.should_stop() and not silence_reported:
+                silence_reported = True
+                if self.on_silence:
+                    self.on_silence()
+
+    def _consume(self, samples):
+        if self.trimmer:
+            if not self.trimmer.speech_started:
+                # Kept until the first word, in case there never is one
+                self.untrimmed.append(samples)
+            samples = self.trimmer.process(samples)
+            if self.trimmer.speech_started:
+                self.untrimmed = []
+        self._deliver(samples)
+
+    def _deliver(self, samples):
+        # Streaming sends right away, batch mode keeps it for stop_recording
+        if self.streaming:
+            self._send_chunk(samples)
+        elif len(samples):
+            self.batch_parts.append(samples)
+
+    def _log_audio(self, transfer_id, chunk_count, trimmed_ms):
+        if self.session_log:
+            self.session_log.audio({"agent_id": self.agent_id, "message_kind": self.message_kind,
+                                    "transfer_id": transfer_id, "chunk_count": chunk_count,
+                                    "profile": self.profile, "streaming": self.streaming, "trimmed_ms": trimmed_ms})
+
+    def _new_transfer_id(self):
+        self.transfers += 1
+        return f"{self.agent_id}-{int(time.time() * 1000)}-{self.transfers}"
+
+    def _publish(self, audio_dict):
+        # Audio goes on the session's bulk lane, in order and behind any action. Not buffered
+        # while disconnected, a stale message is of no use after a reconnect.
+        if not self.session.publish("topic/audio", json.dumps(audio_dict), lane="bulk"):
+            print("Audio message dropped, not connected to the broker")
+            return False
+        return True
+
+    def _send_chunk(self, samples):
+        if not len(samples):
+            return
+        self._publish({
+            "type": "chunk",
+            "transfer_id": self.transfer_id,
             "agent_id": self.agent_id,
-            "message_kind": self.message_kind
-        }
-        
-        # Convert the dictionary to JSON
-        audio_json = json.dumps(audio_dict)
-        
-        # Create the topic
-        topic = f"topic/audio"
-        
-        # Publish the audio data as JSON
-        self.client.publish(topic, audio_json)
-        
-        # Clear frames
-        self.frames = []
+            "seq": self.stream_seq,
+            "audio": base64.b64encode(self.encoder.encode(samples.tobytes())).decode('utf-8')
+        })
+        self.stream_seq += 1
+    
+    def _send_audio(self, samples, trimmed_ms=0):
+        encoded = self.encoder.encode(samples.tobytes())
+        codec_fields = {}
+        if self.encoder.codec == "pcm16":
+            # Convert frames to WAV format in memory
+            buffer = io.BytesIO()
+            wf = wave.open(buffer, 'wb')
+            wf.setnchannels(self.channels)
+            wf.setsampwidth(2)
+            wf.setframerate(self.encoder.rate)
+            wf.writeframes(encoded)
+            wf.close()
+            
+            # Get the WAV data
+            buffer.seek(0)
+            audio_data = buffer.read()
+        else:
+            # Compressed recordings are sent as the bare codec stream
+            audio_data = encoded
+            codec_fields = {"codec": self.encoder.codec, "rate": self.encoder.rate, "channels": self.channels}
+
+        if not self.chunk_bytes:
+            # One message with the whole recording, the format every topic/audio consumer reads
+            audio_dict = {
+                "audio": base64.b64encode(audio_data).decode('utf-8'),
+                "agent_id": self.agent_id,
+                "message_kind": self.message_kind,
+                **codec_fields
+            }
+            if self.trimmer:
+                audio_dict["trimmed_ms"] = trimmed_ms
+            self._publish(audio_dict)
+            return None, 1
+
+        # Split the WAV in chunks that go out on the session's bulk lane, paced and behind any
+        # action, instead of one ~1 MB message. The receiver joins the chunks of a transfer_id
+        # in chunk_index order (a short recording is a single chunk with chunk_count 1).
+        transfer_id = self._new_transfer_id()
+        chunk_count = max(1, -(-len(audio_data) // self.chunk_bytes))
+        for chunk_index in range(chunk_count):
+            chunk = audio_data[chunk_index * self.chunk_bytes:(chunk_index + 1) * self.chunk_bytes]
+            audio_dict = {
+                "audio": base64.b64encode(chunk).decode('utf-8'),
+                "agent_id": self.agent_id,
+                "message_kind": self.message_kind,
+                "transfer_id": transfer_id,
+                "chunk_index": chunk_index,
+                "chunk_count": chunk_count,
+                "trimmed_ms": trimmed_ms,
+                **codec_fields
+            }
+            if not self._publish(audio_dict):
+                break
+        return transfer_id, chunk_count
     
     def cleanup(self):
         self.stop_recording()
+        self.capture.close()
         self.audio.terminate()
-        self.client.loop_stop()
-        self.client.disconnect()
 
 class PlayerGUI:
-    def __init__(self, root, data_queue, action_publisher, agent_id, show_only_self=True):
+    def __init__(self, root, data_queue, action_publisher, agent_id, show_only_self=True, decode_workers=2,
+                 input_buffer_ms=0, rotation_preview=False):
         self.root = root
         self.data_queue = data_queue
         self.action_publisher = action_publisher
@@ -180,15 +360,23 @@ class PlayerGUI:
         self.start_time = None
         self.timer_label = None
         self.game_started = False
+        self.latency_tracker = None  # Will be set in main()
+        self.session_log = None  # Will be set in main() when recording
+        self.connection_state = None  # Set from the MQTT session thread
+        self.shown_connection_state = None
         self.mic_status = "muted"  # Track microphone status
         self.mic_timer = None  # Timer for mic unmute duration
         self.audio_publisher = None  # Will be set in main()
         self.current_message_kind = None  # Track current message kind
+        self.silence_detected = False  # Set from the recording thread when the speaker stopped
 
         self.root.configure(bg='#2C2F33')
         self.root.title("Player Interface")
         self.root.geometry("1000x1000")
         
+        # Connection status, only visible while the MQTT session is not connected
+        self.connection_label = tk.Label(self.root, text="", bg='#F04747', fg='white', font=('Arial', 12, 'bold'))
+
         # Crear un contenedor principal
         self.main_container = tk.Frame(self.root, bg='#2C2F33')
         self.main_container.pack(fill=tk.BOTH, expand=True)
@@ -248,11 +436,16 @@ class PlayerGUI:
         self.controls_panel = tk.Frame(self.right_panel, bg='#2C2F33')
         self.controls_panel.pack(fill=tk.BOTH, expand=True)
         
-        self.labels = []
-        self.img_resolution = (1000, 1000)
+        self.display_size = (400, 400)
+        # The network thread and the decoder workers wake the Tk loop when there is data
+        self.wakeup = TkWakeup(self.root, self.check_queue)
+        self.data_queue.on_put = self.wakeup.notify
+        self.frame_decoder = FrameDecoder(self.display_size, decode_workers,
+                                          on_drop=self.data_queue.discard, on_ready=self.wakeup.notify)
 
-        self.player_names = ["Player 1", "Player 2"]
-        self.number_of_players = 1 if show_only_self else 2
+        # With show_only_self=False every agent is drawn into one canvas, in a grid sized to the agent count
+        self.canvas_size = (800, 800)
+        self.view = None
 
         self.load_initial_images()
         self.load_communication_images()
@@ -260,17 +453,22 @@ class PlayerGUI:
         self.bind_keyboard_controls()
         self.able_to_move = False
         self.current_text = ""
-        self.check_queue()
+        # Optional local preview of turn actions, reconciled with the server's frames in update_gui
+        self.rotation_predictor = RotationPredictor() if rotation_preview else None
+        # input_buffer_ms > 0 keeps a key pressed just before our turn and sends it when the turn starts
+        self.action_pipeline = ActionPipeline(self.action_publisher, self.agent_id, self.root.after,
+                                              can_send=lambda: self.able_to_move and self.game_started,
+                                              can_buffer=lambda: self.game_started, buffer_ms=input_buffer_ms,
+                                              on_send=self.preview_action)
+        self.poll_queue()
         self.update_timer()
 
     def check_server_response(self):
+        # No polling here: the game_started message wakes check_queue, whose update_gui
+        # comes back through start_game once the server confirms
         if self.game_started:
-            # Check if "go ahead" is in the text field
-            self.game_started = True
             self.start_frame.destroy()
             self.game_frame.pack(fill=tk.BOTH, expand=True)
-        else:
-            self.root.after(100, self.check_server_response)
     
     def start_game(self):
         self.action_publisher.publish_action(self.agent_id, "start")
@@ -281,6 +479,10 @@ class PlayerGUI:
         # Reset timer
         self.start_time = None
         self.game_started = False
+        self.frame_decoder.reset()
+        self.action_pipeline.reset()
+        if self.rotation_predictor:
+            self.rotation_predictor.reset()
         
         # Destroy all frames
         self.game_frame.destroy()
@@ -309,7 +511,6 @@ class PlayerGUI:
         self.timer_label = tk.Label(self.frame, text="Time: 00:00", bg='#2C2F33', font=('Arial', 12))
         self.timer_label.pack(anchor='nw', padx=5, pady=5)
         
-        self.labels = []
         self.load_initial_images()
         self.create_bottom_space()
         self.create_control_panel()
@@ -379,15 +580,8 @@ class PlayerGUI:
         self.rotate_right_img = ImageTk.PhotoImage(Image.fromarray(rotate_right))
 
 
-        # Initialize player images
-        for _ in range(self.number_of_players):
-            img_array = np.zeros((350, 350, 3), dtype=np.uint8)
-            img = Image.fromarray(img_array)
-            photo = ImageTk.PhotoImage(image=img)
-            label = tk.Label(self.frame, image=photo)
-            label.image = photo
-            self.labels.append(label)
-            label.pack()
+        # Initialize the player view, its label keeps one PhotoImage that frames are pasted into
+        self.view = AgentView(self.frame, self.agent_id, self.show_only_self, self.canvas_size)
             
     def load_communication_images(self):
         self.informativo_img = ImageTk.PhotoImage(Image.open("imgs/information.png").resize((30, 30)))
@@ -577,8 +771,8 @@ class PlayerGUI:
         # Start new 10 second timer
         self.mic_timer = self.root.after(10000, self.mute_mic)
         
-        # Handle the action
-        self.handle_action(action)
+        # Handle the action, never merged with movement
+        self.handle_action(action, coalesce=False)
         
     def mute_mic(self):
         self.mic_status = "muted"
@@ -610,9 +804,21 @@ class PlayerGUI:
         self.root.bind('t', lambda event: self.handle_comm_action("msg-agreement-request"))
         self.root.bind('y', lambda event: self.handle_comm_action("msg-agreement-evaluation"))
 
-    def handle_action(self, action):
-        if self.able_to_move and self.game_started:
-            self.action_publisher.publish_action(self.agent_id, action)
+    def handle_action(self, action, coalesce=True):
+        # Key auto-repeat is coalesced by the action pipeline, one action per ack or turn
+        if coalesce:
+            self.action_pipeline.submit(action)
+        else:
+            self.action_pipeline.send_now(action)
+
+    def preview_action(self, action, seq):
+        if self.rotation_predictor is None:
+            return
+        frame = self.rotation_predictor.predict(action, seq)
+        if frame is None:
+            return
+        self.view.show(self.agent_id, frame, True)
+        self.view.flush()
 
 
     def update_action_text(self, text):
@@ -653,9 +859,13 @@ class PlayerGUI:
         # Check for end game message
         for agent_id in data_dict:
             if data_dict[agent_id].get("end_game", False):
+                if self.session_log:
+                    self.session_log.control("end_game")
                 self.reset_game()
                 return
             elif data_dict[agent_id].get("game_started", False) and not self.game_started:
+                if self.session_log:
+                    self.session_log.control("game_started")
                 self.game_started = True
                 self.start_game()
                 return
@@ -667,93 +877,188 @@ class PlayerGUI:
             self.start_time = time.time()
             
         sorted_agents = sorted(data_dict.keys())
+        tile_size = self.view.layout(sorted_agents)
+        if tile_size is not None:
+            # New grid, decode straight to its tile size from now on
+            self.frame_decoder.display_size = tile_size
         
-        for i, agent_id in enumerate(sorted_agents):
+        for agent_id in sorted_agents:
             # Skip if we're only showing self and this isn't our agent
             if self.show_only_self and agent_id != self.agent_id:
+                self.data_queue.discard(agent_id)
                 continue
                 
             agent_data = data_dict[agent_id]
             is_turn = agent_data.get("is_turn", False)
-            image_base64 = agent_data.get("image", "")
             text = agent_data.get("text", "")
-            orientation = agent_data.get("orientation", "0")
 
-            # Calculate the correct label index
-            label_index = 0 if self.show_only_self else i
+            # Frames normally arrive already decoded by the FrameDecoder workers
+            img_resized = agent_data.get("frame")
+            if img_resized is None:
+                img_resized = prepare_frame(agent_data, self.frame_decoder.display_size)
 
-            img_data = base64.b64decode(image_base64)
-            img_array = np.frombuffer(img_data, dtype=np.uint8)
-            img_array = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+            if agent_id == self.agent_id and self.rotation_predictor:
+                img_resized = self.rotation_predictor.reconcile(agent_data, img_resized)
 
-            img_resized = cv2.resize(img_array, self.img_resolution, interpolation=cv2.INTER_NEAREST)
-            
-            
-            # Resize to 400x400 with Lanczos interpolation for high quality downscaling
-            img_resized_small = cv2.resize(img_resized, (400, 400), interpolation=cv2.INTER_LANCZOS4)
-            img_resized = img_resized_small
-            
-            if orientation == "1":  # Right - rotate left once
-                img_resized = np.rot90(img_resized, 1)
-            elif orientation == "2":  # Down - rotate left twice
-                img_resized = np.rot90(img_resized, 2)
-            elif orientation == "3":  # Left - rotate left three times
-                img_resized = np.rot90(img_resized, 3)
-            # orientation == 0 means up, no rotation needed
-
-            img = Image.fromarray(img_resized)
-            photo = ImageTk.PhotoImage(image=img)
-            label = self.labels[label_index]
-            label.configure(image=photo)
-            label.image = photo
+            # Our label, or the shared canvas which goes to Tk once after the loop
+            self.view.show(agent_id, img_resized, is_turn)
+            if self.latency_tracker:
+                self.latency_tracker.frame_shown(agent_data, agent_id == self.agent_id)
+            self.data_queue.mark_rendered(agent_id)
 
             if is_turn:
-                label.config(borderwidth=5, relief="solid", highlightthickness=5, highlightbackground="green")
                 if agent_id == self.agent_id:
                     self.update_text(text)
-                    self.able_to_move = True
+                    if not self.able_to_move:
+                        self.able_to_move = True
+                        self.action_pipeline.turn_started()
                 else:
                     self.able_to_move = False
             else:
-                label.config(borderwidth=5, relief="solid", highlightthickness=0)
                 if agent_id == self.agent_id:
                     self.able_to_move = False
 
+        if self.agent_id in data_dict:
+            # After the turn state, so an action that ended our turn releases nothing
+            self.action_pipeline.acknowledged(data_dict[self.agent_id].get("last_action_seq"))
+        self.view.flush()
+        if self.session_log:
+            # Written by the log's own thread, this only queues the shown entries
+            self.session_log.frames(data_dict, self.visible_agents(data_dict))
+
     def update_text(self, text):
-        self.current_text = f"Texto: {text}"
-        self.text_scroll.config(state='normal')
-        self.text_scroll.delete(1.0, tk.END)
-        self.text_scroll.insert(tk.END, self.current_text)
-        self.text_scroll.config(state='disabled')
+        self.current_text = show_turn_text(self.text_scroll, text)
         self.root.update()
 
+    def is_control(self, data_dict):
+        return has_flag(data_dict, "end_game") or (has_flag(data_dict, "game_started") and not self.game_started)
+
+    def visible_agents(self, data_dict):
+        if self.show_only_self:
+            return [self.agent_id]
+        return list(data_dict.keys())
+
     def check_queue(self):
-        while not self.data_queue.empty():
+        # Control messages are handled right away, frames are decoded by the worker pool
+        while self.frame_decoder.has_capacity() and not self.data_queue.empty():
             data_dict = self.data_queue.get()
-            self.update_gui(data_dict)
-        self.root.after(100, self.check_queue)
+            stamp(data_dict, "_t_dequeue")
+            if self.is_control(data_dict):
+                self.update_gui(data_dict)
+            else:
+                self.frame_decoder.submit(data_dict, self.visible_agents(data_dict))
+
+        decoded = self.frame_decoder.latest()
+        if decoded is not None:
+            self.update_gui(decoded)
+
+        if self.connection_state != self.shown_connection_state:
+            self.update_connection_label()
+
+        if self.silence_detected:
+            # The speaker went quiet, close the mic window early
+            self.silence_detected = False
+            if self.mic_status == "unmuted":
+                if self.mic_timer:
+                    self.root.after_cancel(self.mic_timer)
+                self.mute_mic()
+
+    def on_silence(self):
+        # Called from the audio recording thread
+        self.silence_detected = True
+        self.wakeup.notify()
+
+    def on_connection_state(self, state, stats):
+        # Called from the MQTT session thread, the label is updated on the Tk thread
+        self.connection_state = state
+        self.wakeup.notify()
+
+    def update_connection_label(self):
+        state = self.connection_state
+        self.shown_connection_state = state
+        if state == "connected":
+            self.connection_label.pack_forget()
+        else:
+            self.connection_label.config(text="Conectando al servidor..." if state == "connecting"
+                                         else "Conexión perdida, reconectando...")
+            self.connection_label.pack(side=tk.TOP, fill=tk.X, before=self.main_container)
+
+    def poll_queue(self):
+        # Safety net only, new frames and finished decodes wake check_queue through self.wakeup
+        self.check_queue()
+        self.root.after(1000, self.poll_queue)
         
         
-def main(port: int, agent_id: str="1"):
+def main(port: int, agent_id: str="1", per_agent_topic: bool=False, latency_log: str=None,
+         audio_streaming: bool=False, audio_profile: str="pcm44k", capture_rate: int=44100, vad: bool=False,
+         vad_early_stop_ms: int=None, input_buffer_ms: int=0, rotation_preview: bool=False,
+         all_agents: bool=False, session_log: str=None, audio_chunk_kb: int=None):
     broker_address = "172.24.98.252"  # Cambia esta dirección según sea necesario
     data_topic = "topic/data"
+    if per_agent_topic:
+        # Only our own view, split out of topic/data by topic_bridge.py
+        data_topic = agent_topic(data_topic, agent_id)
     actions_topic = "topic/actions"
 
-    data_queue = queue.Queue()
+    # Keeps only the latest frame per agent so the GUI never renders stale frames
+    data_queue = FrameMailbox()
 
-    action_publisher = ActionPublisher(broker_address, actions_topic, port)
-    audio_publisher = AudioPublisher(broker_address, agent_id, port)
+    # One MQTT connection for everything, reconnects on its own after a network blip
+    session = MqttSession(broker_address, port).start()
+    action_publisher = ActionPublisher(session, actions_topic)
+    audio_publisher = AudioPublisher(session, agent_id, streaming=audio_streaming, profile=audio_profile,
+                                     capture_rate=capture_rate, vad=vad, early_stop_ms=vad_early_stop_ms,
+                                     chunk_kb=audio_chunk_kb)
 
     root = tk.Tk()
-    gui = PlayerGUI(root, data_queue, action_publisher, agent_id)
+    gui = PlayerGUI(root, data_queue, action_publisher, agent_id, input_buffer_ms=input_buffer_ms,
+                    rotation_preview=rotation_preview, show_only_self=not all_agents)
+
+    # Timestamps from action publish / MQTT receive to label update
+    latency_tracker = LatencyTracker()
+    gui.latency_tracker = latency_tracker
+    action_publisher.latency_tracker = latency_tracker
+
+    # Optional on-disk record of what this participant saw and did
+    recorder = None
+    if session_log:
+        recorder = SessionLog(session_log, f"{agent_id}_{time.strftime('%Y%m%d_%H%M%S')}", own_id=agent_id)
+        gui.session_log = recorder
+        action_publisher.session_log = recorder
+        audio_publisher.session_log = recorder
     gui.audio_publisher = audio_publisher  # Set the audio publisher
+    audio_publisher.on_silence = gui.on_silence
     
-    subscriber = DataSubscriber(broker_address, data_topic, data_queue, gui, port)
+    subscriber = DataSubscriber(session, data_topic, data_queue, gui)
+    session.add_listener(gui.on_connection_state)
     
     # Set up cleanup on window close
     def on_closing():
+        # First stop waking Tk: the network and decoder threads must not wait on this thread
+        # while it joins them below
+        data_queue.on_put = None
+        gui.wakeup.close()
+        print(f"Frame stats: {data_queue.stats()}")
+        print(f"Decoder stats: {gui.frame_decoder.stats()}")
+        print(f"Delta stats: {subscriber.compositor.stats()}")
+        print(f"Atlas stats: {subscriber.atlas_store.stats()}")
+        print(f"Display stats: {gui.view.stats()}")
+        print(f"Wakeup stats: {gui.wakeup.stats()}")
+        print(f"Latency: {latency_tracker.summary()}")
+        print(f"MQTT session: {session.stats()}")
+        print(f"Action stats: {gui.action_pipeline.stats()}")
+        if gui.rotation_predictor:
+            print(f"Rotation preview stats: {gui.rotation_predictor.stats()}")
+        if latency_log:
+            print(f"Latency histograms written to {latency_tracker.export(latency_log)}")
+        gui.frame_decoder.shutdown()
         if gui.audio_publisher:
+            print(f"Audio capture: {gui.audio_publisher.capture.stats()}")
             gui.audio_publisher.cleanup()
+        session.close()
+        if recorder:
+            recorder.close()
+            print(f"Session log {recorder.base}: {recorder.stats()}")
         root.destroy()
     
     root.protocol("WM_DELETE_WINDOW", on_closing)
@@ -765,6 +1070,31 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, default=8085)
     parser.add_argument("--agent_id", type=str, default="1")
+    parser.add_argument("--per_agent_topic", action="store_true",
+                        help="Subscribe to topic/data/<agent_id> (needs topic_bridge.py running)")
+    parser.add_argument("--latency_log", type=str, default=None,
+                        help="Write latency histograms to this JSON file when the window closes")
+    parser.add_argument("--audio_streaming", action="store_true",
+                        help="Stream audio chunks while the mic is open instead of one WAV after it closes")
+    parser.add_argument("--audio_profile", type=str, choices=sorted(PROFILES), default="pcm44k",
+                        help="Rate and codec of the audio sent on topic/audio (compressed profiles are opt-in)")
+    parser.add_argument("--audio_chunk_kb", type=int, default=None,
+                        help="Split each recording in messages of this size (needs audio_receiver.py on the other end)")
+    parser.add_argument("--capture_rate", type=int, default=44100, help="Microphone sample rate")
+    parser.add_argument("--vad", action="store_true",
+                        help="Trim the silence before and after speech (the whole mic window is sent otherwise)")
+    parser.add_argument("--vad_early_stop_ms", type=int, default=None,
+                        help="With --vad, close the mic after this much silence following speech (off by default)")
+    parser.add_argument("--input_buffer_ms", type=int, default=0,
+                        help="Keep a key pressed up to this long before our turn and send it when the turn starts")
+    parser.add_argument("--rotation_preview", action="store_true",
+                        help="Show turn left/right right away by rotating the last frame, before the server answers")
+    parser.add_argument("--all_agents", action="store_true",
+                        help="Show every agent's view in one grid instead of only ours (not with --per_agent_topic)")
+    parser.add_argument("--session_log", type=str, default=None,
+                        help="Record frames, actions, turns and audio references to this directory")
     args = parser.parse_args()
     
-    main(args.port, args.agent_id)
+    main(args.port, args.agent_id, args.per_agent_topic, args.latency_log, args.audio_streaming, args.audio_profile,
+         args.capture_rate, args.vad, args.vad_early_stop_ms, args.input_buffer_ms, args.rotation_preview,
+         args.all_agents, args.session_log, args.audio_chunk_kb)
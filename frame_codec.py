@@ -0,0 +1,137 @@
+import base64
+import json
+import struct
+
+# Binary envelope for topic/data. Old publishers send JSON with base64 images, this sends the
+# encoded image bytes as they are after a small fixed header per agent:
+#
+#   envelope: MAGIC (3 bytes) | version u8 | agent count u8
+#   record:   agent id length u8 | orientation u8 | flags u8 | reserved u8 | text length u16 | image length u32
+#             | last action seq u32 (version 2 only, 0 = none)
+#             | agent id (utf-8) | text (utf-8) | image bytes
+#
+# MAGIC can never start a JSON document, so the subscriber can tell both formats apart.
+MAGIC = b"\x93MF"
+VERSION = 2
+ENVELOPE = struct.Struct("<3sBB")
+RECORD_V1 = struct.Struct("<BBBBHI")
+RECORD = struct.Struct("<BBBBHII")
+
+FLAG_IS_TURN = 0x01
+FLAG_END_GAME = 0x02
+FLAG_GAME_STARTED = 0x04
+FLAG_TILED = 0x08  # image bytes hold a keyframe or tile delta, see tile_delta.py
+FLAG_SYMBOLIC = 0x10  # image bytes hold a sprite index grid, see sprite_atlas.py
+
+FLAG_KEYS = (
+    (FLAG_IS_TURN, "is_turn"),
+    (FLAG_END_GAME, "end_game"),
+    (FLAG_GAME_STARTED, "game_started"),
+    (FLAG_TILED, "tiled"),
+    (FLAG_SYMBOLIC, "symbolic"),
+)
+
+
+class FrameFormatError(ValueError):
+    pass
+
+
+def is_binary(payload):
+    return bytes(payload[:len(MAGIC)]) == MAGIC
+
+
+def decode_payload(payload):
+    if is_binary(payload):
+        return decode_binary(payload)
+    return json.loads(bytes(payload).decode('utf-8'))
+
+
+def decode_binary(payload):
+    view = memoryview(payload)
+    if len(view) < ENVELOPE.size:
+        raise FrameFormatError("Truncated frame envelope")
+    magic, version, agent_count = ENVELOPE.unpack_from(view, 0)
+    if magic != MAGIC or version not in (1, VERSION):
+        raise FrameFormatError(f"Unsupported frame envelope version {version}")
+    record = RECORD if version == VERSION else RECORD_V1
+
+    data_dict = {}
+    offset = ENVELOPE.size
+    for _ in range(agent_count):
+        if offset + record.size > len(view):
+            raise FrameFormatError("Truncated frame record")
+        id_len, orientation, flags, _reserved, text_len, image_len, *action_seq = record.unpack_from(view, offset)
+        offset += record.size
+        end = offset + id_len + text_len + image_len
+        if end > len(view):
+            raise FrameFormatError("Truncated frame record")
+
+        agent_id = str(view[offset:offset + id_len], 'utf-8')
+        offset += id_len
+        text = str(view[offset:offset + text_len], 'utf-8')
+        offset += text_len
+
+        agent_data = {"orientation": str(orientation), "text": text}
+        if action_seq and action_seq[0]:
+            agent_data["last_action_seq"] = action_seq[0]
+        for flag, key in FLAG_KEYS:
+            if flags & flag:
+                agent_data[key] = True
+        # Slice of the MQTT payload, no copy until cv2.imdecode reads it
+        agent_data["image_bytes"] = view[offset:end]
+        offset = end
+        data_dict[agent_id] = agent_data
+    return data_dict
+
+
+def image_bytes(agent_data):
+    if "image_bytes" in agent_data:
+        return agent_data["image_bytes"]
+    return base64.b64decode(agent_data.get("image", ""))
+
+
+def encode_binary(data_dict):
+    # Reference encoder for publishers. Agent entries may hold raw "image_bytes" or a base64 "image".
+    parts = [ENVELOPE.pack(MAGIC, VERSION, len(data_dict))]
+    for agent_id, agent_data in data_dict.items():
+        agent_id_bytes = str(agent_id).encode('utf-8')
+        text_bytes = agent_data.get("text", "").encode('utf-8')
+        img_bytes = bytes(image_bytes(agent_data))
+        flags = 0
+        for flag, key in FLAG_KEYS:
+            if agent_data.get(key, False):
+                flags |= flag
+        parts.append(RECORD.pack(len(agent_id_bytes), int(agent_data.get("orientation", "0")), flags, 0,
+                                 len(text_bytes), len(img_bytes), agent_data.get("last_action_seq", 0)))
+        parts.extend((agent_id_bytes, text_bytes, img_bytes))
+    return b"".join(parts)
+
+
+def encode_json(data_dict):
+    # Legacy JSON + base64 format, what the current server publishes
+    json_dict = {}
+    for agent_id, agent_data in data_dict.items():
+        agent_json = {key: value for key, value in agent_data.items() if key != "image_bytes"}
+        if "image_bytes" in agent_data:
+            agent_json["image"] = base64.b64encode(bytes(agent_data["image_bytes"])).decode('utf-8')
+        json_dict[str(agent_id)] = agent_json
+    return json.dumps(json_dict)
+
+
+def encode_payload(data_dict, wire_format="json"):
+    if wire_format == "binary":
+        return encode_binary(data_dict)
+    return encode_json(data_dict)
+
+
+def agent_topic(data_topic, agent_id):
+    # Per-agent topic carrying only that agent's entry, e.g. topic/data/1
+    return f"{data_topic}/{agent_id}"
+
+
+def split_by_agent(data_dict):
+    # One message per agent. Control flags are copied to every agent so each client still sees them.
+    control = {key: True for key in ("end_game", "game_started")
+               if any(isinstance(agent_data, dict) and agent_data.get(key, False) for agent_data in data_dict.values())}
+    for agent_id, agent_data in data_dict.items():
+        yield agent_id, {agent_id: dict(agent_data, **control)}
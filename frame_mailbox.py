@@ -0,0 +1,88 @@
+import threading
+from collections import Counter, deque
+
+
+def has_flag(data_dict, key):
+    for agent_data in data_dict.values():
+        if isinstance(agent_data, dict) and agent_data.get(key, False):
+            return True
+    return False
+
+
+class FrameMailbox:
+    # Drop-in replacement for the queue.Queue shared by DataSubscriber and PlayerGUI.
+    # Frames are coalesced per agent so the GUI only ever sees the latest snapshot,
+    # while control messages (end_game, game_started) are kept in arrival order.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = deque()  # each entry is ("frames", {agent_id: agent_data}) or ("control", data_dict)
+        self.received = Counter()
+        self.rendered = Counter()
+        self.dropped = Counter()
+        self.start_seen = False
+        self.on_put = None  # called after every put, e.g. to wake the Tk loop
+
+    def put(self, data_dict):
+        self._put(data_dict)
+        if self.on_put:
+            self.on_put()
+
+    def _put(self, data_dict):
+        with self.lock:
+            # end_game is always a barrier. game_started only matters the first time it is seen,
+            # afterwards the server may keep the flag set on regular frames and those can coalesce.
+            if has_flag(data_dict, "end_game"):
+                self.start_seen = False
+                self.entries.append(("control", data_dict))
+                return
+            if has_flag(data_dict, "game_started") and not self.start_seen:
+                self.start_seen = True
+                self.entries.append(("control", data_dict))
+                return
+
+            for agent_id in data_dict:
+                self.received[agent_id] += 1
+
+            # Merge into the trailing frame batch; anything it replaces was never shown
+            if self.entries and self.entries[-1][0] == "frames":
+                pending = self.entries[-1][1]
+                for agent_id, agent_data in data_dict.items():
+                    if agent_id in pending:
+                        self.dropped[agent_id] += 1
+                    pending[agent_id] = agent_data
+            else:
+                self.entries.append(("frames", dict(data_dict)))
+
+    def get(self):
+        with self.lock:
+            return self.entries.popleft()[1]
+
+    def empty(self):
+        with self.lock:
+            return not self.entries
+
+    def mark_rendered(self, agent_id):
+        with self.lock:
+            self.rendered[agent_id] += 1
+
+    def discard(self, agent_id):
+        # Frames pulled from the mailbox but never shown (e.g. filtered out by show_only_self)
+        with self.lock:
+            self.dropped[agent_id] += 1
+
+    def stats(self):
+        with self.lock:
+            agents = sorted(set(self.received) | set(self.rendered) | set(self.dropped))
+            return {
+                "frames_received": sum(self.received.values()),
+                "frames_rendered": sum(self.rendered.values()),
+                "frames_dropped": sum(self.dropped.values()),
+                "per_agent": {
+                    agent_id: {
+                        "received": self.received[agent_id],
+                        "rendered": self.rendered[agent_id],
+                        "dropped": self.dropped[agent_id],
+                    }
+                    for agent_id in agents
+                },
+            }
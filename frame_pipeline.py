@@ -0,0 +1,317 @@
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+
+from frame_codec import image_bytes
+
+
+def decode_image(agent_data):
+    # Works for both the binary envelope (raw bytes) and the JSON one (base64 string)
+    img_array = np.frombuffer(image_bytes(agent_data), dtype=np.uint8)
+    img_array = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+    if img_array is None:
+        raise ValueError("Could not decode frame image")
+    return img_array
+
+
+def rotation_steps(orientation):
+    # 0 = up (no rotation), 1 = right, 2 = down, 3 = left; each step rotates the view left once
+    return {"1": 1, "2": 2, "3": 3}.get(str(orientation), 0)
+
+
+UPSCALE_RESOLUTION = (1000, 1000)  # the intermediate size of the original two pass pipeline
+
+
+def scale_and_rotate_two_pass(img_array, img_resolution, display_size, orientation):
+    # Original pipeline, kept as the reference for the benchmark below
+    img_resized = cv2.resize(img_array, img_resolution, interpolation=cv2.INTER_NEAREST)
+
+    # Resize to display size with Lanczos interpolation for high quality downscaling
+    img_resized = cv2.resize(img_resized, display_size, interpolation=cv2.INTER_LANCZOS4)
+
+    return np.ascontiguousarray(np.rot90(img_resized, rotation_steps(orientation)))
+
+
+def _legacy_taps(src_len, upscale_len, dst_len):
+    # What the legacy resizes do along one axis: an identity image through INTER_NEAREST up to
+    # upscale_len and INTER_LANCZOS4 down to the display gives the weight of every texel in
+    # every display pixel. A display pixel mixes a few neighbouring texels (two while a texel
+    # is wider than the Lanczos window, sources under ~125 px a side): their indices and
+    # weights, heaviest first. The weights are not clamped to [0, 1], next to a texel edge
+    # Lanczos overshoots, which bilinear sampling can not reproduce.
+    weights = np.eye(src_len, dtype=np.float32)
+    weights = cv2.resize(weights, (upscale_len, src_len), interpolation=cv2.INTER_NEAREST)
+    weights = cv2.resize(weights, (dst_len, src_len), interpolation=cv2.INTER_LANCZOS4)
+    used = np.abs(weights) > 1e-6  # the Lanczos window leaves ~1e-34 on far taps
+    taps = min(int(used.sum(axis=0).max()), src_len)
+    first = np.minimum(np.argmax(used, axis=0), src_len - taps)
+    index = first + np.arange(taps)[:, np.newaxis]
+    weight = np.take_along_axis(weights, index, axis=0)
+    order = np.argsort(-weight, axis=0, kind="stable")
+    index = np.take_along_axis(index, order, axis=0)
+    weight = np.take_along_axis(weight, order, axis=0)
+    return list(zip(index, weight))
+
+
+def _blend_taps(taps, length):
+    # The taps as blendLinear steps: each one mixes the running result (which weighs the sum
+    # of the taps so far) with the next tap. None when a running sum gets too close to zero.
+    blends = []
+    total = np.zeros_like(taps[0][1])
+    for index, weight in taps:
+        if blends and np.abs(total).min() < 0.05:
+            return None
+        blends.append((index, np.repeat(total[:, np.newaxis], length, axis=1),
+                       np.repeat(weight[:, np.newaxis], length, axis=1)))
+        total = total + weight
+    return blends
+
+
+ROTATIONS = {1: cv2.ROTATE_90_COUNTERCLOCKWISE, 2: cv2.ROTATE_180, 3: cv2.ROTATE_90_CLOCKWISE}  # np.rot90 steps
+
+
+@functools.lru_cache(maxsize=32)
+def resize_tables(src_shape, display_size):
+    # Texel indices and per pixel weights of both passes, blendLinear takes a weight per
+    # pixel and every pixel of a row (or a column) has the same
+    src_h, src_w = src_shape
+    dst_w, dst_h = display_size
+    rows = _blend_taps(_legacy_taps(src_h, UPSCALE_RESOLUTION[1], dst_h), src_w)
+    cols = _blend_taps(_legacy_taps(src_w, UPSCALE_RESOLUTION[0], dst_w), dst_h)
+    if rows is None or cols is None:
+        return None
+    return rows, cols
+
+
+def _apply_taps(img, blends):
+    out = img[blends[0][0]]
+    for index, out_weight, weight in blends[1:]:
+        out = cv2.blendLinear(out, img[index], out_weight, weight)
+    return out
+
+
+def scale_and_rotate(img_array, display_size, orientation):
+    # The legacy resize + rotate from cached tables, without the full resolution intermediate.
+    # Both passes pick texel rows by index and blend them; the columns pass works on the
+    # transposed image so it picks rows too. The intermediate stays float32, like the
+    # fixed point buffer of cv2.resize, so the Lanczos overshoot is only saturated at the end.
+    tables = resize_tables(img_array.shape[:2], tuple(display_size))
+    if tables is None:
+        return scale_and_rotate_two_pass(img_array, UPSCALE_RESOLUTION, display_size, orientation)
+    rows, cols = tables
+    img = cv2.transpose(_apply_taps(img_array.astype(np.float32), rows))
+    img = cv2.transpose(cv2.add(_apply_taps(img, cols), 0.0, dtype=cv2.CV_8U))
+    steps = rotation_steps(orientation)
+    return cv2.rotate(img, ROTATIONS[steps]) if steps else img
+
+
+def prepare_frame(agent_data, display_size):
+    # Delta mode entries already carry the composited frame at source resolution,
+    # symbolic entries are drawn from their sprite atlas without any image decoding
+    img_array = agent_data.get("raw_frame")
+    if img_array is None and "grid" in agent_data:
+        img_array = agent_data["atlas"].render(agent_data["grid"])
+    if img_array is None:
+        img_array = decode_image(agent_data)
+    return scale_and_rotate(img_array, display_size, agent_data.get("orientation", "0"))
+
+
+def frame_key(agent_data, display_size):
+    # Content address of the source image. The base64 string is hashed as is, which is
+    # cheaper than decoding it first.
+    digest = hashlib.blake2b(digest_size=16)
+    if "raw_frame" in agent_data:
+        digest.update(np.ascontiguousarray(agent_data["raw_frame"]).data)
+    elif "grid" in agent_data:
+        digest.update(agent_data["atlas"].version)
+        digest.update(np.ascontiguousarray(agent_data["grid"]).data)
+    elif "image_bytes" in agent_data:
+        digest.update(agent_data["image_bytes"])
+    else:
+        digest.update(agent_data.get("image", "").encode('utf-8'))
+    return digest.digest(), str(agent_data.get("orientation", "0")), tuple(display_size)
+
+
+class FrameCache:
+    # Bounded LRU of display-ready frames. The server often republishes the same observation
+    # with only is_turn or text changed, those frames skip decode/scale/rotate entirely.
+    # Cached arrays are shared, so they are marked read-only.
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            frame = self.entries.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(self, key, frame):
+        frame.flags.writeable = False
+        with self.lock:
+            self.entries[key] = frame
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def prepare_cached_frame(agent_data, display_size, cache):
+    if cache is None or cache.max_entries <= 0:
+        return prepare_frame(agent_data, display_size)
+    key = frame_key(agent_data, display_size)
+    frame = cache.get(key)
+    if frame is None:
+        frame = prepare_frame(agent_data, display_size)
+        cache.put(key, frame)
+    return frame
+
+
+class FrameDecoder:
+    # Runs the decode/resize/rotate stage in a thread pool (OpenCV releases the GIL)
+    # so the Tk thread only has to swap the finished buffer into its label.
+    def __init__(self, display_size=(400, 400), workers=2, on_drop=None, cache_entries=32, on_ready=None):
+        self.display_size = display_size
+        self.cache = FrameCache(cache_entries)
+        self.workers = workers
+        self.on_drop = on_drop
+        self.on_ready = on_ready  # called from the worker thread when a decode finishes
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="frame-decoder")
+        self.lock = threading.Lock()
+        self.pending = deque()  # (generation, agent_ids, future) in submission order
+        self.generation = 0
+        self.decoded = 0
+        self.superseded = 0
+        self.errors = 0
+
+    def has_capacity(self):
+        # Leave frames in the mailbox (where they coalesce) while every worker is busy
+        with self.lock:
+            return len(self.pending) < self.workers
+
+    def busy(self):
+        with self.lock:
+            return bool(self.pending)
+
+    def submit(self, data_dict, agent_ids):
+        agent_ids = [agent_id for agent_id in agent_ids if agent_id in data_dict]
+        with self.lock:
+            future = self.executor.submit(self._decode, data_dict, agent_ids)
+            self.pending.append((self.generation, list(data_dict), future))
+        if self.on_ready:
+            future.add_done_callback(lambda _: self.on_ready())
+
+    def _decode(self, data_dict, agent_ids):
+        decoded = dict(data_dict)
+        for agent_id in agent_ids:
+            agent_data = dict(data_dict[agent_id])
+            agent_data["frame"] = prepare_cached_frame(agent_data, self.display_size, self.cache)
+            agent_data["_t_decoded"] = time.perf_counter()
+            decoded[agent_id] = agent_data
+        return decoded
+
+    def latest(self):
+        # Newest finished frame batch, anything older than it is dropped
+        with self.lock:
+            newest = None
+            for index, (generation, agent_ids, future) in enumerate(self.pending):
+                if future.done():
+                    newest = index
+            if newest is None:
+                return None
+            ready = [self.pending.popleft() for _ in range(newest + 1)]
+
+        result = None
+        for index, (generation, agent_ids, future) in enumerate(ready):
+            stale = generation != self.generation or index < len(ready) - 1
+            if stale:
+                future.cancel()
+                self.superseded += 1
+                self._drop(agent_ids)
+                continue
+            try:
+                result = future.result()
+                self.decoded += 1
+            except Exception as e:
+                self.errors += 1
+                self._drop(agent_ids)
+                print(f"Error al decodificar el frame: {e}")
+        return result
+
+    def reset(self):
+        # Called when the game restarts so frames decoded for the old game are never shown
+        with self.lock:
+            self.generation += 1
+
+    def _drop(self, agent_ids):
+        if self.on_drop:
+            for agent_id in agent_ids:
+                self.on_drop(agent_id)
+
+    def stats(self):
+        return {"decoded": self.decoded, "superseded": self.superseded, "errors": self.errors,
+                "cache": self.cache.stats()}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def benchmark(iterations=200, tiles=11, tile_size=8, display_size=(400, 400)):
+    # Synthetic sprite grid, roughly what a meltingpot observation looks like
+    rng = np.random.default_rng(0)
+    grid = rng.integers(0, 256, (tiles, tiles, 3), dtype=np.uint8)
+    img_array = np.repeat(np.repeat(grid, tile_size, axis=0), tile_size, axis=1)
+
+    for orientation in ("0", "1", "2", "3"):
+        legacy = scale_and_rotate_two_pass(img_array, UPSCALE_RESOLUTION, display_size, orientation)
+        single = scale_and_rotate(img_array, display_size, orientation)
+        diff = np.abs(legacy.astype(np.int16) - single.astype(np.int16))
+        print(f"orientation {orientation}: mean abs diff {diff.mean():.4f}, max {diff.max()}, "
+              f"pixels off by more than 1: {(diff > 1).mean() * 100:.1f}%")
+
+    for name, run in (("two pass (1000x1000 + Lanczos + rot90)",
+                       lambda o: scale_and_rotate_two_pass(img_array, UPSCALE_RESOLUTION, display_size, o)),
+                      ("cached resize tables", lambda o: scale_and_rotate(img_array, display_size, o))):
+        start = time.perf_counter()
+        for i in range(iterations):
+            run(str(i % 4))
+        elapsed = (time.perf_counter() - start) / iterations
+        print(f"{name}: {elapsed * 1000:.3f} ms/frame")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--tiles", type=int, default=11)
+    parser.add_argument("--tile_size", type=int, default=8)
+    args = parser.parse_args()
+
+    benchmark(args.iterations, args.tiles, args.tile_size)
@@ -0,0 +1,112 @@
+import json
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Latency instrumentation for the client. Every agent entry picks up perf_counter timestamps
+# as it moves through the client:
+#
+#   _t_arrival  MQTT message handed to DataSubscriber.on_message
+#   _t_recv     payload parsed and ready for the mailbox
+#   _t_dequeue  taken out of the mailbox by check_queue
+#   _t_decoded  decoded, scaled and rotated by a FrameDecoder worker
+#   shown       label updated (passed to frame_shown)
+#
+# ActionPublisher stamps every action with a sequence id. The server (or local_server.py)
+# echoes the last applied id as "last_action_seq" in the agent's entry, which gives the
+# action to next frame round trip.
+
+# Histogram buckets in milliseconds, 8 per decade from 10 us to 100 s
+BUCKET_EDGES_MS = np.logspace(-2, 5, 57)
+
+STAGES = (
+    ("parse", "_t_arrival", "_t_recv"),
+    ("mailbox", "_t_recv", "_t_dequeue"),
+    ("decode", "_t_dequeue", "_t_decoded"),
+    ("display", "_t_decoded", None),
+    ("receive_to_shown", "_t_recv", None),
+)
+
+
+class Histogram:
+    def __init__(self, max_samples=100000):
+        self.counts = np.zeros(len(BUCKET_EDGES_MS) + 1, dtype=np.int64)
+        self.samples = deque(maxlen=max_samples)  # recent samples, for percentiles
+        self.total = 0
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        self.counts[np.searchsorted(BUCKET_EDGES_MS, ms)] += 1
+        self.samples.append(ms)
+        self.total += 1
+
+    def summary(self):
+        if not self.samples:
+            return {"count": 0}
+        values = np.fromiter(self.samples, dtype=np.float64)
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {"count": self.total, "mean_ms": round(float(values.mean()), 3), "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3),
+                "max_ms": round(float(values.max()), 3)}
+
+
+class LatencyTracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {name: Histogram() for name, _, _ in STAGES}
+        self.histograms["action_to_frame"] = Histogram()
+        self.histograms["action_to_shown"] = Histogram()
+        self.sent = {}  # action seq -> perf_counter at publish
+        self.answered = set()
+
+    def action_sent(self, seq, timestamp=None):
+        with self.lock:
+            self.sent[seq] = time.perf_counter() if timestamp is None else timestamp
+            # Only keep the recent ones, the server echoes the last applied seq anyway
+            if len(self.sent) > 1000:
+                for old_seq in sorted(self.sent)[:500]:
+                    del self.sent[old_seq]
+                    self.answered.discard(old_seq)
+
+    def frame_shown(self, agent_data, own_agent=True, timestamp=None):
+        shown = time.perf_counter() if timestamp is None else timestamp
+        with self.lock:
+            for name, start_key, end_key in STAGES:
+                start = agent_data.get(start_key)
+                end = shown if end_key is None else agent_data.get(end_key)
+                if start is not None and end is not None:
+                    self.histograms[name].add(end - start)
+
+            seq = agent_data.get("last_action_seq")
+            if own_agent and seq in self.sent and seq not in self.answered:
+                # First frame that reflects this action
+                self.answered.add(seq)
+                if "_t_recv" in agent_data:
+                    self.histograms["action_to_frame"].add(agent_data["_t_recv"] - self.sent[seq])
+                self.histograms["action_to_shown"].add(shown - self.sent[seq])
+
+    def summary(self):
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in self.histograms.items()}
+
+    def export(self, path):
+        with self.lock:
+            report = {
+                "bucket_edges_ms": [round(float(edge), 4) for edge in BUCKET_EDGES_MS],
+                "stages": {
+                    name: dict(histogram.summary(), buckets=histogram.counts.tolist())
+                    for name, histogram in self.histograms.items()
+                },
+            }
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        return path
+
+
+def stamp(data_dict, key, timestamp=None):
+    now = time.perf_counter() if timestamp is None else timestamp
+    for agent_data in data_dict.values():
+        if isinstance(agent_data, dict):
+            agent_data[key] = now
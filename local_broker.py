@@ -0,0 +1,159 @@
+import queue
+import threading
+
+import paho.mqtt.client as mqtt
+
+# In-process stand-in for the MQTT broker. LoopbackClient implements the part of the paho
+# client API the clients use (callbacks, connect, loop/loop_start/stop, subscribe, publish), so
+# DataSubscriber, ActionPublisher and the local server can talk to each other with no network.
+# Every client delivers its messages on its own thread, like paho's network loop does.
+
+
+class LoopbackMessage:
+    def __init__(self, topic, payload, qos=0, retain=False):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+
+
+class LoopbackBroker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = []
+        self.retained = {}
+
+    def client(self, *args, **kwargs):
+        # Usable as a drop-in for mqtt.Client when passed as a client factory
+        return LoopbackClient(self)
+
+    def attach(self, client):
+        with self.lock:
+            self.clients.append(client)
+
+    def detach(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def subscribed(self, client, topic):
+        with self.lock:
+            retained = [message for message_topic, message in self.retained.items()
+                        if mqtt.topic_matches_sub(topic, message_topic)]
+        for message in retained:
+            client.deliver(message)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        message = LoopbackMessage(topic, payload, qos, retain)
+        with self.lock:
+            if retain:
+                self.retained[topic] = message
+            clients = list(self.clients)
+        for client in clients:
+            if client.matches(topic):
+                client.deliver(message)
+
+
+class LoopbackClient:
+    def __init__(self, broker):
+        self.broker = broker
+        self.on_connect = None
+        self.on_message = None
+        self.on_disconnect = None
+        self.on_publish = None
+        self.on_connect_fail = None
+        self.mid = 0
+        self.subscriptions = set()
+        self.inbox = queue.Queue()
+        self.thread = None
+        self.connected = False
+
+    def connect(self, host=None, port=None, keepalive=60):
+        self.broker.attach(self)
+        self.connected = True
+        self.inbox.put(("connect", None))
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def connect_async(self, host=None, port=None, keepalive=60):
+        # Connected once the loop runs, like paho
+        return self.connect(host, port, keepalive)
+
+    def reconnect(self):
+        return self.connect()
+
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        pass
+
+    def disconnect(self):
+        self.broker.detach(self)
+        self.connected = False
+        self.inbox.put(("disconnect", None))
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def is_connected(self):
+        return self.connected
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.add(topic)
+        self.broker.subscribed(self, topic)
+        return mqtt.MQTT_ERR_SUCCESS, 0
+
+    def unsubscribe(self, topic):
+        self.subscriptions.discard(topic)
+        return mqtt.MQTT_ERR_SUCCESS, 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.mid += 1
+        self.broker.publish(topic, payload, qos, retain)
+        # Delivered synchronously, so it counts as written right away
+        if self.on_publish:
+            self.on_publish(self, None, self.mid)
+        return mqtt.MQTTMessageInfo(self.mid)
+
+    def want_write(self):
+        return False
+
+    def matches(self, topic):
+        return any(mqtt.topic_matches_sub(subscription, topic) for subscription in self.subscriptions)
+
+    def deliver(self, message):
+        self.inbox.put(("message", message))
+
+    def loop_start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.loop_forever, daemon=True)
+            self.thread.start()
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_stop(self):
+        if self.thread is not None:
+            self.inbox.put(("stop", None))
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_forever(self):
+        while self.dispatch(self.inbox.get()):
+            pass
+
+    def loop(self, timeout=1.0):
+        # One iteration of the network loop, for callers that drive it themselves (MqttSession)
+        try:
+            self.dispatch(self.inbox.get(timeout=timeout))
+        except queue.Empty:
+            pass
+        return mqtt.MQTT_ERR_SUCCESS if self.connected else mqtt.MQTT_ERR_NO_CONN
+
+    def dispatch(self, item):
+        kind, message = item
+        if kind == "stop":
+            return False
+        if kind == "connect" and self.on_connect:
+            self.on_connect(self, None, {}, 0)
+        elif kind == "disconnect" and self.on_disconnect:
+            self.on_disconnect(self, None, 0)
+        elif kind == "message" and self.on_message:
+            self.on_message(self, None, message)
+        return True
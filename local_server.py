@@ -0,0 +1,235 @@
+import json
+import threading
+import time
+
+import numpy as np
+import cv2
+import paho.mqtt.client as mqtt
+
+from frame_codec import encode_payload
+from sprite_atlas import SpriteAtlas, encode_grid
+from tile_delta import TileDeltaEncoder
+
+# Local stand-in for the game server. It publishes synthetic sprite-grid frames on topic/data
+# and reacts to topic/actions, so the clients can be exercised without the real meltingpot
+# server. Only the message format is faithful, the game itself is a toy.
+
+TILE_COLORS = np.array([
+    [30, 30, 30],     # 0 floor
+    [90, 90, 90],     # 1 wall
+    [40, 180, 60],    # 2 apple
+    [200, 60, 60],    # 3 agent
+    [60, 60, 200],    # 4 other agent
+], dtype=np.uint8)
+
+MOVES = {
+    "move up": (-1, 0),
+    "move down": (1, 0),
+    "move left": (0, -1),
+    "move right": (0, 1),
+}
+
+
+class SyntheticGame:
+    def __init__(self, agent_ids, world_size=24, view_tiles=11, tile_size=8, seed=0):
+        self.agent_ids = [str(agent_id) for agent_id in agent_ids]
+        self.view_tiles = view_tiles
+        self.tile_size = tile_size
+        self.rng = np.random.default_rng(seed)
+
+        self.world = np.zeros((world_size, world_size), dtype=np.uint8)
+        self.world[self.rng.random(self.world.shape) < 0.15] = 2
+        self.world[0, :] = self.world[-1, :] = self.world[:, 0] = self.world[:, -1] = 1
+
+        self.positions = {}
+        self.orientations = {}
+        for i, agent_id in enumerate(self.agent_ids):
+            self.positions[agent_id] = (2 + 2 * i, 2 + i)
+            self.orientations[agent_id] = 0
+
+        self.turn_index = 0
+        self.step = 0
+        self.last_action_seq = {}
+        self.started = False
+
+        # Pre-rendered sprite for every tile kind, a filled square with a darker border
+        sprites = np.repeat(np.repeat(TILE_COLORS[:, np.newaxis, np.newaxis, :], tile_size, 1), tile_size, 2)
+        sprites[:, 0, :, :] //= 2
+        sprites[:, :, 0, :] //= 2
+        self.sprites = sprites
+
+    def current_agent(self):
+        return self.agent_ids[self.turn_index % len(self.agent_ids)]
+
+    def apply_action(self, agent_id, action, seq=None):
+        if agent_id != self.current_agent():
+            return False
+        if seq is not None:
+            # Echoed back in the next frames so the client can measure action round trips
+            self.last_action_seq[agent_id] = seq
+        if action in MOVES:
+            dy, dx = MOVES[action]
+            y, x = self.positions[agent_id]
+            if self.world[y + dy, x + dx] != 1:
+                self.positions[agent_id] = (y + dy, x + dx)
+                if self.world[y + dy, x + dx] == 2:
+                    self.world[y + dy, x + dx] = 0
+        elif action == "turn left":
+            self.orientations[agent_id] = (self.orientations[agent_id] - 1) % 4
+        elif action == "turn right":
+            self.orientations[agent_id] = (self.orientations[agent_id] + 1) % 4
+        elif action != "attack":
+            return False
+        self.turn_index += 1
+        self.step += 1
+        return True
+
+    def grid(self, agent_id):
+        # Tile indices around the agent, padded with walls outside the world
+        half = self.view_tiles // 2
+        y, x = self.positions[agent_id]
+        padded = np.pad(self.world, half, constant_values=1)
+        view = padded[y:y + self.view_tiles, x:x + self.view_tiles].copy()
+        for other_id, (oy, ox) in self.positions.items():
+            vy, vx = oy - y + half, ox - x + half
+            if 0 <= vy < self.view_tiles and 0 <= vx < self.view_tiles:
+                view[vy, vx] = 3 if other_id == agent_id else 4
+        return view
+
+    def render(self, agent_id):
+        view = self.sprites[self.grid(agent_id)]  # (rows, cols, tile, tile, 3)
+        rows, cols = view.shape[:2]
+        return view.transpose(0, 2, 1, 3, 4).reshape(rows * self.tile_size, cols * self.tile_size, 3)
+
+    def observation(self, agent_id):
+        is_turn = self.started and agent_id == self.current_agent()
+        observation = {
+            "is_turn": is_turn,
+            "orientation": str(self.orientations[agent_id]),
+            "text": "Your turn" if is_turn else "Wait for your turn",
+        }
+        if agent_id in self.last_action_seq:
+            observation["last_action_seq"] = self.last_action_seq[agent_id]
+        return observation
+
+    def atlas(self):
+        return SpriteAtlas(self.sprites)
+
+    def frame(self, encoders=None, atlas=None):
+        # With encoders (one TileDeltaEncoder per agent) the frame is sent in delta mode,
+        # with an atlas only the sprite grid is sent
+        data_dict = {}
+        for agent_id in self.agent_ids:
+            agent_data = self.observation(agent_id)
+            if atlas is not None:
+                agent_data["image_bytes"] = encode_grid(self.grid(agent_id), atlas.version)
+                agent_data["symbolic"] = True
+            elif encoders is not None:
+                agent_data["image_bytes"] = encoders[agent_id].encode(self.render(agent_id))
+                agent_data["tiled"] = True
+            else:
+                agent_data["image_bytes"] = cv2.imencode(".png", self.render(agent_id))[1].tobytes()
+            data_dict[agent_id] = agent_data
+        return data_dict
+
+    def control(self, key):
+        return {agent_id: {key: True} for agent_id in self.agent_ids}
+
+
+class LocalServer:
+    def __init__(self, broker_address, port, agent_ids, wire_format="json", fps=10.0,
+                 data_topic="topic/data", actions_topic="topic/actions", keyframe_interval=None, symbolic=False):
+        self.game = SyntheticGame(agent_ids)
+        self.wire_format = wire_format
+        self.interval = 1.0 / fps
+        self.data_topic = data_topic
+        self.actions_topic = actions_topic
+        self.keyframe_topic = "topic/keyframe"
+        self.atlas_topic = "topic/atlas"
+        self.sprite_atlas = self.game.atlas() if symbolic else None
+        self.encoders = None
+        if keyframe_interval:
+            self.encoders = {agent_id: TileDeltaEncoder(self.game.tile_size, keyframe_interval)
+                             for agent_id in self.game.agent_ids}
+        self.lock = threading.Lock()
+
+        self.client = mqtt.Client()
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        print(f"Local server trying to connect to {broker_address} on port {port}")
+        self.client.connect(broker_address, port, 60)
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe(self.actions_topic)
+            client.subscribe(self.keyframe_topic)
+            if self.sprite_atlas is not None:
+                client.subscribe(f"{self.atlas_topic}/request")
+                self.publish_atlas()
+        else:
+            print(f"Error al conectar al broker. Código de error: {rc}")
+
+    def on_message(self, client, userdata, message):
+        try:
+            action_dict = json.loads(message.payload.decode('utf-8'))
+        except json.JSONDecodeError as e:
+            print(f"Error al decodificar la acción: {e}")
+            return
+        if message.topic == f"{self.atlas_topic}/request":
+            if self.sprite_atlas is not None:
+                self.publish_atlas()
+            return
+        if message.topic == self.keyframe_topic:
+            agent_id = str(action_dict.get("agent_id"))
+            if self.encoders and agent_id in self.encoders:
+                with self.lock:
+                    self.encoders[agent_id].request_keyframe()
+            return
+        agent_id = str(action_dict.get("agent_id"))
+        action = action_dict.get("action")
+        with self.lock:
+            if action == "start":
+                if not self.game.started:
+                    self.game.started = True
+                    self.publish(self.game.control("game_started"))
+            else:
+                self.game.apply_action(agent_id, action, action_dict.get("seq"))
+
+    def publish_atlas(self):
+        # Retained, so clients that connect later get the atlas right away
+        self.client.publish(self.atlas_topic, self.sprite_atlas.to_bytes(), retain=True)
+
+    def publish(self, data_dict):
+        self.client.publish(self.data_topic, encode_payload(data_dict, self.wire_format))
+
+    def run(self):
+        self.client.loop_start()
+        try:
+            while True:
+                with self.lock:
+                    if self.game.started:
+                        self.publish(self.game.frame(self.encoders, self.sprite_atlas))
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.client.loop_stop()
+            self.client.disconnect()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--broker", type=str, default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--agents", type=str, default="1,2")
+    parser.add_argument("--format", type=str, choices=["json", "binary"], default="json")
+    parser.add_argument("--fps", type=float, default=10.0)
+    parser.add_argument("--delta", type=int, default=0, metavar="KEYFRAME_INTERVAL",
+                        help="Send tile deltas with a keyframe every KEYFRAME_INTERVAL frames")
+    parser.add_argument("--symbolic", action="store_true", help="Send sprite grids and publish the sprite atlas")
+    args = parser.parse_args()
+
+    LocalServer(args.broker, args.port, args.agents.split(","), args.format, args.fps,
+                keyframe_interval=args.delta, symbolic=args.symbolic).run()
@@ -0,0 +1,347 @@
+import random
+import threading
+import time
+from collections import deque
+
+import paho.mqtt.client as mqtt
+
+from latency import Histogram
+
+# One MQTT connection per client process, shared by DataSubscriber, ActionPublisher and
+# AudioPublisher. The session owns the paho client. Socket reads and writes only happen on
+# paho's own network thread (loop_start), and client.publish is only called by the session
+# thread, never with self.lock held: publish() from the GUI, the audio thread or a message
+# callback just queues the message and wakes the session thread. The session also:
+#
+#   - reconnects with jittered exponential backoff whenever the connection drops (or the
+#     broker is not reachable at start up). paho reconnects by itself, the session sets the
+#     delay it waits before every attempt with reconnect_delay_set
+#   - subscriptions are registered with subscribe(topic, callback) and renewed on every connect
+#   - publish(..., buffer=True) keeps messages (the actions) while disconnected and sends them
+#     after the reconnect, unless they are older than max_buffer_age
+#   - state changes ("connecting", "connected", "reconnecting", "closed") go to the listeners
+#     added with add_listener, together with the stats
+#
+# Outgoing messages go through two lanes. "control" (actions, keyframe and atlas requests) is
+# handed to paho as soon as the session thread wakes up, in publish order. "bulk" (audio
+# chunks) is only handed to paho when the control lane is empty and paho's outgoing queue is
+# too, paced to bulk_rate bytes per second, so an action never waits behind more than one bulk
+# chunk on the socket.
+LANES = ("control", "bulk")
+
+
+class MqttSession:
+    def __init__(self, broker_address, port, keepalive=10, min_backoff=0.25, max_backoff=8.0,
+                 buffer_size=64, max_buffer_age=5.0, bulk_rate=1000000, client_factory=mqtt.Client):
+        self.broker_address = broker_address
+        self.port = port
+        self.keepalive = keepalive
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.max_buffer_age = max_buffer_age
+
+        self.client = client_factory()
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+        self.client.on_publish = self.on_publish
+        self.client.on_connect_fail = self.on_connect_fail
+
+        self.lock = threading.Lock()
+        self.handlers = []  # (topic filter, callback)
+        self.listeners = []
+        self.outbox = deque()  # (time buffered, topic, payload, qos) while disconnected
+        self.buffer_size = buffer_size
+        self.state = "connecting"
+        self.attempt = 0
+        self.disconnected_at = time.perf_counter()
+        self.stopping = threading.Event()
+        self.wake = threading.Event()
+        self.thread = None
+
+        self.control = deque()  # (time queued, topic, payload, qos, buffer) for the session thread
+        self.bulk = deque()  # (time queued, topic, payload, qos)
+        self.bulk_rate = bulk_rate
+        self.bulk_allowance = 0.0
+        self.bulk_refilled = time.perf_counter()
+        # Send latency is measured from publish() to paho's on_publish (message written to the socket)
+        self.metrics_lock = threading.Lock()
+        self.in_flight = {}  # mid -> (lane, time queued)
+        self.published = {}  # mid -> time written, for messages written before publish() returned
+        self.lanes = {lane: {"sent": 0, "bytes": 0, "dropped": 0, "max_depth": 0,
+                             "send_latency": Histogram(max_samples=10000)} for lane in LANES}
+
+        self.connects = 0
+        self.disconnects = 0
+        self.failed_attempts = 0
+        self.buffered = 0
+        self.flushed = 0
+        self.expired = 0
+        self.overflowed = 0
+        self.reconnect_time = Histogram(max_samples=1000)
+
+    def start(self):
+        if self.thread is None:
+            print(f"Trying to connect to {self.broker_address} on port {self.port}")
+            self.client.reconnect_delay_set(self.min_backoff, self.min_backoff)
+            self.client.connect_async(self.broker_address, self.port, self.keepalive)
+            self.client.loop_start()
+            self.thread = threading.Thread(target=self.run, name="mqtt-session", daemon=True)
+            self.thread.start()
+        return self
+
+    def run(self):
+        # The only thread that calls client.publish, the network itself is paho's thread
+        while not self.stopping.is_set():
+            # Short timeout while bulk data is waiting so the pacing stays smooth
+            self.wake.wait(0.005 if self.bulk else 0.5)
+            self.wake.clear()
+            self.send_control()
+            if self.bulk:
+                self.send_bulk()
+
+    def backoff(self, reason):
+        # Called on paho's thread before it waits and reconnects. Full jitter on the upper half
+        # so a lab full of clients does not reconnect in lockstep
+        delay = min(self.max_backoff, self.min_backoff * 2 ** self.attempt)
+        delay *= random.uniform(0.5, 1.0)
+        self.attempt += 1
+        self.client.reconnect_delay_set(delay, delay)
+        self.set_state("reconnecting" if self.connects else "connecting")
+        print(f"MQTT connection unavailable ({reason}), retrying in {delay:.2f} s")
+
+    def on_connect_fail(self, client, userdata):
+        self.failed_attempts += 1
+        if not self.stopping.is_set():
+            self.backoff("connection failed")
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            # The broker closes the connection, paho reconnects after the backoff
+            print(f"Error al conectar al broker. Código de error: {rc}")
+            self.failed_attempts += 1
+            return
+        print("Conectado al broker MQTT")
+        with self.lock:
+            topics = sorted({topic for topic, _ in self.handlers})
+        for topic in topics:
+            client.subscribe(topic)
+
+        with self.lock:
+            # Moved to the control lane in the same step that sets the state, so nothing
+            # published meanwhile overtakes the buffered actions
+            now = time.perf_counter()
+            while self.outbox:
+                buffered_at, topic, payload, qos = self.outbox.popleft()
+                if now - buffered_at > self.max_buffer_age:
+                    self.expired += 1
+                    continue
+                self.control.append((buffered_at, topic, payload, qos, True))
+                self.flushed += 1
+
+            if self.connects:
+                self.reconnect_time.add(now - self.disconnected_at)
+            self.connects += 1
+            self.attempt = 0
+            self.state = "connected"
+        self.wake.set()
+        self.notify("connected")
+
+    def on_disconnect(self, client, userdata, rc):
+        if self.state == "connected":
+            self.connection_lost(rc)
+        elif not self.stopping.is_set():
+            # Refused or dropped before the CONNACK
+            self.backoff(mqtt.error_string(rc))
+
+    def connection_lost(self, rc):
+        with self.lock:
+            self.disconnects += 1
+            self.disconnected_at = time.perf_counter()
+            # Half sent bulk transfers are of no use after a reconnect
+            self.lanes["bulk"]["dropped"] += len(self.bulk)
+            self.bulk.clear()
+            # Control messages not handed to paho yet wait for the reconnect if they asked to
+            for entry in reversed(self.control):
+                self.keep(entry)
+            self.control.clear()
+        with self.metrics_lock:
+            self.in_flight.clear()
+            self.published.clear()
+        if self.stopping.is_set():
+            self.set_state("closed")
+            return
+        print(f"Desconectado del broker MQTT ({mqtt.error_string(rc)})")
+        self.backoff(mqtt.error_string(rc))
+
+    def on_message(self, client, userdata, message):
+        with self.lock:
+            handlers = list(self.handlers)
+        for topic, callback in handlers:
+            if mqtt.topic_matches_sub(topic, message.topic):
+                callback(client, userdata, message)
+
+    def subscribe(self, topic, callback):
+        with self.lock:
+            self.handlers.append((topic, callback))
+            connected = self.state == "connected"
+        if connected:
+            # on_connect may subscribe to it too, a second SUBSCRIBE is harmless
+            self.client.subscribe(topic)
+
+    def publish(self, topic, payload, qos=0, buffer=False, lane="control"):
+        # Returns True when the message was queued for the connection (or buffered). Safe from
+        # any thread, message callbacks included: it never waits on paho
+        queued_at = time.perf_counter()
+        with self.lock:
+            if self.state != "connected":
+                if not buffer or lane == "bulk":
+                    self.lanes[lane]["dropped"] += 1
+                    return False
+                self.buffer((queued_at, topic, payload, qos))
+                return True
+            if lane == "bulk":
+                self.bulk.append((queued_at, topic, payload, qos))
+                depth = len(self.bulk)
+            else:
+                self.control.append((queued_at, topic, payload, qos, buffer))
+                depth = len(self.control)
+            self.lanes[lane]["max_depth"] = max(self.lanes[lane]["max_depth"], depth)
+        self.wake.set()
+        return True
+
+    def buffer(self, entry):
+        # Called with self.lock held, keeps a control message for the next connection
+        if len(self.outbox) >= self.buffer_size:
+            self.outbox.popleft()
+            self.overflowed += 1
+        self.outbox.append(entry)
+        self.lanes["control"]["max_depth"] = max(self.lanes["control"]["max_depth"], len(self.outbox))
+        self.buffered += 1
+
+    def keep(self, entry):
+        # Called with self.lock held, for a queued control message the connection lost
+        queued_at, topic, payload, qos, buffer = entry
+        if buffer:
+            self.outbox.appendleft((queued_at, topic, payload, qos))
+            self.buffered += 1
+        else:
+            self.lanes["control"]["dropped"] += 1
+
+    def send_control(self):
+        # Session thread only, everything queued on the control lane in publish order
+        while True:
+            with self.lock:
+                if not self.control or self.state != "connected":
+                    return
+                entry = self.control.popleft()
+            if not self.send("control", *entry[:4]):
+                with self.lock:
+                    self.keep(entry)
+
+    def send(self, lane, queued_at, topic, payload, qos):
+        # Session thread only, never with self.lock held. paho's thread may write the message
+        # (and call on_publish) before publish returns, those show up in self.published
+        info = self.client.publish(topic, payload, qos)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            return False
+        with self.metrics_lock:
+            published_at = self.published.pop(info.mid, None)
+            if published_at is not None:
+                self.lanes[lane]["send_latency"].add(published_at - queued_at)
+            else:
+                self.in_flight[info.mid] = (lane, queued_at)
+            self.lanes[lane]["sent"] += 1
+            self.lanes[lane]["bytes"] += len(payload)
+        return True
+
+    def send_bulk(self):
+        # Session thread only. One chunk at a time, and only once paho has nothing left to write
+        now = time.perf_counter()
+        self.bulk_allowance = min(self.bulk_rate * 0.25,
+                                  self.bulk_allowance + (now - self.bulk_refilled) * self.bulk_rate)
+        self.bulk_refilled = now
+        if self.bulk_allowance < 0 or self.client.want_write():
+            return
+        with self.lock:
+            if not self.bulk or self.control or self.state != "connected":
+                return
+            queued_at, topic, payload, qos = self.bulk.popleft()
+        if self.send("bulk", queued_at, topic, payload, qos):
+            self.bulk_allowance -= len(payload)
+        else:
+            with self.lock:
+                self.lanes["bulk"]["dropped"] += 1
+
+    def on_publish(self, client, userdata, mid):
+        now = time.perf_counter()
+        with self.metrics_lock:
+            sent = self.in_flight.pop(mid, None)
+            if sent is None:
+                self.published[mid] = now
+            else:
+                lane, queued_at = sent
+                self.lanes[lane]["send_latency"].add(now - queued_at)
+
+    def add_listener(self, callback):
+        # callback(state, stats), called from paho's network thread
+        with self.lock:
+            self.listeners.append(callback)
+        callback(self.state, self.stats())
+
+    def set_state(self, state):
+        with self.lock:
+            if state == self.state:
+                return
+            self.state = state
+        self.notify(state)
+
+    def notify(self, state):
+        with self.lock:
+            listeners = list(self.listeners)
+        stats = self.stats()
+        for callback in listeners:
+            callback(state, stats)
+
+    def is_connected(self):
+        return self.state == "connected"
+
+    def stats(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "connects": self.connects,
+                "disconnects": self.disconnects,
+                "failed_attempts": self.failed_attempts,
+                "buffered": self.buffered,
+                "flushed": self.flushed,
+                "expired": self.expired,
+                "overflowed": self.overflowed,
+                "pending": len(self.outbox),
+                "reconnect_time": self.reconnect_time.summary(),
+                "lanes": self.lane_stats(),
+            }
+
+    def lane_stats(self):
+        depth = {"control": len(self.outbox) + len(self.control), "bulk": len(self.bulk)}
+        with self.metrics_lock:
+            return {
+                lane: dict({key: value for key, value in metrics.items() if key != "send_latency"},
+                           depth=depth[lane], in_flight=sum(1 for sent_lane, _ in self.in_flight.values()
+                                                            if sent_lane == lane),
+                           send_latency=metrics["send_latency"].summary())
+                for lane, metrics in self.lanes.items()
+            }
+
+    def close(self):
+        self.stopping.set()
+        self.wake.set()
+        try:
+            self.client.disconnect()
+        except OSError:
+            pass
+        if self.thread is not None:
+            self.client.loop_stop()
+            self.thread.join(timeout=2.0)
+            self.thread = None
+        self.set_state("closed")
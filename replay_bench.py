@@ -0,0 +1,348 @@
+import os
+import struct
+import threading
+import time
+import tkinter as tk
+import tracemalloc
+
+import numpy as np
+import paho.mqtt.client as mqtt
+
+from client_with_keys import ActionPublisher, DataSubscriber, PlayerGUI
+from frame_codec import encode_payload
+from frame_mailbox import FrameMailbox
+from frame_pipeline import FrameCache, FrameDecoder
+from latency import LatencyTracker, stamp
+from local_broker import LoopbackBroker
+from local_server import SyntheticGame
+from mqtt_session import MqttSession
+from tk_display import NullSurface
+
+# Record-and-replay harness for the client render path.
+#
+#   record:     python replay_bench.py record session.rec --broker <host> --port <port> --duration 60
+#   synthesize: python replay_bench.py synthesize session.rec --frames 2000 --format binary
+#   replay:     python replay_bench.py replay session.rec [--pace max|lockstep|realtime] [--display null|tk]
+#
+# A recording is every message seen on topic/# with its arrival time. Replay publishes them on
+# an in-process LoopbackBroker and runs them through DataSubscriber, FrameMailbox and a real
+# PlayerGUI (check_queue, FrameDecoder, update_gui), so the turn highlight, the turn text and
+# root.update() are part of what is measured. Both GUI displays need Tk (xvfb-run on a headless
+# machine): --display tk shows the frames, --display null does all the widget work but stops the
+# frames at the PIL image. --display none needs no display and measures the decode side only.
+
+RECORDING_MAGIC = b"MPREC1\n"
+RECORD = struct.Struct("<dHI")  # arrival time, topic length, payload length
+
+
+class RecordingWriter:
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(RECORDING_MAGIC)
+        self.count = 0
+
+    def write(self, timestamp, topic, payload):
+        topic_bytes = topic.encode('utf-8')
+        self.file.write(RECORD.pack(timestamp, len(topic_bytes), len(payload)))
+        self.file.write(topic_bytes)
+        self.file.write(payload)
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_recording(path):
+    with open(path, "rb") as f:
+        if f.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            raise ValueError(f"{path} is not a recording")
+        messages = []
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return messages
+            timestamp, topic_len, payload_len = RECORD.unpack(header)
+            topic = f.read(topic_len).decode('utf-8')
+            messages.append((timestamp, topic, f.read(payload_len)))
+
+
+def record(path, broker_address, port, topic="topic/#", duration=60.0):
+    writer = RecordingWriter(path)
+    lock = threading.Lock()
+
+    def on_connect(client, userdata, flags, rc):
+        client.subscribe(topic)
+
+    def on_message(client, userdata, message):
+        with lock:
+            writer.write(time.time(), message.topic, message.payload)
+
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(broker_address, port, 60)
+    client.loop_start()
+    try:
+        time.sleep(duration)
+    except KeyboardInterrupt:
+        pass
+    client.loop_stop()
+    client.disconnect()
+    writer.close()
+    print(f"Recorded {writer.count} messages to {path}")
+
+
+def synthesize(path, frames=1000, agents=("1", "2"), wire_format="json", fps=10.0, keyframe_interval=0,
+               symbolic=False):
+    # Recording made with the local server's synthetic game, for runs without any broker
+    from tile_delta import TileDeltaEncoder
+
+    game = SyntheticGame(agents)
+    game.started = True
+    atlas = game.atlas() if symbolic else None
+    encoders = None
+    if keyframe_interval:
+        encoders = {agent_id: TileDeltaEncoder(game.tile_size, keyframe_interval) for agent_id in game.agent_ids}
+    actions = ["move right", "move down", "turn left", "move left", "move up", "turn right", "attack"]
+
+    writer = RecordingWriter(path)
+    timestamp = time.time()
+    if atlas is not None:
+        writer.write(timestamp, "topic/atlas", atlas.to_bytes())
+    for i in range(frames):
+        if i % 3 == 0:
+            game.apply_action(game.current_agent(), actions[(i // 3) % len(actions)])
+        payload = encode_payload(game.frame(encoders, atlas), wire_format)
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        writer.write(timestamp + i / fps, "topic/data", payload)
+    writer.close()
+    print(f"Wrote {writer.count} synthetic messages to {path}")
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    values = np.asarray(values) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": len(values), "mean_ms": round(float(values.mean()), 3), "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3)}
+
+
+def player_gui(session, mailbox, display, workers, agent_id, cache_entries, latency_tracker):
+    # The keys client's PlayerGUI, already past the start screen. agent_id shows only that agent
+    # like the client does by default, without it every agent is drawn (--all_agents).
+    # display "null" keeps all the Tk widget work but stops the frames at the PIL image.
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        print(f"No display for PlayerGUI ({e}): run under xvfb-run, or use --display none")
+        return None
+    gui = PlayerGUI(root, mailbox, ActionPublisher(session, "topic/actions"), agent_id or "1",
+                    show_only_self=agent_id is not None, decode_workers=workers)
+    gui.frame_decoder.cache = FrameCache(cache_entries)
+    gui.latency_tracker = latency_tracker
+    gui.game_started = True
+    gui.check_server_response()
+    if display == "null":
+        gui.view.set_surface(NullSurface(gui.view.label))
+    return gui
+
+
+def render_pipeline(mailbox, decoder, agent_id, latency_tracker, finished):
+    # Without a display: the decode side of PlayerGUI.check_queue only, no Tk work is measured
+    ready = threading.Event()
+    mailbox.on_put = ready.set
+    decoder.on_ready = ready.set
+    surface = NullSurface()
+    while True:
+        ready.clear()
+        while decoder.has_capacity() and not mailbox.empty():
+            data_dict = mailbox.get()
+            stamp(data_dict, "_t_dequeue")
+            visible = [agent_id] if agent_id else list(data_dict)
+            decoder.submit(data_dict, visible)
+
+        decoded = decoder.latest()
+        if decoded is not None:
+            for agent, agent_data in decoded.items():
+                if "frame" not in agent_data:
+                    mailbox.discard(agent)
+                    continue
+                surface.show(agent_data["frame"])
+                latency_tracker.frame_shown(agent_data)
+                mailbox.mark_rendered(agent)
+        elif finished():
+            return
+        else:
+            ready.wait(0.05)
+
+
+def replay(path, pace="max", display="null", workers=2, agent_id=None, trace_memory=False, cache_entries=32):
+    # pace: "max" publishes as fast as possible (frames coalesce like they would under load),
+    # "lockstep" waits until each message is fully rendered before the next one (capacity of the
+    # render path, nothing is coalesced) and "realtime" keeps the recorded timing.
+    messages = read_recording(path)
+    if not messages:
+        print("Empty recording")
+        return None
+    if trace_memory:
+        tracemalloc.start()
+
+    broker = LoopbackBroker()
+    mailbox = FrameMailbox()
+    receive_times = []
+    latency_tracker = LatencyTracker()
+    session = MqttSession("loopback", 0, client_factory=broker.client).start()
+    DataSubscriber(session, "topic/data", mailbox, None)
+    original_on_message = session.client.on_message
+
+    def timed_on_message(client, userdata, message):
+        start = time.perf_counter()
+        original_on_message(client, userdata, message)
+        receive_times.append(time.perf_counter() - start)
+
+    session.client.on_message = timed_on_message
+    while not session.client.matches("topic/data"):
+        time.sleep(0.001)
+
+    publisher = broker.client()
+    publisher.connect()
+    done = threading.Event()
+    gui = None
+    if display != "none":
+        gui = player_gui(session, mailbox, display, workers, agent_id, cache_entries, latency_tracker)
+        if gui is None:
+            session.close()
+            return None
+        decoder = gui.frame_decoder
+    else:
+        decoder = FrameDecoder(workers=workers, on_drop=mailbox.discard, cache_entries=cache_entries)
+
+    def publish_all():
+        first = messages[0][0]
+        start = time.perf_counter()
+        for published, (timestamp, topic, payload) in enumerate(messages):
+            if pace == "realtime":
+                delay = (timestamp - first) - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            elif pace == "lockstep":
+                while len(receive_times) < published or not mailbox.empty() or decoder.busy():
+                    time.sleep(0.0001)
+            publisher.publish(topic, payload)
+        done.set()
+
+    def finished():
+        if not (done.is_set() and mailbox.empty() and not decoder.busy()):
+            return False
+        # Let the subscriber thread finish what the broker already handed it
+        time.sleep(0.05)
+        return mailbox.empty() and not decoder.busy()
+
+    start = time.perf_counter()
+    threading.Thread(target=publish_all, daemon=True).start()
+    if gui is not None:
+        # The client's own render path: TkWakeup -> check_queue -> update_gui, turn highlight,
+        # turn text and root.update() included
+        def check_finished():
+            if finished():
+                gui.root.quit()
+            else:
+                gui.root.after(20, check_finished)
+
+        gui.root.after(20, check_finished)
+        gui.root.mainloop()
+    else:
+        render_pipeline(mailbox, decoder, agent_id, latency_tracker, finished)
+    elapsed = time.perf_counter() - start
+
+    if gui is not None:
+        mailbox.on_put = None
+        gui.wakeup.close()
+    session.close()
+    decoder.shutdown()
+    display_stats = {}
+    if gui is not None:
+        display_stats = gui.view.stats()
+        gui.root.destroy()
+
+    stats = mailbox.stats()
+    report = {
+        "messages": len(messages),
+        "seconds": round(elapsed, 3),
+        "messages_per_s": round(len(messages) / elapsed, 1),
+        "frames_received": stats["frames_received"],
+        "frames_rendered": stats["frames_rendered"],
+        "frames_dropped": stats["frames_dropped"],
+        "rendered_per_s": round(stats["frames_rendered"] / elapsed, 1),
+        "stages": dict(on_message=percentiles(receive_times), **{
+            stage: summary for stage, summary in latency_tracker.summary().items() if not stage.startswith("action")
+        }),
+        "decoder": decoder.stats(),
+        "display": display_stats,
+    }
+    if trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report["traced_memory_peak_mb"] = round(peak / 2 ** 20, 2)
+    try:
+        import resource
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report["max_rss_mb"] = round(maxrss / (2 ** 20 if os.uname().sysname == "Darwin" else 2 ** 10), 2)
+    except ImportError:
+        pass
+    return report
+
+
+def print_report(report):
+    for key, value in report.items():
+        if key == "stages":
+            for stage, summary in value.items():
+                print(f"  {stage:>16}: {summary}")
+        else:
+            print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record")
+    record_parser.add_argument("path")
+    record_parser.add_argument("--broker", type=str, default="172.24.98.252")
+    record_parser.add_argument("--port", type=int, default=8085)
+    record_parser.add_argument("--topic", type=str, default="topic/#")
+    record_parser.add_argument("--duration", type=float, default=60.0)
+
+    synth_parser = subparsers.add_parser("synthesize")
+    synth_parser.add_argument("path")
+    synth_parser.add_argument("--frames", type=int, default=1000)
+    synth_parser.add_argument("--agents", type=str, default="1,2")
+    synth_parser.add_argument("--format", type=str, choices=["json", "binary"], default="json")
+    synth_parser.add_argument("--fps", type=float, default=10.0)
+    synth_parser.add_argument("--delta", type=int, default=0, metavar="KEYFRAME_INTERVAL")
+    synth_parser.add_argument("--symbolic", action="store_true")
+
+    replay_parser = subparsers.add_parser("replay")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("--pace", type=str, choices=["max", "lockstep", "realtime"], default="max")
+    replay_parser.add_argument("--display", type=str, choices=["null", "tk", "none"], default="null")
+    replay_parser.add_argument("--workers", type=int, default=2)
+    replay_parser.add_argument("--agent_id", type=str, default=None, help="Only render this agent, like the client (default: all agents)")
+    replay_parser.add_argument("--trace_memory", action="store_true")
+    replay_parser.add_argument("--cache_entries", type=int, default=32, help="0 disables the frame cache")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args.path, args.broker, args.port, args.topic, args.duration)
+    elif args.command == "synthesize":
+        synthesize(args.path, args.frames, args.agents.split(","), args.format, args.fps, args.delta, args.symbolic)
+    else:
+        report = replay(args.path, args.pace, args.display, args.workers, args.agent_id, args.trace_memory,
+                        args.cache_entries)
+        if report is not None:
+            print_report(report)
@@ -0,0 +1,419 @@
+import mmap
+import os
+import threading
+import time
+import tkinter as tk
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from agent_view import AgentView, show_turn_text
+from frame_pipeline import prepare_frame
+from session_log import INDEX_DTYPE, KINDS, MESSAGE_KINDS, agent_number, load_meta, message_kind_code, read_record, session_base
+
+# Replay of a session recorded with session_log.py. The log is memory mapped, the index as
+# well, and only its step and time columns are copied out (16 bytes per record) so every seek
+# is a binary search over contiguous arrays:
+#
+#   by step           np.searchsorted on step, the records of one step are contiguous
+#   by time           np.searchsorted on time, the step of the record at that moment
+#   by message_kind   the steps of every kind's records (the msg- action and the audio
+#                     reference) are collected once when the session is opened, a seek is a
+#                     binary search in that short list
+#
+# Frames are decoded only for the step on screen, from the PNG blob in the log, with the
+# clients' own prepare_frame (scale and rotation) and drawn by the clients' AgentView: our
+# agent in one label, or every agent in an AgentCanvas grid, with the same turn highlight and
+# turn text as in the game. "Only my agent" switches a multi-agent recording to the view the
+# participant had by default. A background worker decodes the next few steps after the
+# playhead into a small LRU so playback and stepping do not wait.
+
+
+class SessionReplay:
+    def __init__(self, path, agent_ids=None, display_size=(400, 400), prefetch=8, cache_entries=64):
+        self.base = session_base(path)
+        self.meta = load_meta(self.base)
+        self.started_at = self.meta["started_at"]
+        self.own_id = self.meta.get("own_id")
+
+        self.log_file = open(self.base + ".log", "rb")
+        self.log = mmap.mmap(self.log_file.fileno(), 0, access=mmap.ACCESS_READ)
+        rows = os.path.getsize(self.base + ".idx") // INDEX_DTYPE.itemsize
+        if not rows:
+            raise ValueError(f"Session {self.base} has no records")
+        self.index = np.memmap(self.base + ".idx", dtype=INDEX_DTYPE, mode="r", shape=(rows,))
+        # A log cut short by a crash: drop the index rows past its end
+        while rows and int(self.index[rows - 1]["offset"]) + int(self.index[rows - 1]["length"]) > len(self.log):
+            rows -= 1
+        self.index = self.index[:rows]
+        self.steps = np.ascontiguousarray(self.index["step"])
+        self.times = np.ascontiguousarray(self.index["time"])
+        self.last_step = int(self.steps[-1])
+        self.duration = float(self.times[-1] - self.started_at)
+        codes = np.asarray(self.index["message_kind"])
+        self.kind_steps = {int(code): self.steps[codes == code] for code in np.unique(codes[codes != 0])}
+
+        # Replay starts at the first frame (actions can be logged before it), the agents shown
+        # are the ones with a frame there unless given
+        first = 0
+        while first < rows - 1 and self.index[first]["kind"] != KINDS["frame"]:
+            first += 1
+        self.first_step = int(self.steps[first])
+        self.all_agent_ids = sorted(
+            meta["agent_id"] for kind, t, meta, blob in self.records(self.first_step) if kind == "frame")
+
+        self.prefetch_steps = prefetch
+        self.cache_entries = cache_entries
+        self.cache = OrderedDict()  # step -> (frames, info)
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.set_agents(agent_ids or self.all_agent_ids, display_size)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="replay-prefetch")
+        self.pending = set()
+        self.playhead = self.first_step
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.skipped = 0
+
+    def set_agents(self, agent_ids, display_size):
+        # Agents shown and their frame size. Cached and prefetched steps were decoded for the
+        # previous ones and are dropped
+        with self.lock:
+            self.agent_ids = list(agent_ids)
+            self.agent_numbers = {agent_number(agent_id) for agent_id in self.agent_ids}
+            self.display_size = display_size
+            self.generation += 1
+            self.cache.clear()
+
+    def rows_at(self, step):
+        lo = int(np.searchsorted(self.steps, step, "left"))
+        hi = int(np.searchsorted(self.steps, step, "right"))
+        return range(lo, hi)
+
+    def records(self, step):
+        return [read_record(self.log, int(self.index[row]["offset"])) for row in self.rows_at(step)]
+
+    def clamp(self, step):
+        return max(self.first_step, min(self.last_step, int(step)))
+
+    def step_at_time(self, seconds):
+        # Step on screen `seconds` after the recording started
+        row = int(np.searchsorted(self.times, self.started_at + seconds, "right")) - 1
+        return int(self.steps[max(0, row)])
+
+    def find_message(self, message_kind, step, forward=True):
+        # Step of the next (or previous) message of this kind, None when there is none
+        steps = self.kind_steps.get(message_kind_code(message_kind))
+        if steps is None:
+            return None
+        if forward:
+            i = int(np.searchsorted(steps, step, "right"))
+            return int(steps[i]) if i < len(steps) else None
+        i = int(np.searchsorted(steps, step, "left")) - 1
+        return int(steps[i]) if i >= 0 else None
+
+    def frame(self, step):
+        # Display-ready frames {agent_id: array} and what happened at this step
+        step = self.clamp(step)
+        self.playhead = step
+        with self.lock:
+            entry = self.cache.get(step)
+            if entry is not None:
+                self.cache.move_to_end(step)
+                self.hits += 1
+        if entry is None:
+            self.misses += 1
+            generation = self.generation
+            entry = self._decode(step)
+            self._store(step, entry, generation)
+        self.prefetch(step)
+        return entry
+
+    def prefetch(self, step):
+        for ahead in range(step + 1, min(self.last_step, step + self.prefetch_steps) + 1):
+            with self.lock:
+                if ahead in self.cache or ahead in self.pending:
+                    continue
+                self.pending.add(ahead)
+            self.executor.submit(self._prefetch_one, ahead)
+
+    def _prefetch_one(self, step):
+        try:
+            # The playhead may have jumped away since this was queued
+            if self.playhead < step <= self.playhead + self.prefetch_steps:
+                generation = self.generation
+                self._store(step, self._decode(step), generation)
+                self.prefetched += 1
+            else:
+                self.skipped += 1
+        except Exception as e:
+            print(f"Error al decodificar el frame {step}: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(step)
+
+    def _store(self, step, entry, generation):
+        with self.lock:
+            if generation != self.generation:
+                return  # decoded for agents or a size no longer shown
+            self.cache[step] = entry
+            self.cache.move_to_end(step)
+            while len(self.cache) > self.cache_entries:
+                self.cache.popitem(last=False)
+
+    def _decode(self, step):
+        agent_ids, agent_numbers, display_size = self.agent_ids, self.agent_numbers, self.display_size
+        frames = {}
+        info = {"step": step, "time": None, "turns": {}, "text": {}, "actions": [], "audio": [], "control": []}
+        for row in self.rows_at(step):
+            entry = self.index[row]
+            if entry["kind"] == KINDS["frame"] and int(entry["agent"]) not in agent_numbers:
+                continue  # not shown, its blob is never read
+            kind, t, meta, blob = read_record(self.log, int(entry["offset"]))
+            if info["time"] is None:
+                info["time"] = t - self.started_at
+            if kind == "frame" and meta["agent_id"] in agent_ids:
+                agent_data = {"image_bytes": blob, "orientation": meta.get("orientation", "0")}
+                frames[meta["agent_id"]] = prepare_frame(agent_data, display_size)
+                info["turns"][meta["agent_id"]] = meta.get("is_turn", False)
+                info["text"][meta["agent_id"]] = meta.get("text", "")
+            elif kind == "action":
+                info["actions"].append(f"{meta['agent_id']}: {meta['action']}")
+            elif kind == "audio":
+                info["audio"].append(f"{meta['agent_id']}: {meta.get('message_kind')}")
+            elif kind == "control":
+                info["control"].append(meta["control"])
+        return frames, info
+
+    def stats(self):
+        with self.lock:
+            return {"records": len(self.index), "steps": self.last_step - self.first_step + 1,
+                    "cached": len(self.cache), "hits": self.hits, "misses": self.misses,
+                    "prefetched": self.prefetched, "prefetch_skipped": self.skipped}
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        del self.index
+        self.log.close()
+        self.log_file.close()
+
+
+class ReplayViewer:
+    def __init__(self, root, replay, fps=10.0, own_only=False):
+        self.root = root
+        self.replay = replay
+        self.interval = int(1000 / fps)
+        self.step = replay.first_step
+        self.target = replay.first_step
+        self.render_scheduled = False
+        self.playing = False
+
+        self.root.configure(bg='#2C2F33')
+        self.root.title(f"Replay {os.path.basename(replay.base)}")
+
+        # Drawn by the clients' AgentView, rebuilt when "Only my agent" is toggled
+        self.view_frame = tk.Frame(self.root, bg='#2C2F33')
+        self.view_frame.pack(padx=10, pady=10)
+        self.view = None
+        self.agent_ids = list(replay.agent_ids)
+        self.display_size = replay.display_size
+        self.own_only = tk.BooleanVar(value=own_only)
+        self.build_view()
+
+        # The turn text, where the client shows it under the view
+        self.text_scroll = tk.Text(self.root, wrap=tk.NONE, height=3, width=70,
+                                   bg='#99AAB5', fg='black', font=('Arial', 12))
+        self.text_scroll.pack(fill=tk.X, padx=10)
+        self.text_scroll.config(state='disabled')
+
+        self.info_label = tk.Label(self.root, text="", bg='#2C2F33', fg='white', font=('Arial', 12),
+                                   justify=tk.LEFT)
+        self.info_label.pack(fill=tk.X, padx=10)
+
+        self.scale = tk.Scale(self.root, from_=replay.first_step, to=replay.last_step, orient=tk.HORIZONTAL,
+                              showvalue=False, command=lambda value: self.seek(int(float(value))),
+                              bg='#2C2F33', fg='white', highlightthickness=0)
+        self.scale.pack(fill=tk.X, padx=10)
+
+        controls = tk.Frame(self.root, bg='#2C2F33')
+        controls.pack(pady=5)
+        tk.Button(controls, text="<", command=lambda: self.seek(self.step - 1)).pack(side=tk.LEFT)
+        self.play_button = tk.Button(controls, text="Play", width=6, command=self.toggle_play)
+        self.play_button.pack(side=tk.LEFT)
+        tk.Button(controls, text=">", command=lambda: self.seek(self.step + 1)).pack(side=tk.LEFT)
+
+        tk.Label(controls, text="Time (s or mm:ss):", bg='#2C2F33', fg='white').pack(side=tk.LEFT, padx=(15, 2))
+        self.time_entry = tk.Entry(controls, width=8)
+        self.time_entry.pack(side=tk.LEFT)
+        self.time_entry.bind('<Return>', lambda event: self.seek_time())
+
+        self.message_kind = tk.StringVar(value=MESSAGE_KINDS[0])
+        tk.OptionMenu(controls, self.message_kind, *MESSAGE_KINDS).pack(side=tk.LEFT, padx=(15, 2))
+        tk.Button(controls, text="Prev msg", command=lambda: self.seek_message(False)).pack(side=tk.LEFT)
+        tk.Button(controls, text="Next msg", command=lambda: self.seek_message(True)).pack(side=tk.LEFT)
+        if self.can_show_own_only():
+            tk.Checkbutton(controls, text="Only my agent", variable=self.own_only, command=self.toggle_own_only,
+                           bg='#2C2F33', fg='white', selectcolor='#23272A').pack(side=tk.LEFT, padx=(15, 0))
+
+        self.root.bind('<Left>', lambda event: self.seek(self.step - 1))
+        self.root.bind('<Right>', lambda event: self.seek(self.step + 1))
+        self.root.bind('<space>', lambda event: self.toggle_play())
+
+        self.render()
+
+    def can_show_own_only(self):
+        return len(self.agent_ids) > 1 and self.replay.own_id in self.agent_ids
+
+    def build_view(self):
+        # Like PlayerGUI: one agent in a label (ours with "Only my agent", or the only one shown),
+        # otherwise every agent in the AgentCanvas grid
+        if self.view is not None:
+            self.view.destroy()
+        shown = [self.replay.own_id] if self.own_only.get() and self.can_show_own_only() else self.agent_ids
+        own_id = shown[0] if len(shown) == 1 else self.replay.own_id
+        self.view = AgentView(self.view_frame, own_id, show_only_self=len(shown) == 1)
+        self.replay.set_agents(shown, self.view.layout(shown) or self.display_size)
+
+    def toggle_own_only(self):
+        self.build_view()
+        self.seek(self.step)
+
+    def seek(self, step):
+        # Dragging the scale fires for every pixel, only the latest target is rendered
+        self.target = self.replay.clamp(step)
+        if not self.render_scheduled:
+            self.render_scheduled = True
+            self.root.after_idle(self.render)
+
+    def seek_time(self):
+        text = self.time_entry.get().strip()
+        try:
+            minutes, _, seconds = text.rpartition(":")
+            seconds = float(seconds) + 60 * float(minutes or 0)
+        except ValueError:
+            return
+        self.seek(self.replay.step_at_time(seconds))
+
+    def seek_message(self, forward):
+        step = self.replay.find_message(self.message_kind.get(), self.step, forward)
+        if step is not None:
+            self.seek(step)
+
+    def render(self):
+        self.render_scheduled = False
+        self.step = self.target
+        frames, info = self.replay.frame(self.step)
+        for agent_id, frame in frames.items():
+            self.view.show(agent_id, frame, info["turns"].get(agent_id, False))
+        self.view.flush()
+        # The client updates the text on our turns only
+        if info["turns"].get(self.view.own_id):
+            show_turn_text(self.text_scroll, info["text"].get(self.view.own_id, ""))
+
+        seconds = info["time"] or 0.0
+        lines = [f"Step {self.step}/{self.replay.last_step}   {int(seconds // 60):02d}:{seconds % 60:05.2f}"]
+        for name in ("actions", "audio", "control"):
+            if info[name]:
+                lines.append(f"{name}: {', '.join(info[name])}")
+        self.info_label.config(text="\n".join(lines))
+        if int(self.scale.get()) != self.step:
+            self.scale.set(self.step)
+
+    def toggle_play(self):
+        self.playing = not self.playing
+        self.play_button.config(text="Pause" if self.playing else "Play")
+        if self.playing:
+            self.tick()
+
+    def tick(self):
+        if not self.playing:
+            return
+        if self.step >= self.replay.last_step:
+            self.toggle_play()
+            return
+        self.seek(self.step + 1)
+        self.root.after(self.interval, self.tick)
+
+
+def benchmark(steps=5000, agents=2, seeks=200):
+    # Records a synthetic session, then times random seeks and sequential playback
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        _benchmark(directory, steps, agents, seeks)
+
+
+def _benchmark(directory, steps, agents, seeks):
+    from local_server import MOVES, SyntheticGame
+    from session_log import SessionLog
+
+    game = SyntheticGame(range(1, agents + 1))
+    game.started = True
+    rng = np.random.default_rng(0)
+    log = SessionLog(directory, "bench", own_id="1", max_pending=100000)
+    start = time.perf_counter()
+    for step in range(steps):
+        agent_id = game.current_agent()
+        action = list(MOVES)[rng.integers(len(MOVES))]
+        log.action(agent_id, action, step)
+        game.apply_action(agent_id, action, step)
+        if step % 500 == 250:
+            log.audio({"agent_id": agent_id, "message_kind": MESSAGE_KINDS[step // 500 % len(MESSAGE_KINDS)]})
+        log.frames(game.frame(), game.agent_ids)
+    log.close()
+    print(f"Recorded {steps} steps in {time.perf_counter() - start:.1f} s: {log.stats()}")
+
+    start = time.perf_counter()
+    replay = SessionReplay(os.path.join(directory, "bench"))
+    print(f"Open: {(time.perf_counter() - start) * 1000:.2f} ms, {len(replay.index)} index rows, "
+          f"agents {replay.agent_ids}")
+
+    timings = []
+    for step in rng.integers(replay.first_step, replay.last_step + 1, seeks):
+        start = time.perf_counter()
+        replay.frame(int(step))
+        timings.append(time.perf_counter() - start)
+    print(f"Random seek + decode: median {np.median(timings) * 1000:.2f} ms, max {np.max(timings) * 1000:.2f} ms")
+
+    start = time.perf_counter()
+    for seconds in rng.uniform(0, replay.duration, seeks):
+        replay.step_at_time(seconds)
+    for step in rng.integers(replay.first_step, replay.last_step + 1, seeks):
+        replay.find_message(MESSAGE_KINDS[int(step) % len(MESSAGE_KINDS)], int(step))
+    print(f"Seek by time / message_kind: {(time.perf_counter() - start) / (2 * seeks) * 1e6:.1f} us")
+
+    hits = replay.hits
+    timings = []
+    for step in range(replay.first_step, replay.first_step + 100):
+        start = time.perf_counter()
+        replay.frame(step)
+        timings.append(time.perf_counter() - start)
+        time.sleep(0.02)  # a little of the time between frames at playback speed
+    print(f"Playback: median {np.median(timings) * 1000:.2f} ms per step, "
+          f"{replay.hits - hits}/100 steps already prefetched, {replay.stats()}")
+    replay.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("session", type=str, nargs="?", help="Session log path, with or without .log")
+    parser.add_argument("--agent_id", type=str, default=None, help="Only show this agent")
+    parser.add_argument("--own_only", action="store_true",
+                        help="Start with only the recording participant's agent (also a checkbox in the viewer)")
+    parser.add_argument("--fps", type=float, default=10.0)
+    parser.add_argument("--benchmark", action="store_true", help="Time seeks on a synthetic session instead")
+    args = parser.parse_args()
+
+    if args.benchmark or not args.session:
+        benchmark()
+    else:
+        replay = SessionReplay(args.session, [args.agent_id] if args.agent_id else None)
+        root = tk.Tk()
+        viewer = ReplayViewer(root, replay, args.fps, args.own_only)
+        root.mainloop()
+        print(f"Replay stats: {replay.stats()}")
+        replay.close()
@@ -0,0 +1,77 @@
+import time
+
+import numpy as np
+
+from frame_pipeline import rotation_steps
+
+# Client side prediction for "turn left" / "turn right". A turn only changes the agent's
+# orientation, and the client applies orientation as a rotation of the whole view, so the
+# frame the server will send back is (almost always) the last one we showed, rotated. Instead
+# of waiting for that round trip the last displayed frame is rotated right away:
+#
+#   - predict() is called when a turn action is actually published and returns the frame to
+#     show with the predicted orientation. Several turns in a row chain on the prediction
+#   - reconcile() gets every authoritative frame for our agent. Frames older than the turn
+#     (their last_action_seq is below the turn's seq) are shown rotated to the prediction, the
+#     first one that includes it settles the prediction as confirmed or mispredicted
+#   - a turn the server never applies (it was not our turn) never shows up in last_action_seq;
+#     after timeout_s the prediction is given up as mispredicted
+#
+# Frames without last_action_seq (older servers, or before our first action was applied)
+# settle the prediction as soon as they show the predicted orientation.
+
+TURNS = {"turn left": -1, "turn right": 1}
+
+
+class RotationPredictor:
+    def __init__(self, timeout_s=1.0):
+        self.timeout = timeout_s
+        self.frame = None  # last authoritative frame for our agent, as displayed
+        self.steps = 0  # rotation steps of self.frame
+        self.predicted = None  # (action seq, predicted steps, time predicted)
+        self.predictions = 0
+        self.confirmed = 0
+        self.mispredictions = 0
+
+    def predict(self, action, seq):
+        turn = TURNS.get(action)
+        if turn is None or self.frame is None:
+            return None
+        base = self.predicted[1] if self.predicted is not None else self.steps
+        steps = (base + turn) % 4
+        self.predicted = (seq, steps, time.perf_counter())
+        self.predictions += 1
+        return self.rotate(self.frame, self.steps, steps)
+
+    def reconcile(self, agent_data, frame):
+        # Returns the frame to show for the authoritative one
+        steps = rotation_steps(agent_data.get("orientation", "0"))
+        self.frame = frame
+        self.steps = steps
+        if self.predicted is None:
+            return frame
+        seq, predicted, predicted_at = self.predicted
+        acked = agent_data.get("last_action_seq")
+        applied = acked >= seq if acked is not None else steps == predicted
+        if not applied and time.perf_counter() - predicted_at < self.timeout:
+            # The server has not applied the turn yet, keep the prediction on screen
+            return self.rotate(frame, steps, predicted)
+        self.predicted = None
+        if applied and steps == predicted:
+            self.confirmed += 1
+        else:
+            self.mispredictions += 1
+        return frame
+
+    def rotate(self, frame, from_steps, to_steps):
+        # Square display, so rotating the displayed frame equals rendering it at the new orientation
+        return np.ascontiguousarray(np.rot90(frame, (to_steps - from_steps) % 4))
+
+    def reset(self):
+        self.frame = None
+        self.steps = 0
+        self.predicted = None
+
+    def stats(self):
+        return {"predictions": self.predictions, "confirmed": self.confirmed,
+                "mispredictions": self.mispredictions}
@@ -0,0 +1,205 @@
+import glob
+import os
+import time
+
+import numpy as np
+
+from session_log import ACTIONS, FLAG_OWN, FLAG_TURN, INDEX_DTYPE, KINDS, MESSAGE_KINDS, load_meta, session_base
+
+# Columnar export of recorded sessions (session_log.py) for analysis. Only the .idx files are
+# read: every column comes from the fixed-size index rows, so nothing in the .log (JSON meta,
+# images) is touched and a session becomes a table with a handful of numpy operations.
+# One row per step and agent with a frame on screen:
+#
+#   session, step, time       time in seconds since the session started
+#   agent, own, is_turn, orientation, last_action_seq       from the frame
+#   action, action_seq, actions   last game action the agent sent during the step, and how many
+#   ack_ms, ack_steps         until a frame of the agent acknowledged that action (last_action_seq)
+#   message_kind              communication message the agent started or sent during the step
+#
+# Sessions are written in chunks: a row group per chunk in one Parquet file when pyarrow is
+# installed, otherwise one compressed .npz per chunk (strings as codes, with the code -> name
+# tables stored next to them). In Parquet session, action and message_kind are dictionary
+# columns over the same codes, so every row group has the same schema, empty ones too.
+# Sessions written in another format version are skipped.
+
+ACTION_NAMES = np.full(256, "other", dtype=object)
+ACTION_NAMES[0] = ""
+ACTION_NAMES[1:1 + len(ACTIONS)] = ACTIONS
+MESSAGE_KIND_NAMES = np.full(256, "other", dtype=object)
+MESSAGE_KIND_NAMES[0] = ""
+MESSAGE_KIND_NAMES[1:1 + len(MESSAGE_KINDS)] = MESSAGE_KINDS
+
+
+def step_agent_keys(rows):
+    # One int64 per (step, agent), ordered like the steps
+    return (rows["step"].astype(np.int64) << 20) | (rows["agent"].astype(np.int64) + 1)
+
+
+def last_by_key(keys):
+    # Sorted unique keys, the position of the last row with each key and how many rows had it
+    if not len(keys):
+        return keys, np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    last = np.flatnonzero(np.append(sorted_keys[1:] != sorted_keys[:-1], True))
+    return sorted_keys[last], order[last], np.diff(np.append(-1, last))
+
+
+def lookup(keys, table_keys):
+    # Position of every key in table_keys and whether it is there at all
+    pos = np.searchsorted(table_keys, keys)
+    pos = np.minimum(pos, max(len(table_keys) - 1, 0))
+    found = table_keys[pos] == keys if len(table_keys) else np.zeros(len(keys), dtype=bool)
+    return pos, found
+
+
+def session_columns(base):
+    base = session_base(base)
+    started_at = load_meta(base)["started_at"]
+    index = np.fromfile(base + ".idx", dtype=INDEX_DTYPE)
+
+    frames = index[index["kind"] == KINDS["frame"]]
+    frame_keys, last, _ = last_by_key(step_agent_keys(frames))
+    frames = frames[last]
+    count = len(frames)
+    columns = {
+        "step": frames["step"].astype(np.int64),
+        "time": frames["time"] - started_at,
+        "agent": frames["agent"],
+        "own": (frames["flags"] & FLAG_OWN) != 0,
+        "is_turn": (frames["flags"] & FLAG_TURN) != 0,
+        "orientation": np.where(frames["orientation"] == 255, -1, frames["orientation"]).astype(np.int8),
+        "last_action_seq": frames["seq"],
+        "action": np.zeros(count, dtype=np.uint8),
+        "action_seq": np.full(count, -1, dtype=np.int32),
+        "actions": np.zeros(count, dtype=np.int32),
+        "ack_ms": np.full(count, np.nan, dtype=np.float32),
+        "ack_steps": np.full(count, -1, dtype=np.int32),
+        "message_kind": np.zeros(count, dtype=np.uint8),
+    }
+
+    # Game actions only, the communication ones ("msg-...") are in message_kind
+    actions = index[(index["kind"] == KINDS["action"]) & (index["message_kind"] == 0)]
+    action_keys, last, counts = last_by_key(step_agent_keys(actions))
+    actions = actions[last]
+    pos, found = lookup(frame_keys, action_keys)
+    columns["action"][found] = actions["action"][pos[found]]
+    columns["action_seq"][found] = actions["seq"][pos[found]]
+    columns["actions"][found] = counts[pos[found]]
+
+    # First frame of the same agent whose last_action_seq reaches the action's seq
+    ack_ms = np.full(len(actions), np.nan, dtype=np.float32)
+    ack_steps = np.full(len(actions), -1, dtype=np.int32)
+    for agent in np.unique(actions["agent"]):
+        agent_frames = frames[frames["agent"] == agent]
+        agent_actions = np.flatnonzero(actions["agent"] == agent)
+        acked = np.maximum.accumulate(agent_frames["seq"]) if len(agent_frames) else agent_frames["seq"]
+        first = np.searchsorted(acked, actions["seq"][agent_actions], "left")
+        ok = first < len(agent_frames)
+        hit = agent_frames[first[ok]]
+        ack_ms[agent_actions[ok]] = (hit["time"] - actions["time"][agent_actions[ok]]) * 1000
+        ack_steps[agent_actions[ok]] = hit["step"].astype(np.int64) - actions["step"][agent_actions[ok]].astype(np.int64)
+    columns["ack_ms"][found] = ack_ms[pos[found]]
+    columns["ack_steps"][found] = ack_steps[pos[found]]
+
+    messages = index[index["message_kind"] != 0]
+    message_keys, last, _ = last_by_key(step_agent_keys(messages))
+    pos, found = lookup(frame_keys, message_keys)
+    columns["message_kind"][found] = messages["message_kind"][last][pos[found]]
+    return columns
+
+
+def session_bases(paths):
+    # Session files given directly, or every session in the given directories
+    bases = set()
+    for path in paths:
+        if os.path.isdir(path):
+            bases.update(session_base(idx) for idx in glob.glob(os.path.join(path, "*.idx")))
+        else:
+            bases.add(session_base(path))
+    return sorted(bases)
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet
+        return True
+    except ImportError:
+        return False
+
+
+def string_column(pa, codes, names):
+    # Codes into a fixed table of names, as an Arrow dictionary column
+    return pa.DictionaryArray.from_arrays(pa.array(codes.astype(np.int32)), pa.array(names, type=pa.string()))
+
+
+def export_sessions(paths, out, output_format="auto", chunk_sessions=50):
+    if output_format == "auto":
+        output_format = "parquet" if parquet_available() else "npz"
+    elif output_format == "parquet" and not parquet_available():
+        raise ValueError("Parquet export needs pyarrow (pip install pyarrow), or use --format npz")
+
+    bases = []
+    for base in session_bases(paths):
+        try:
+            load_meta(base)
+            bases.append(base)
+        except (OSError, ValueError) as e:
+            print(f"Skipping {base}: {e}")
+    session_names = np.array([os.path.basename(base) for base in bases])
+
+    start = time.perf_counter()
+    rows = 0
+    written = []
+    writer = None
+    for chunk_index in range(0, len(bases), chunk_sessions):
+        chunk = bases[chunk_index:chunk_index + chunk_sessions]
+        tables = [session_columns(base) for base in chunk]
+        columns = {name: np.concatenate([table[name] for table in tables]) for name in tables[0]}
+        session = np.repeat(np.arange(chunk_index, chunk_index + len(chunk)),
+                            [len(table["step"]) for table in tables])
+        rows += len(session)
+
+        if output_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            arrays = {"session": string_column(pa, session, session_names)}
+            arrays.update({name: pa.array(column) for name, column in columns.items()})
+            arrays["action"] = string_column(pa, columns["action"], ACTION_NAMES.astype(str))
+            arrays["message_kind"] = string_column(pa, columns["message_kind"], MESSAGE_KIND_NAMES.astype(str))
+            table = pa.table(arrays)
+            if writer is None:
+                writer = pq.ParquetWriter(out, table.schema)
+                written.append(out)
+            writer.write_table(table)
+        else:
+            path = f"{os.path.splitext(out)[0]}_{chunk_index // chunk_sessions:04d}.npz"
+            np.savez_compressed(path, session=session,
+                                session_names=session_names,
+                                action_names=ACTION_NAMES.astype(str),
+                                message_kind_names=MESSAGE_KIND_NAMES.astype(str), **columns)
+            written.append(path)
+    if writer is not None:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Exported {len(bases)} sessions, {rows} rows as {output_format} in {elapsed:.2f} s: {', '.join(written)}")
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", type=str, nargs="+", help="Session files or directories with sessions")
+    parser.add_argument("--out", type=str, default="sessions.parquet")
+    parser.add_argument("--format", type=str, default="auto", choices=["auto", "parquet", "npz"])
+    parser.add_argument("--chunk_sessions", type=int, default=50, help="Sessions per row group / .npz file")
+    args = parser.parse_args()
+
+    try:
+        export_sessions(args.paths, args.out, args.format, args.chunk_sessions)
+    except ValueError as e:
+        parser.error(str(e))
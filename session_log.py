@@ -0,0 +1,282 @@
+import json
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+import cv2
+
+from frame_codec import image_bytes
+
+# Append-only recording of a client session: the frames the participant was shown, the
+# actions they sent, their turn state and references to the audio messages they recorded.
+# Every call only does a put_nowait on a bounded queue; a writer thread encodes and writes
+# the records, so recording never waits on the disk. When the writer falls behind, records
+# are dropped and counted instead of blocking the GUI.
+#
+#   <name>.log    records back to back: RECORD_HEADER, a JSON meta dict, then an optional blob
+#                 (the frame as PNG, or the image bytes as received for plain frames)
+#   <name>.idx    one fixed-size INDEX_DTYPE row per record, can be loaded with np.fromfile or
+#                 memory mapped and searched with np.searchsorted on step or time
+#   <name>.json   session metadata, rewritten with the final stats on close
+#
+# step counts the frame messages shown so far. Actions, turn changes and audio get the step
+# of the frame on screen when they happened. The GUI and the audio thread both record, so step
+# and time are taken and the record is queued under one lock, and time is started_at plus a
+# perf_counter offset: step and time never decrease along the index, even if the wall clock
+# is adjusted during the session.
+# The index is written after the records it points to, a crash leaves at most a log tail
+# without index rows. It also carries the action and orientation codes, so tables can be
+# built from the .idx alone (session_export.py).
+
+FORMAT_VERSION = 2
+MAGIC = 0x5347
+RECORD_HEADER = struct.Struct("<HBxIId")  # magic, kind, meta length, blob length, time
+
+KINDS = {"frame": 1, "action": 2, "turn": 3, "audio": 4, "control": 5}
+KIND_NAMES = {code: kind for kind, code in KINDS.items()}
+MESSAGE_KINDS = ("environment-information", "environment-question", "strategy-individual",
+                 "strategy-collective", "agreement-request", "agreement-evaluation")
+ACTIONS = ("move up", "move down", "move left", "move right", "turn left", "turn right", "attack", "start")
+
+FLAG_TURN = 1  # is_turn was set for the agent
+FLAG_OWN = 2  # the record is about the recording participant's own agent
+
+INDEX_DTYPE = np.dtype([
+    ("offset", "<u8"),
+    ("length", "<u4"),
+    ("kind", "u1"),
+    ("message_kind", "u1"),  # 1 + position in MESSAGE_KINDS, 0 for none, 255 unknown
+    ("action", "u1"),  # 1 + position in ACTIONS, 0 for none, 255 any other action
+    ("orientation", "u1"),  # frames only, 255 for none
+    ("flags", "<u2"),
+    ("time", "<f8"),
+    ("step", "<u8"),
+    ("agent", "<i4"),  # numeric agent id, -1 when there is none
+    ("seq", "<i4"),  # action seq, or the last_action_seq a frame acknowledges, -1 for none
+])
+
+
+def message_kind_code(message_kind):
+    if not message_kind:
+        return 0
+    message_kind = message_kind.replace("msg-", "")
+    if message_kind in MESSAGE_KINDS:
+        return MESSAGE_KINDS.index(message_kind) + 1
+    return 255
+
+
+def action_code(action):
+    if not action:
+        return 0
+    if action in ACTIONS:
+        return ACTIONS.index(action) + 1
+    return 255
+
+
+def agent_number(agent_id):
+    agent_id = str(agent_id) if agent_id is not None else ""
+    return int(agent_id) if agent_id.isdigit() else -1
+
+
+def frame_blob(agent_data):
+    # Same source priority as prepare_frame: delta mode frames and sprite grids are encoded
+    # here, on the writer thread; plain frames are kept exactly as received
+    img_array = agent_data.get("raw_frame")
+    if img_array is None and "grid" in agent_data:
+        img_array = agent_data["atlas"].render(agent_data["grid"])
+    if img_array is None:
+        return image_bytes(agent_data)
+    return cv2.imencode(".png", img_array)[1].tobytes()
+
+
+def session_base(path):
+    for suffix in (".log", ".idx", ".json"):
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def read_record(buffer, offset):
+    # (kind name, time, meta dict, blob) of the record at offset, buffer can be an mmap
+    magic, kind, meta_length, blob_length, t = RECORD_HEADER.unpack_from(buffer, offset)
+    if magic != MAGIC:
+        raise ValueError(f"No session log record at offset {offset}")
+    start = offset + RECORD_HEADER.size
+    meta = json.loads(bytes(buffer[start:start + meta_length]))
+    blob = bytes(buffer[start + meta_length:start + meta_length + blob_length])
+    return KIND_NAMES.get(kind, str(kind)), t, meta, blob
+
+
+def load_index(path):
+    return np.fromfile(path, dtype=INDEX_DTYPE)
+
+
+def load_meta(base):
+    # Session metadata, refused when the session was written in another format (version 1
+    # logs have a 40 byte index row without the action and orientation codes)
+    with open(base + ".json") as f:
+        meta = json.load(f)
+    version = meta.get("version")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Session {base} has format version {version}, only version {FORMAT_VERSION} can be read")
+    return meta
+
+
+class SessionLog:
+    def __init__(self, directory, name, own_id=None, max_pending=512, flush_interval=0.5):
+        os.makedirs(directory, exist_ok=True)
+        self.base = os.path.join(directory, name)
+        self.own_id = own_id
+        self.log_file = open(self.base + ".log", "ab")
+        self.index_file = open(self.base + ".idx", "ab")
+        self.offset = self.log_file.tell()
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.flush_interval = flush_interval
+        self.stop_marker = object()
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.perf_start = time.perf_counter()
+        self.step = 0
+        self.turns = {}
+        self.records = 0
+        self.dropped = 0
+        self.errors = 0
+        self.bytes_written = 0
+        self.max_queued = 0
+        self.write_meta()
+        self.thread = threading.Thread(target=self._run, name="session-log", daemon=True)
+        self.thread.start()
+
+    # Called from the GUI / network threads
+
+    def frames(self, data_dict, agent_ids):
+        # One shown message: a frame record per agent, and a turn record when is_turn changed
+        with self.lock:
+            self.step += 1
+            for agent_id in agent_ids:
+                agent_data = data_dict.get(agent_id)
+                if agent_data is None:
+                    continue
+                is_turn = bool(agent_data.get("is_turn", False))
+                self._put("frame", {
+                    "agent_id": agent_id,
+                    "orientation": str(agent_data.get("orientation", "0")),
+                    "is_turn": is_turn,
+                    "text": agent_data.get("text", ""),
+                    "last_action_seq": agent_data.get("last_action_seq"),
+                }, agent_data)
+                if self.turns.get(agent_id) != is_turn:
+                    self.turns[agent_id] = is_turn
+                    self._put("turn", {"agent_id": agent_id, "is_turn": is_turn})
+
+    def action(self, agent_id, action, seq):
+        with self.lock:
+            self._put("action", {"agent_id": agent_id, "action": action, "seq": seq})
+
+    def audio(self, audio_dict):
+        # Reference to an audio message sent on topic/audio (transfer_id, message_kind, ...),
+        # called from the recording thread
+        with self.lock:
+            self._put("audio", dict(audio_dict))
+
+    def control(self, key):
+        with self.lock:
+            self._put("control", {"control": key})
+
+    def clock(self):
+        # Wall clock time of the session start, advanced by the monotonic clock
+        return self.started_at + (time.perf_counter() - self.perf_start)
+
+    def _put(self, kind, meta, agent_data=None):
+        # Called with self.lock held, never blocks
+        try:
+            self.queue.put_nowait((kind, self.clock(), self.step, meta, agent_data))
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.max_queued = max(self.max_queued, self.queue.qsize())
+
+    # Writer thread
+
+    def _run(self):
+        rows = []
+        last_flush = time.perf_counter()
+        while True:
+            try:
+                entry = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                entry = None
+            if entry is self.stop_marker:
+                break
+            if entry is not None:
+                try:
+                    rows.append(self._write(*entry))
+                except Exception as e:
+                    self.errors += 1
+                    print(f"Error al guardar el registro de la sesión: {e}")
+            if rows and (entry is None or len(rows) >= 64 or time.perf_counter() - last_flush >= self.flush_interval):
+                self._flush(rows)
+                rows = []
+                last_flush = time.perf_counter()
+        self._flush(rows)
+
+    def _write(self, kind, t, step, meta, agent_data):
+        blob = frame_blob(agent_data) if agent_data is not None else b""
+        meta_bytes = json.dumps(meta).encode('utf-8')
+        self.log_file.write(RECORD_HEADER.pack(MAGIC, KINDS[kind], len(meta_bytes), len(blob), t))
+        self.log_file.write(meta_bytes)
+        self.log_file.write(blob)
+        length = RECORD_HEADER.size + len(meta_bytes) + len(blob)
+
+        agent_id = meta.get("agent_id")
+        flags = (FLAG_TURN if meta.get("is_turn") else 0) | (FLAG_OWN if agent_id == self.own_id else 0)
+        seq = meta.get("seq", meta.get("last_action_seq"))
+        action = meta.get("action")
+        # Communication actions ("msg-<kind>") are indexed under their message kind too
+        message_kind = meta.get("message_kind") or (action if action and action.startswith("msg-") else None)
+        orientation = meta.get("orientation")
+        row = (self.offset, length, KINDS[kind], message_kind_code(message_kind), action_code(action),
+               int(orientation) if orientation is not None and orientation.isdigit() else 255, flags, t, step,
+               agent_number(agent_id), -1 if seq is None else seq)
+        self.offset += length
+        self.records += 1
+        self.bytes_written += length
+        return row
+
+    def _flush(self, rows):
+        if not rows:
+            return
+        # Records first, so an index row never points past the end of the log
+        self.log_file.flush()
+        self.index_file.write(np.array(rows, dtype=INDEX_DTYPE).tobytes())
+        self.index_file.flush()
+
+    def write_meta(self, extra=None):
+        meta = {
+            "version": FORMAT_VERSION,
+            "own_id": self.own_id,
+            "started_at": self.started_at,
+            "kinds": KINDS,
+            "message_kinds": MESSAGE_KINDS,
+            "actions": ACTIONS,
+            "index_dtype": INDEX_DTYPE.descr,
+            **(extra or {}),
+        }
+        with open(self.base + ".json", "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def stats(self):
+        return {"records": self.records, "dropped": self.dropped, "errors": self.errors,
+                "queued": self.queue.qsize(), "max_queued": self.max_queued,
+                "mb_written": round(self.bytes_written / 2 ** 20, 2)}
+
+    def close(self):
+        # Everything already queued is written before the files are closed
+        self.queue.put(self.stop_marker)
+        self.thread.join()
+        self.log_file.close()
+        self.index_file.close()
+        self.write_meta({"closed_at": self.clock(), "steps": self.step, "stats": self.stats()})
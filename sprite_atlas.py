@@ -0,0 +1,162 @@
+import hashlib
+import io
+import os
+import struct
+import threading
+
+import numpy as np
+
+from frame_codec import FrameFormatError, image_bytes
+
+# Symbolic render mode for topic/data. Entries flagged "symbolic" carry a grid of sprite
+# indices instead of a rendered image and the client draws the view from a sprite atlas:
+#
+#   grid payload: atlas version (8 bytes) | rows u16 | cols u16 | bytes per index u8 | indices
+#
+# The atlas itself is published once on topic/atlas (retained) and cached on disk, keyed by
+# its version, which is a hash of the sprite pixels. A frame naming a version the client does
+# not have means its atlas is stale; it then asks for the right one on topic/atlas/request.
+GRID_HEADER = struct.Struct("<8sHHB")
+ATLAS_DIR = os.path.join(os.path.expanduser("~"), ".cache", "social_dilemma_atlas")
+
+
+def atlas_version(sprites):
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(np.asarray(sprites.shape, dtype=np.uint32).tobytes())
+    digest.update(np.ascontiguousarray(sprites).tobytes())
+    return digest.digest()
+
+
+class SpriteAtlas:
+    def __init__(self, sprites):
+        self.sprites = np.ascontiguousarray(sprites, dtype=np.uint8)  # (count, tile h, tile w, 3)
+        self.version = atlas_version(self.sprites)
+
+    def render(self, grid):
+        # One fancy-indexing gather, then interleave tile rows with pixel rows
+        rows, cols = grid.shape
+        _, tile_h, tile_w, channels = self.sprites.shape
+        tiles = self.sprites[grid]
+        return tiles.transpose(0, 2, 1, 3, 4).reshape(rows * tile_h, cols * tile_w, channels)
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez(buffer, sprites=self.sprites, version=np.frombuffer(self.version, dtype=np.uint8))
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, payload):
+        try:
+            with np.load(io.BytesIO(bytes(payload)), allow_pickle=False) as data:
+                atlas = cls(data["sprites"])
+                claimed = data["version"].tobytes()
+        except (ValueError, KeyError, OSError) as e:
+            raise FrameFormatError(f"Invalid sprite atlas: {e}")
+        if atlas.version != claimed:
+            raise FrameFormatError("Sprite atlas does not match its version")
+        return atlas
+
+    def save(self, directory=ATLAS_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"atlas-{self.version.hex()}.npz")
+        # Write then rename so a crash never leaves a half written atlas behind
+        with open(path + ".tmp", "wb") as f:
+            f.write(self.to_bytes())
+        os.replace(path + ".tmp", path)
+        return path
+
+    @classmethod
+    def load(cls, version, directory=ATLAS_DIR):
+        path = os.path.join(directory, f"atlas-{version.hex()}.npz")
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+
+def encode_grid(grid, version):
+    grid = np.ascontiguousarray(grid)
+    index_bytes = 1 if grid.max(initial=0) < 256 else 2
+    rows, cols = grid.shape
+    indices = grid.astype(np.uint8 if index_bytes == 1 else np.uint16)
+    return GRID_HEADER.pack(version, rows, cols, index_bytes) + indices.tobytes()
+
+
+def decode_grid(payload):
+    view = memoryview(payload)
+    if len(view) < GRID_HEADER.size:
+        raise FrameFormatError("Truncated sprite grid")
+    version, rows, cols, index_bytes = GRID_HEADER.unpack_from(view, 0)
+    dtype = np.uint8 if index_bytes == 1 else np.uint16
+    if len(view) - GRID_HEADER.size != rows * cols * index_bytes:
+        raise FrameFormatError("Malformed sprite grid")
+    grid = np.frombuffer(view, dtype=dtype, offset=GRID_HEADER.size).reshape(rows, cols)
+    return version, grid
+
+
+class AtlasStore:
+    # Client side: atlases in memory, backed by the disk cache
+    def __init__(self, directory=ATLAS_DIR):
+        self.directory = directory
+        self.atlases = {}
+        self.lock = threading.Lock()
+        self.current_version = None
+        self.version_changes = 0
+        self.stale_frames = 0
+        self.received = 0
+
+    def get(self, version):
+        with self.lock:
+            atlas = self.atlases.get(version)
+        if atlas is None:
+            try:
+                atlas = SpriteAtlas.load(version, self.directory)
+            except (FrameFormatError, OSError) as e:
+                print(f"Discarding cached sprite atlas {version.hex()}: {e}")
+                atlas = None
+            if atlas is not None:
+                with self.lock:
+                    self.atlases[version] = atlas
+        return atlas
+
+    def add(self, payload):
+        atlas = SpriteAtlas.from_bytes(payload)
+        with self.lock:
+            self.atlases[atlas.version] = atlas
+            self.received += 1
+        # The disk cache is only an optimisation: a full disk or a read-only cache directory
+        # must not take down the network thread, the atlas stays usable from memory
+        try:
+            atlas.save(self.directory)
+        except OSError as e:
+            print(f"Could not cache sprite atlas {atlas.version.hex()}: {e}")
+        return atlas
+
+    def attach(self, data_dict):
+        # Resolves the atlas for every symbolic entry. Entries whose atlas is not available yet
+        # are dropped; returns the versions that have to be requested.
+        missing = []
+        for agent_id, agent_data in list(data_dict.items()):
+            if not agent_data.get("symbolic", False):
+                continue
+            version, grid = decode_grid(image_bytes(agent_data))
+            if version != self.current_version:
+                self.current_version = version
+                self.version_changes += 1
+            atlas = self.get(version)
+            if atlas is None:
+                self.stale_frames += 1
+                missing.append(version)
+                del data_dict[agent_id]
+                continue
+            agent_data["grid"] = grid
+            agent_data["atlas"] = atlas
+        return missing
+
+    def stats(self):
+        return {
+            "atlases": len(self.atlases),
+            "received": self.received,
+            "version_changes": self.version_changes,
+            "stale_frames": self.stale_frames,
+        }
@@ -0,0 +1,91 @@
+import unittest
+
+from action_pipeline import ActionPipeline
+
+
+class FakePublisher:
+    def __init__(self):
+        self.seq = 0
+        self.published = []
+
+    def publish_action(self, agent_id, action):
+        self.seq += 1
+        self.published.append((action, self.seq))
+        return self.seq
+
+
+class FakeScheduler:
+    # root.after without Tk, callbacks run when the test says so
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, ms, callback):
+        self.calls.append(callback)
+
+    def run(self):
+        calls, self.calls = self.calls, []
+        for callback in calls:
+            callback()
+
+
+class ActionPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.publisher = FakePublisher()
+        self.scheduler = FakeScheduler()
+        self.our_turn = False
+        self.pipeline = ActionPipeline(self.publisher, "1", self.scheduler, can_send=lambda: self.our_turn)
+
+    def start_turn(self):
+        self.our_turn = True
+        self.pipeline.turn_started()
+
+    def hold_key(self, action, events):
+        for _ in range(events):
+            self.pipeline.submit(action)
+
+    def test_key_held_through_a_turn_publishes_once(self):
+        self.start_turn()
+        self.hold_key("move up", 30)
+        # The server applies the move and hands the turn over, acknowledging it in the same frame
+        self.our_turn = False
+        self.pipeline.acknowledged(1)
+        self.hold_key("move up", 30)
+        self.assertEqual(self.publisher.published, [("move up", 1)])
+        self.assertEqual(self.pipeline.stats()["debounced"], 29)
+
+        # The next turn starts a new window, still one action for it
+        self.start_turn()
+        self.hold_key("move up", 30)
+        self.our_turn = False
+        self.pipeline.acknowledged(2)
+        self.assertEqual(self.publisher.published, [("move up", 1), ("move up", 2)])
+
+    def test_ack_within_the_turn_sends_the_latest_intent(self):
+        self.start_turn()
+        self.pipeline.submit("move up")
+        self.hold_key("move left", 5)
+        self.hold_key("move right", 5)
+        self.pipeline.acknowledged(1)
+        self.assertEqual(self.publisher.published, [("move up", 1), ("move right", 2)])
+        self.assertEqual(self.pipeline.stats()["coalesced"], 1)
+
+    def test_no_ack_falls_back_to_the_timeout(self):
+        self.start_turn()
+        self.hold_key("move down", 10)
+        self.scheduler.run()
+        self.assertEqual(self.publisher.published, [("move down", 1), ("move down", 2)])
+        self.assertEqual(self.pipeline.stats()["ack_timeouts"], 1)
+
+    def test_timeout_of_an_acked_action_does_nothing(self):
+        self.start_turn()
+        self.pipeline.submit("attack")
+        self.pipeline.acknowledged(1)
+        self.hold_key("attack", 3)
+        # The timeout of action 1 must not release the intent waiting on action 2
+        self.scheduler.calls.pop(0)()
+        self.assertEqual(self.publisher.published, [("attack", 1), ("attack", 2)])
+        self.assertEqual(self.pipeline.stats()["ack_timeouts"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
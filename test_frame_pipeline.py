@@ -0,0 +1,38 @@
+import unittest
+
+import numpy as np
+
+from frame_pipeline import UPSCALE_RESOLUTION, scale_and_rotate, scale_and_rotate_two_pass
+
+
+def sprite_frame(tiles_y, tiles_x, tile_size, seed=0):
+    rng = np.random.default_rng(seed)
+    grid = rng.integers(0, 256, (tiles_y, tiles_x, 3), dtype=np.uint8)
+    return np.repeat(np.repeat(grid, tile_size, axis=0), tile_size, axis=1)
+
+
+class ScaleAndRotateTest(unittest.TestCase):
+    def assert_matches_two_pass(self, img_array, display_size):
+        for orientation in ("0", "1", "2", "3"):
+            legacy = scale_and_rotate_two_pass(img_array, UPSCALE_RESOLUTION, display_size, orientation)
+            frame = scale_and_rotate(img_array, display_size, orientation)
+            self.assertEqual(frame.shape, legacy.shape)
+            # Only the rounding of the fixed point cv2.resize differs
+            self.assertLessEqual(np.abs(frame.astype(np.int16) - legacy).max(), 1)
+
+    def test_observation_at_the_display_size(self):
+        self.assert_matches_two_pass(sprite_frame(11, 11, 8), (400, 400))
+
+    def test_canvas_tile_size(self):
+        self.assert_matches_two_pass(sprite_frame(11, 11, 8), (186, 186))
+
+    def test_non_square(self):
+        self.assert_matches_two_pass(sprite_frame(9, 15, 8, seed=1), (400, 300))
+
+    def test_large_source(self):
+        # Texels narrower than the Lanczos window, a display pixel mixes three of them
+        self.assert_matches_two_pass(sprite_frame(9, 9, 16, seed=2), (400, 400))
+
+
+if __name__ == "__main__":
+    unittest.main()
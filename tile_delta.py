@@ -0,0 +1,147 @@
+import struct
+
+import numpy as np
+import cv2
+
+from frame_codec import FrameFormatError, image_bytes
+
+# Optional delta mode for topic/data. Instead of a full encoded image on every step, the
+# publisher sends a keyframe every so often and, in between, only the sprite tiles that
+# changed since the previous step. Agent entries in this mode carry "tiled": True and their
+# image bytes hold one of:
+#
+#   header:   seq u32 | base seq u32 | height u16 | width u16 | tile size u8 | keyframe u8 | tile count u16
+#   keyframe: header | encoded image (PNG)
+#   delta:    header | tile count x (row u16, col u16) | tile count x raw tile pixels (tile x tile x 3)
+#
+# A delta only applies on top of the frame with seq == base seq. If one is missed the client
+# keeps showing its last frame and waits for (or asks for) the next keyframe.
+HEADER = struct.Struct("<IIHHBBH")
+
+
+class TileDeltaEncoder:
+    def __init__(self, tile_size=8, keyframe_interval=30):
+        self.tile_size = tile_size
+        self.keyframe_interval = keyframe_interval
+        self.previous = None
+        self.seq = 0
+        self.since_keyframe = 0
+        self.force_keyframe = False
+
+    def request_keyframe(self):
+        self.force_keyframe = True
+
+    def encode(self, frame):
+        self.seq += 1
+        height, width = frame.shape[:2]
+        keyframe = (self.force_keyframe or self.previous is None or self.previous.shape != frame.shape
+                    or self.since_keyframe >= self.keyframe_interval
+                    or height % self.tile_size or width % self.tile_size)
+        if keyframe:
+            payload = self._keyframe(frame)
+        else:
+            payload = self._delta(frame)
+        self.previous = frame.copy()
+        return payload
+
+    def _keyframe(self, frame):
+        self.force_keyframe = False
+        self.since_keyframe = 0
+        height, width = frame.shape[:2]
+        header = HEADER.pack(self.seq, 0, height, width, self.tile_size, 1, 0)
+        return header + cv2.imencode(".png", frame)[1].tobytes()
+
+    def _delta(self, frame):
+        self.since_keyframe += 1
+        height, width = frame.shape[:2]
+        t = self.tile_size
+        rows, cols = height // t, width // t
+        tiles = frame.reshape(rows, t, cols, t, 3).transpose(0, 2, 1, 3, 4)
+        previous = self.previous.reshape(rows, t, cols, t, 3).transpose(0, 2, 1, 3, 4)
+        changed = np.any(tiles != previous, axis=(2, 3, 4))
+        indices = np.argwhere(changed).astype(np.uint16)
+        header = HEADER.pack(self.seq, self.seq - 1, height, width, t, 0, len(indices))
+        return header + indices.tobytes() + np.ascontiguousarray(tiles[changed]).tobytes()
+
+
+class TileCompositor:
+    # Client side of delta mode: one persistent framebuffer per agent, patched in place.
+    def __init__(self):
+        self.framebuffers = {}
+        self.last_seq = {}
+        self.keyframe_bytes = {}
+        self.waiting_keyframe = set()
+        self.keyframes = 0
+        self.deltas = 0
+        self.deltas_skipped = 0
+        self.bytes_received = 0
+        self.bytes_saved = 0
+
+    def apply(self, agent_id, payload):
+        # Returns the agent's current framebuffer, or None if there is nothing to show yet.
+        # The boolean tells whether a keyframe is needed because a delta could not be applied.
+        view = memoryview(payload)
+        if len(view) < HEADER.size:
+            raise FrameFormatError("Truncated tile header")
+        seq, base_seq, height, width, tile_size, keyframe, tile_count = HEADER.unpack_from(view, 0)
+        body = view[HEADER.size:]
+        self.bytes_received += len(view)
+
+        if keyframe:
+            frame = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                raise FrameFormatError("Could not decode keyframe image")
+            self.framebuffers[agent_id] = frame
+            self.last_seq[agent_id] = seq
+            self.keyframe_bytes[agent_id] = len(view)
+            self.waiting_keyframe.discard(agent_id)
+            self.keyframes += 1
+            return frame, False
+
+        framebuffer = self.framebuffers.get(agent_id)
+        if (framebuffer is None or agent_id in self.waiting_keyframe or self.last_seq.get(agent_id) != base_seq
+                or framebuffer.shape[:2] != (height, width)):
+            # Missed a step, every delta until the next keyframe would be applied on a wrong base
+            self.waiting_keyframe.add(agent_id)
+            self.deltas_skipped += 1
+            return framebuffer, True
+
+        t = tile_size
+        if len(body) != tile_count * (4 + t * t * 3) or height % t or width % t:
+            raise FrameFormatError("Malformed tile delta")
+        indices = np.frombuffer(body, dtype=np.uint16, count=tile_count * 2).reshape(tile_count, 2)
+        pixels = np.frombuffer(body, dtype=np.uint8, offset=tile_count * 4).reshape(tile_count, t, t, 3)
+        tiles = framebuffer.reshape(height // t, t, width // t, t, 3).transpose(0, 2, 1, 3, 4)
+        tiles[indices[:, 0], indices[:, 1]] = pixels  # view into the framebuffer, patched in place
+
+        self.last_seq[agent_id] = seq
+        self.deltas += 1
+        self.bytes_saved += max(self.keyframe_bytes.get(agent_id, 0) - len(view), 0)
+        return framebuffer, False
+
+    def stats(self):
+        return {
+            "keyframes": self.keyframes,
+            "deltas": self.deltas,
+            "deltas_skipped": self.deltas_skipped,
+            "bytes_received": self.bytes_received,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+def composite_frames(compositor, data_dict):
+    # Patches every tiled entry into its framebuffer and replaces it by a private copy of the
+    # result ("raw_frame"). Must run in arrival order, i.e. before frames reach the mailbox.
+    # Returns the agents that need a keyframe.
+    need_keyframe = []
+    for agent_id, agent_data in list(data_dict.items()):
+        if not agent_data.get("tiled", False):
+            continue
+        frame, missed = compositor.apply(agent_id, image_bytes(agent_data))
+        if missed:
+            need_keyframe.append(agent_id)
+        if frame is None:
+            del data_dict[agent_id]
+        else:
+            agent_data["raw_frame"] = frame.copy()
+    return need_keyframe
@@ -0,0 +1,197 @@
+import os
+import threading
+import time
+import tkinter as tk
+
+from PIL import Image, ImageTk
+
+
+class PhotoSurface:
+    # Keeps one PhotoImage per label and pastes new frames into it, instead of creating a
+    # new Tk image for every frame. A new PhotoImage is only made when the frame size changes.
+    def __init__(self, label):
+        self.label = label
+        self.photo = None
+        self.size = None
+        self.allocations = 0
+        self.updates = 0
+        self.total_time = 0.0
+
+    def show(self, frame):
+        start = time.perf_counter()
+        img = Image.fromarray(frame)
+        if self.photo is None or img.size != self.size:
+            self.photo = ImageTk.PhotoImage(image=img)
+            self.label.configure(image=self.photo)
+            self.label.image = self.photo
+            self.size = img.size
+            self.allocations += 1
+        else:
+            self.photo.paste(img)
+        self.updates += 1
+        self.total_time += time.perf_counter() - start
+
+    def stats(self):
+        return {
+            "updates": self.updates,
+            "allocations": self.allocations,
+            "ms_per_frame": round(self.total_time / self.updates * 1000, 3) if self.updates else 0.0,
+        }
+
+
+class NullSurface:
+    # Display backend for headless runs: does the array to PIL conversion Tk would need and
+    # stops there. Same interface as PhotoSurface.
+    def __init__(self, label=None):
+        self.label = label
+        self.size = None
+        self.allocations = 0
+        self.updates = 0
+        self.total_time = 0.0
+
+    def show(self, frame):
+        start = time.perf_counter()
+        img = Image.fromarray(frame)
+        if img.size != self.size:
+            self.size = img.size
+            self.allocations += 1
+        self.updates += 1
+        self.total_time += time.perf_counter() - start
+
+    stats = PhotoSurface.stats
+
+
+class TkWakeup:
+    # Lets other threads (MQTT network loop, decoder workers) wake the Tk loop as soon as there
+    # is something to show, instead of Tk polling on a timer. On POSIX a byte is written to a
+    # self-pipe that Tk watches with createfilehandler; where that is not available (Windows)
+    # a <<DataReady>> virtual event is generated, which threaded Tcl hands to the Tk thread.
+    # Notifications coalesce: while a wakeup is pending further notify() calls do nothing.
+    # After close() they do nothing at all: event_generate from another thread waits for the
+    # Tk thread, which on close is joining those threads.
+    def __init__(self, root, callback):
+        self.root = root
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.pending = False
+        self.closed = False
+        self.in_flight = 0  # notify() calls inside event_generate
+        self.notifications = 0
+        self.wakeups = 0
+        self.read_fd = None
+        self.write_fd = None
+        if os.name == "posix" and hasattr(root.tk, "createfilehandler"):
+            self.read_fd, self.write_fd = os.pipe()
+            os.set_blocking(self.read_fd, False)
+            os.set_blocking(self.write_fd, False)
+            root.tk.createfilehandler(self.read_fd, tk.READABLE, self._on_readable)
+            self.mode = "pipe"
+        else:
+            root.bind("<<DataReady>>", self._on_event)
+            self.mode = "event"
+
+    def notify(self):
+        # Safe to call from any thread
+        with self.lock:
+            if self.closed:
+                return
+            self.notifications += 1
+            if self.pending:
+                return
+            self.pending = True
+            self.in_flight += 1
+        try:
+            if self.mode == "pipe":
+                os.write(self.write_fd, b"\0")
+            else:
+                self.root.event_generate("<<DataReady>>", when="tail")
+        except (OSError, RuntimeError, tk.TclError):
+            # Window closing or Tk not in its main loop yet, the safety poll will catch up
+            with self.lock:
+                self.pending = False
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def _on_readable(self, fd, mask):
+        try:
+            os.read(fd, 64)
+        except BlockingIOError:
+            pass
+        self._fire()
+
+    def _on_event(self, event):
+        self._fire()
+
+    def _fire(self):
+        # Cleared before the callback so anything arriving meanwhile wakes us again
+        with self.lock:
+            self.pending = False
+            self.wakeups += 1
+        self.callback()
+
+    def close(self):
+        # Called on the Tk thread before the threads that notify are stopped
+        with self.lock:
+            self.closed = True
+        # A notify() that got past the check is waiting for this thread to service its event
+        deadline = time.perf_counter() + 1.0
+        while self.in_flight and time.perf_counter() < deadline:
+            if self.mode == "event":
+                self.root.update()
+            time.sleep(0.001)
+        if self.read_fd is not None:
+            self.root.tk.deletefilehandler(self.read_fd)
+            os.close(self.read_fd)
+            os.close(self.write_fd)
+            self.read_fd = self.write_fd = None
+
+    def stats(self):
+        with self.lock:
+            return {"mode": self.mode, "notifications": self.notifications, "wakeups": self.wakeups}
+
+
+def benchmark(iterations=300, size=(400, 400)):
+    # Per-frame Tk cost of the old path (new PhotoImage every frame) against PhotoSurface,
+    # redraw included. Needs a display, under a headless machine run it with xvfb-run.
+    import numpy as np
+
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        print(f"No display for the Tk benchmark ({e}), run it as: xvfb-run python tk_display.py")
+        return None
+    label = tk.Label(root)
+    label.pack()
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8) for _ in range(8)]
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        photo = ImageTk.PhotoImage(image=Image.fromarray(frames[i % len(frames)]))
+        label.configure(image=photo)
+        label.image = photo
+        root.update()
+    per_frame_new = (time.perf_counter() - start) / iterations
+
+    surface = PhotoSurface(label)
+    start = time.perf_counter()
+    for i in range(iterations):
+        surface.show(frames[i % len(frames)])
+        root.update()
+    per_frame_reuse = (time.perf_counter() - start) / iterations
+
+    root.destroy()
+    print(f"new PhotoImage per frame: {per_frame_new * 1000:.3f} ms/frame")
+    print(f"reused PhotoImage (paste): {per_frame_reuse * 1000:.3f} ms/frame, {surface.stats()}")
+    return per_frame_new, per_frame_reuse
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=300)
+    args = parser.parse_args()
+
+    benchmark(args.iterations)
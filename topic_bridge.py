@@ -0,0 +1,67 @@
+import json
+
+import paho.mqtt.client as mqtt
+
+from frame_codec import FrameFormatError, agent_topic, decode_payload, encode_binary, is_binary, split_by_agent
+
+# Splits the combined topic/data messages published by the current server into per-agent
+# topics (topic/data/<agent_id>), so every client only downloads and parses its own view.
+# Run it next to the broker; the server does not need to change.
+
+
+class TopicBridge:
+    def __init__(self, broker_address, port, data_topic="topic/data"):
+        self.data_topic = data_topic
+        self.messages = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+        self.client = mqtt.Client()
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        print(f"Topic bridge trying to connect to {broker_address} on port {port}")
+        self.client.connect(broker_address, port, 60)
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            print(f"Bridge splitting {self.data_topic} into {agent_topic(self.data_topic, '<agent_id>')}")
+            client.subscribe(self.data_topic)
+        else:
+            print(f"Error al conectar al broker. Código de error: {rc}")
+
+    def on_message(self, client, userdata, message):
+        try:
+            data_dict = decode_payload(message.payload)
+        except (json.JSONDecodeError, FrameFormatError) as e:
+            print(f"Error al decodificar el mensaje: {e}")
+            return
+
+        binary = is_binary(message.payload)
+        self.messages += 1
+        self.bytes_in += len(message.payload)
+        for agent_id, agent_dict in split_by_agent(data_dict):
+            # Keep the publisher's format, JSON entries are forwarded untouched
+            payload = encode_binary(agent_dict) if binary else json.dumps(agent_dict)
+            self.bytes_out += len(payload)
+            client.publish(agent_topic(self.data_topic, agent_id), payload)
+
+    def run(self):
+        try:
+            self.client.loop_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print(f"Bridge forwarded {self.messages} messages, {self.bytes_in} bytes in, {self.bytes_out} bytes out")
+            self.client.disconnect()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--broker", type=str, default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--data_topic", type=str, default="topic/data")
+    args = parser.parse_args()
+
+    TopicBridge(args.broker, args.port, args.data_topic).run()